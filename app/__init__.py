@@ -1,7 +1,9 @@
 from flask import Flask
 from werkzeug.middleware.proxy_fix import ProxyFix # 【追加】これが必要
 from .config import Config
-from .extensions import db, csrf
+from .extensions import db, csrf, timeline_cache, post_limiter, write_queue, metrics, assets, embers, snapshots, firekeeper, flood_guard, profiler
+from .middleware import ClosedHoursMiddleware, AdmissionControlMiddleware
+from .schedule import OpeningSchedule
 
 def create_app():
     # 1. Flaskアプリのインスタンスを作成
@@ -11,31 +13,80 @@ def create_app():
     app.config.from_object(Config)
 
 
+    # 営業時間の表（起動時に1度だけ作る）
+    schedule = OpeningSchedule.from_config(app.config)
+    app.extensions['opening_schedule'] = schedule
+
+    # 混み合っているときは、優先度の低いリクエストを Flask に入る前に 503 で帰す
+    # （休業中のページは軽いので、その内側に置いて数に入れない）
+    app.wsgi_app = AdmissionControlMiddleware(app.wsgi_app, app)
+
+    # 休業時間中の一般客は、Flaskに入る前に描画済みのページで帰ってもらう
+    app.wsgi_app = ClosedHoursMiddleware(app.wsgi_app, app, schedule)
+
 # 【追加】Render（プロキシ環境）対策
     # これがないと、IPアドレスが取れなかったり、httpsへのリダイレクトがおかしくなります
+    # ※一番外側に置き、内側のミドルウェアにも正しいホスト・IPが見えるようにする
     app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
 
-    # 3. 拡張機能（DBやCSRF）をアプリと紐付ける
+    # 3. 拡張機能（DBやCSRF、キャッシュ、連投制限、書き込みキュー、計測）をアプリと紐付ける
     # これにより、extensions.py で作った空の箱に中身が入ります
     db.init_app(app)
     csrf.init_app(app)
+    timeline_cache.init_app(app)
+    post_limiter.init_app(app)
+    write_queue.init_app(app)
+    metrics.init_app(app)
+    assets.init_app(app)
+    embers.init_app(app)
+    snapshots.init_app(app)
+    firekeeper.init_app(app)
+    flood_guard.init_app(app)
+    profiler.init_app(app)
+
+    # 後回しにした投稿がDBに入ったら、タイムラインのキャッシュを捨てる
+    write_queue.after_flush(lambda rows: timeline_cache.bump())
+    # 過去の日時で書かれた投稿があれば、その夜のスナップショットを捨てる
+    write_queue.after_flush(lambda rows: snapshots.invalidate(row.get('created_at') for row in rows))
+    # 夜ごとの集計にも足す
+    from .stats import record_flushed
+    write_queue.after_flush(record_flushed)
 
     # 4. アプリケーションコンテキスト内での処理
     with app.app_context():
         # モデルをインポートしてSQLAlchemyに認識させる
         from . import models
+
+        # 冷たい保管庫の置き場（SQLite なら別ファイルを ATTACH）を用意する
+        from .cold_storage import setup_cold_storage
+        setup_cold_storage()
         
         # テーブルが存在しなければ作成する
         # （これまでは app.py のグローバルスコープでやっていました）
         db.create_all()
 
+        # 既存テーブルに足りない列・インデックスがあれば知らせる（足すのはデプロイ時の `flask upgrade-schema`）
+        from .schema import warn_if_outdated
+        warn_if_outdated(app.logger)
+
+        # 管理者検索用のトライグラム索引を用意する
+        from .search import setup_search_index
+        setup_search_index()
+
         # ※ ここに後ほど「Blueprints（ルート）」の登録処理が入ります
-        from .routes import system, main, post,bot
+        from .routes import system, main, post,bot, admin, api, archive
 
         # Blueprintの登録
         app.register_blueprint(system.bp)
         app.register_blueprint(main.bp)
         app.register_blueprint(post.bp)
-        # app.register_blueprint(bot.bp) # <--- 追加
+        app.register_blueprint(admin.bp)
+        app.register_blueprint(api.bp)
+        app.register_blueprint(archive.bp)
+        app.register_blueprint(bot.bp)
+
+        # 管理用コマンド（flask backfill-aikotoba-hash など）
+        from .commands import register_commands
+        register_commands(app)
 
     return app
\ No newline at end of file
@@ -0,0 +1,166 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+from flask import request, send_file, url_for, abort
+
+try:
+    import brotli
+except ImportError:  # brotli は任意。無ければ gzip だけ作る
+    brotli = None
+
+"""
+静的ファイルの配信（指紋付きファイル名 + 事前圧縮）
+app/static の CSS / JS / 画像を、中身のハッシュ入りの名前（style.3f2a9c1d0e.css）でコピーし、
+gzip（と、brotli が入っていれば br）を事前に作っておきます。
+
+名前が中身で決まるので、/assets/ 配下は「1年キャッシュ・immutable」で返せます。
+テンプレートでは url_for('static', ...) の代わりに asset_url('css/style.css') を使ってください。
+ビルドされていない場合は、今までどおり /static/ のURLを返します。
+
+    flask --app run build-assets
+"""
+
+# 指紋に使うハッシュの長さ
+HASH_LENGTH = 10
+# 事前圧縮する拡張子（画像はもともと圧縮済み）
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt')
+# 1年（秒）
+IMMUTABLE_MAX_AGE = 31536000
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def _fingerprinted(name, digest):
+    root, ext = os.path.splitext(name)
+    return f"{root}.{digest[:HASH_LENGTH]}{ext}"
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def write_precompressed(path, data):
+    """data を path に書き、gzip 版（と、brotli が入っていれば br 版）も並べて置く"""
+    _write_atomic(path, data)
+    _write_atomic(f"{path}.gz", gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        _write_atomic(f"{path}.br", brotli.compress(data, quality=11))
+
+
+def build_assets(source_dir, output_dir):
+    """
+    source_dir 配下を指紋付きの名前で output_dir にコピーし、圧縮版とマニフェストを書く。
+    マニフェスト {元の名前: 指紋付きの名前} を返す
+    """
+    manifest = {}
+    for root, _dirs, files in os.walk(source_dir):
+        for filename in sorted(files):
+            source = os.path.join(root, filename)
+            name = os.path.relpath(source, source_dir).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+
+            hashed = _fingerprinted(name, hashlib.sha256(data).hexdigest())
+            target = os.path.join(output_dir, hashed)
+            manifest[name] = hashed
+            if os.path.exists(target):
+                continue
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if name.endswith(COMPRESSIBLE):
+                write_precompressed(target, data)
+            else:
+                _write_atomic(target, data)
+
+    os.makedirs(output_dir, exist_ok=True)
+    _write_atomic(
+        os.path.join(output_dir, MANIFEST_NAME),
+        json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True).encode('utf-8'),
+    )
+    return manifest
+
+
+def _needs_build(source_dir, manifest_path):
+    """マニフェストが無いか、元ファイルのどれかがマニフェストより新しい"""
+    if not os.path.exists(manifest_path):
+        return True
+    built_at = os.path.getmtime(manifest_path)
+    for root, _dirs, files in os.walk(source_dir):
+        for filename in files:
+            if os.path.getmtime(os.path.join(root, filename)) > built_at:
+                return True
+    return False
+
+
+def send_precompressed(path, cache_control):
+    """
+    path のファイルを返す。隣に .br / .gz があり、ブラウザが受け取れるならそちらを返す（br > gzip）
+    """
+    accepted = request.accept_encodings
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if accepted[candidate] and os.path.isfile(path + suffix):
+            encoding, path = candidate, path + suffix
+            break
+
+    # 圧縮版でも、種類は元のファイル名で決める
+    response = send_file(path, mimetype=mimetype, conditional=True, etag=True)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+class Assets:
+    """Flask拡張の形をとった静的ファイル配信（extensions.py で空の箱を作り init_app で中身を入れる）"""
+
+    def __init__(self, app=None):
+        self.directory = None
+        self.manifest = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('ASSETS_DIR') or os.path.join(app.instance_path, 'assets')
+        if app.config.get('ASSETS_BUILD_ON_START', True) and \
+                _needs_build(app.static_folder, os.path.join(self.directory, MANIFEST_NAME)):
+            try:
+                build_assets(app.static_folder, self.directory)
+            except OSError as e:
+                app.logger.warning(f"asset build skipped: {e}")
+        self.load_manifest()
+
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.serve)
+        app.add_template_global(self.asset_url, 'asset_url')
+        app.extensions['assets'] = self
+
+    def load_manifest(self):
+        path = os.path.join(self.directory, MANIFEST_NAME)
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def asset_url(self, name, **kwargs):
+        """テンプレート用：ビルド済みなら指紋付きのURL、無ければ /static/ のURL"""
+        hashed = self.manifest.get(name)
+        if hashed is None:
+            return url_for('static', filename=name, **kwargs)
+        return url_for('assets', filename=hashed, **kwargs)
+
+    def serve(self, filename):
+        """指紋付きのファイルを返す。ブラウザが受け取れるなら事前圧縮版（br > gzip）を選ぶ"""
+        path = os.path.abspath(os.path.join(self.directory, filename))
+        if not path.startswith(os.path.abspath(self.directory) + os.sep) or filename == MANIFEST_NAME \
+                or not os.path.isfile(path):
+            abort(404)
+
+        return send_precompressed(path, f'public, max-age={IMMUTABLE_MAX_AGE}, immutable')
@@ -0,0 +1,234 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+"""
+公開タイムラインの描画結果キャッシュ
+書き込み・消火・メモ更新のたびに「世代番号」を1つ進め、
+キーに世代番号を含めることで古いキャッシュを一斉に無効化します。
+
+- lru    : プロセス内のLRU（中身はワーカーごと）
+- sqlite : ローカルのSQLiteファイル（gunicornの複数ワーカーで中身も共有）
+- none   : キャッシュしない
+
+世代番号はどの方式でもローカルのSQLiteファイルに置き、ワーカー間で共有します。
+（条件付きGETの検証子にも使うので、ほかのワーカーでの書き込みを見落とすと古いページに 304 を返してしまう）
+"""
+
+
+def _connect_shared(local, path, timeout=5, synchronous='NORMAL'):
+    """
+    スレッドごとに1本の接続（自動コミット・WAL）。
+    fork した先（gunicorn --preload のワーカー）では、親から受け継いだ接続を使わずに開き直す
+    """
+    conn = getattr(local, 'conn', None)
+    if conn is None or getattr(local, 'pid', None) != os.getpid() or getattr(local, 'path', None) != path:
+        conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={synchronous}')
+        local.conn = conn
+        local.pid = os.getpid()
+        local.path = path
+    return conn
+
+
+class SharedGeneration:
+    """世代番号だけをローカルSQLiteファイルで共有する（SQLiteBackend と同じ表を使う）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = _connect_shared(self._local, path)
+        conn.execute('CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        conn.execute("INSERT OR IGNORE INTO cache_meta (name, value) VALUES ('generation', 0)")
+
+    def get(self):
+        row = _connect_shared(self._local, self.path).execute(
+            "SELECT value FROM cache_meta WHERE name = 'generation'"
+        ).fetchone()
+        return row[0] if row else 0
+
+    def bump(self):
+        conn = _connect_shared(self._local, self.path)
+        conn.execute("UPDATE cache_meta SET value = value + 1 WHERE name = 'generation'")
+        return self.get()
+
+
+class LocalGeneration:
+    """プロセス内だけの世代番号（アプリに載せる前の空の箱用）"""
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        return self._value
+
+    def bump(self):
+        with self._lock:
+            self._value += 1
+            return self._value
+
+
+class LRUBackend:
+    """プロセス内LRU。スレッドセーフ。世代番号は generation（SharedGeneration など）から読む"""
+
+    def __init__(self, max_entries=256, generation=None):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = generation or LocalGeneration()
+        self._seen_generation = None
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def get_generation(self):
+        generation = self._generation.get()
+        if generation != self._seen_generation:
+            # ほかのワーカーが進めた場合も、古い世代は二度と参照されないので捨てておく
+            with self._lock:
+                self._data.clear()
+                self._seen_generation = generation
+        return generation
+
+    def bump_generation(self):
+        generation = self._generation.bump()
+        with self._lock:
+            self._data.clear()
+            self._seen_generation = generation
+        return generation
+
+
+class SQLiteBackend:
+    """ローカルSQLiteファイルを使う、ワーカー間で共有できるキャッシュ"""
+
+    def __init__(self, path, max_entries=256):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._setup()
+
+    def _connect(self):
+        return _connect_shared(self._local, self.path)
+
+    def _setup(self):
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache_entries ('
+            ' key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        conn.execute("INSERT OR IGNORE INTO cache_meta (name, value) VALUES ('generation', 0)")
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT value FROM cache_entries WHERE key = ? AND expires_at >= ?', (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl):
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, value, now + ttl),
+        )
+        # 期限切れと上限超過分を掃除（古い順に消す）
+        conn.execute('DELETE FROM cache_entries WHERE expires_at < ?', (now,))
+        conn.execute(
+            'DELETE FROM cache_entries WHERE key NOT IN ('
+            ' SELECT key FROM cache_entries ORDER BY expires_at DESC LIMIT ?)',
+            (self.max_entries,),
+        )
+
+    def get_generation(self):
+        row = self._connect().execute("SELECT value FROM cache_meta WHERE name = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    def bump_generation(self):
+        conn = self._connect()
+        conn.execute("UPDATE cache_meta SET value = value + 1 WHERE name = 'generation'")
+        conn.execute('DELETE FROM cache_entries')
+        return self.get_generation()
+
+
+class NullBackend:
+    """キャッシュ無効時。世代番号だけは数えておく（条件付きGETの検証子に使う）"""
+
+    def __init__(self, generation=None):
+        self._generation = generation or LocalGeneration()
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def get_generation(self):
+        return self._generation.get()
+
+    def bump_generation(self):
+        return self._generation.bump()
+
+
+class TimelineCache:
+    """Flask拡張の形をとったキャッシュ本体（extensions.py で空の箱を作り init_app で中身を入れる）"""
+
+    def __init__(self, app=None):
+        self.backend = NullBackend()
+        self.ttl = 300
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        kind = app.config.get('TIMELINE_CACHE_BACKEND', 'lru')
+        max_entries = app.config.get('TIMELINE_CACHE_MAX_ENTRIES', 256)
+        self.ttl = app.config.get('TIMELINE_CACHE_TTL', 300)
+
+        path = app.config.get('TIMELINE_CACHE_PATH') or os.path.join(app.instance_path, 'timeline_cache.sqlite3')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if kind == 'sqlite':
+            self.backend = SQLiteBackend(path, max_entries=max_entries)
+        elif kind == 'lru':
+            self.backend = LRUBackend(max_entries=max_entries, generation=SharedGeneration(path))
+        else:
+            self.backend = NullBackend(generation=SharedGeneration(path))
+
+        app.extensions['timeline_cache'] = self
+
+    @property
+    def generation(self):
+        return self.backend.get_generation()
+
+    def bump(self):
+        """タイムラインの見た目が変わる操作の後に呼ぶ"""
+        return self.backend.bump_generation()
+
+    def get(self, key, generation):
+        """
+        generation は、行を読む前に1度だけ読んだ世代番号。set にも同じ値を渡すこと
+        （描画中に世代が進んでも、古いデータで描いたページを新しい世代として置かないように）
+        """
+        return self.backend.get(f"{generation}:{key}")
+
+    def set(self, key, value, generation):
+        self.backend.set(f"{generation}:{key}", value, self.ttl)
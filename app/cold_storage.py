@@ -0,0 +1,208 @@
+import json
+import os
+import re
+import zlib
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+from .extensions import db, timeline_cache, snapshots
+from .models import Diary, ArchivedNight
+from .ng_words import normalize_text
+from .search import SearchPage
+from .snapshots import night_bounds
+
+"""
+冷たい保管庫（古い夜のアーカイブ）
+日記のテーブルが大きくなると、最近の夜しか見ないタイムラインでも索引が太り、
+バックアップや VACUUM も重くなります。そこで、終わってから ARCHIVE_AFTER_DAYS 日たった夜は
+夜ごとに1行へまとめて圧縮し、archived_nights（冷たい保管庫）へ移して、diaries からは消します。
+
+- SQLite     : 保管庫は別ファイル（COLD_STORAGE_PATH）を ATTACH して置く。本体のDBは小さいまま
+- PostgreSQL : 保管庫は archive スキーマに置く。diaries 自体も月ごとに分割できる（partitions.py）
+
+移した夜は、移す前に /archive/ のスナップショットを書き出しておくので、一般客はそのまま読めます。
+管理者は保管庫検索（/admin/cold）で本文・種火を探せます（夜ごとに展開して調べるので、新しい夜から順に）。
+消火・再点火が必要になったら `flask restore-night` で diaries に戻してください。
+
+    flask --app run archive-nights
+"""
+
+# 保管庫のスキーマ名（SQLite では ATTACH の別名）
+COLD_SCHEMA = 'archive'
+# 圧縮の強さ（書くのは1夜に1回だけなので、いちばん強く）
+COMPRESS_LEVEL = 9
+
+
+def setup_cold_storage():
+    """保管庫の置き場を用意する。create_all より前に、create_app から呼ぶ"""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        path = current_app.config.get('COLD_STORAGE_PATH') or \
+            os.path.join(current_app.instance_path, 'archive.sqlite3')
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        def attach(dbapi_connection, _record):
+            dbapi_connection.execute(f'ATTACH DATABASE ? AS {COLD_SCHEMA}', (path,))
+
+        if not event.contains(db.engine, 'connect', attach):
+            event.listen(db.engine, 'connect', attach)
+        # ATTACH していない接続が残らないように、作り置きの接続を捨てる
+        db.engine.dispose()
+
+    elif dialect == 'postgresql':
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS {COLD_SCHEMA}'))
+        except DBAPIError as e:
+            current_app.logger.warning(f"cold storage setup skipped: {e}")
+
+
+# --- 日記 <-> 保管用の1行 ---
+
+def _columns():
+    return Diary.__table__.columns
+
+
+def to_record(diary):
+    """日記（全列を読んだもの）を、JSONにできる dict にする"""
+    record = {}
+    for column in _columns():
+        value = getattr(diary, column.key)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        record[column.key] = value
+    return record
+
+
+def from_record(record):
+    """保管用の dict を、INSERT できる dict に戻す（日時は datetime に）"""
+    values = {}
+    for column in _columns():
+        value = record.get(column.key)
+        if value is not None and isinstance(column.type, db.DateTime):
+            value = datetime.fromisoformat(value)
+        values[column.key] = value
+    return values
+
+
+class ColdDiary:
+    """保管庫から読み出した日記。テンプレートからは Diary と同じように属性で読める"""
+
+    def __init__(self, record):
+        self.__dict__.update(from_record(record))
+
+
+def pack(records):
+    lines = '\n'.join(json.dumps(record, ensure_ascii=False, sort_keys=True) for record in records)
+    return zlib.compress(lines.encode('utf-8'), COMPRESS_LEVEL)
+
+
+def unpack(payload):
+    data = zlib.decompress(payload).decode('utf-8')
+    return [json.loads(line) for line in data.splitlines() if line]
+
+
+# --- 移す・戻す ---
+
+def archived_rows(night):
+    """その夜の保管済みの日記（ColdDiary のリスト。保管されていなければ空）"""
+    archived = db.session.get(ArchivedNight, night)
+    if archived is None:
+        return []
+    return [ColdDiary(record) for record in unpack(archived.payload)]
+
+
+def archive_night(night):
+    """
+    その夜の日記を保管庫へ移し、移した件数を返す。
+    すでに保管されている夜なら、残っていた分を足し合わせる。
+    """
+    start, end = night_bounds(night, snapshots.boundary_hour)
+    rows = Diary.admin_query() \
+        .filter(Diary.created_at >= start, Diary.created_at < end) \
+        .order_by(Diary.id).all()
+    if not rows:
+        return 0
+
+    # 一般客向けのページは、diaries から消す前に書き出しておく
+    snapshots.ensure(night)
+
+    records = {row.id: to_record(row) for row in rows}
+    archived = db.session.get(ArchivedNight, night)
+    if archived is None:
+        archived = ArchivedNight(night=night)
+        db.session.add(archived)
+    else:
+        for record in unpack(archived.payload):
+            records.setdefault(record['id'], record)
+
+    ordered = [records[key] for key in sorted(records)]
+    archived.payload = pack(ordered)
+    archived.row_count = len(ordered)
+    archived.archived_at = datetime.now()
+
+    # 読み終えた後に書き込まれた行（IDはそれより大きい）は消さない
+    db.session.query(Diary) \
+        .filter(Diary.created_at >= start, Diary.created_at < end, Diary.id <= rows[-1].id) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    db.session.expunge_all()
+    timeline_cache.bump()
+    return len(rows)
+
+
+def restore_night(night):
+    """保管庫の夜を diaries に戻し、戻した件数を返す（保管庫からは消す）"""
+    archived = db.session.get(ArchivedNight, night)
+    if archived is None:
+        return 0
+
+    values = [from_record(record) for record in unpack(archived.payload)]
+    existing = {
+        diary_id for (diary_id,) in
+        db.session.query(Diary.id).filter(Diary.id.in_([v['id'] for v in values]))
+    } if values else set()
+    values = [v for v in values if v['id'] not in existing]
+    if values:
+        db.session.execute(Diary.__table__.insert(), values)
+    db.session.delete(archived)
+    db.session.commit()
+    timeline_cache.bump()
+    snapshots.invalidate_night(night)
+    return len(values)
+
+
+# --- 管理者の保管庫検索 ---
+
+def search_cold(query_text, page=1, per_page=20):
+    """
+    保管庫の本文・種火の部分一致検索（新しい夜から順に展開して調べる）。
+    「#123」ならIDで探す。1ページ分を SearchPage で返す
+    """
+    page = max(page, 1)
+    skip = (page - 1) * per_page
+    query_text = (query_text or '').strip()
+    id_match = re.fullmatch(r'#(\d+)', query_text)
+    normalized = normalize_text(query_text)
+
+    def matches(record):
+        if id_match:
+            return record['id'] == int(id_match.group(1))
+        return normalized in (record.get('search_text') or '') or query_text in (record.get('aikotoba') or '')
+
+    found = []
+    nights = db.session.query(ArchivedNight.night, ArchivedNight.payload) \
+        .order_by(ArchivedNight.night.desc()).yield_per(10)
+    for _night, payload in nights:
+        hits = [r for r in unpack(payload) if matches(r)]
+        hits.sort(key=lambda r: (r['created_at'], r['id']), reverse=True)
+        for record in hits:
+            if skip:
+                skip -= 1
+                continue
+            found.append(ColdDiary(record))
+        if len(found) > per_page:
+            break
+
+    return SearchPage(found[:per_page], page, len(found) > per_page, {'q': query_text})
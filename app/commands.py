@@ -0,0 +1,385 @@
+import gzip
+import os
+import sys
+from datetime import date, datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from .assets import build_assets
+from .cold_storage import archive_night, restore_night
+from .export import FORMATS, iter_export, read_records, import_records
+from .extensions import db, assets, snapshots, firekeeper, profiler, write_queue
+from .models import Diary, ModerationEvent, ArchivedNight
+from .moderation import split_memo_log
+from . import ng_words
+from .partitions import partition_diaries, drop_empty_partitions
+from .schema import upgrade_schema
+from .snapshots import night_bounds
+from .stats import iter_stat_records, rebuild as rebuild_stats
+from .utils import hash_aikotoba, derive_content_fields
+
+"""
+管理用のコマンド（flask <コマンド名> で実行）
+例: flask --app run backfill-aikotoba-hash
+"""
+
+
+@click.command('upgrade-schema')
+@with_appcontext
+def upgrade_schema_command():
+    """モデル定義にあって実DBに無い列・インデックスを足す（デプロイ時に1度だけ。PostgreSQL では書き込みを止めずに作る）"""
+    count = upgrade_schema(echo=click.echo)
+    if db.session.query(Diary.id).filter(Diary.search_text.is_(None)).limit(1).first() is not None:
+        click.echo("search_text が空の日記があります。`flask backfill-content-fields` で埋めてください")
+    click.echo(f"完了: {count} 件")
+
+
+@click.command('backfill-aikotoba-hash')
+@click.option('--batch-size', default=1000, show_default=True, help='1回のコミットで処理する件数')
+@with_appcontext
+def backfill_aikotoba_hash(batch_size):
+    """種火ハッシュが空の既存日記を埋める"""
+    total = 0
+    while True:
+        rows = db.session.query(Diary.id, Diary.aikotoba) \
+            .filter(Diary.aikotoba_hash.is_(None)) \
+            .order_by(Diary.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        db.session.execute(
+            db.update(Diary),
+            [{'id': row.id, 'aikotoba_hash': hash_aikotoba(row.aikotoba)} for row in rows],
+        )
+        db.session.commit()
+        total += len(rows)
+        click.echo(f"{total} 件の種火ハッシュを埋めました")
+
+    click.echo(f"完了: {total} 件")
+
+
+@click.command('backfill-content-fields')
+@click.option('--batch-size', default=1000, show_default=True, help='1回のコミットで処理する件数')
+@with_appcontext
+def backfill_content_fields(batch_size):
+    """折りたたみ・検索用テキストが空の既存日記を埋める"""
+    total = 0
+    while True:
+        rows = db.session.query(Diary.id, Diary.content) \
+            .filter(Diary.search_text.is_(None)) \
+            .order_by(Diary.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        db.session.execute(
+            db.update(Diary),
+            [dict(derive_content_fields(row.content), id=row.id) for row in rows],
+        )
+        db.session.commit()
+        total += len(rows)
+        click.echo(f"{total} 件の日記を埋めました")
+
+    click.echo(f"完了: {total} 件")
+
+
+@click.command('split-memo-events')
+@click.option('--batch-size', default=500, show_default=True, help='1回のコミットで処理する件数')
+@with_appcontext
+def split_memo_events(batch_size):
+    """admin_memo に追記されていた消火・再点火の記録を、操作履歴テーブルへ移す"""
+    total_rows = 0
+    total_events = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(Diary.id, Diary.admin_memo) \
+            .filter(Diary.id > last_id, Diary.admin_memo.like('%管理操作による%')) \
+            .order_by(Diary.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        events = []
+        memos = []
+        for row in rows:
+            parsed, rest = split_memo_log(row.admin_memo)
+            if not parsed:
+                continue
+            events.extend(
+                {'diary_id': row.id, 'action': action, 'note': note, 'created_at': created_at}
+                for created_at, action, note in parsed
+            )
+            memos.append({'id': row.id, 'admin_memo': rest})
+
+        if events:
+            db.session.execute(db.insert(ModerationEvent), events)
+            db.session.execute(db.update(Diary), memos)
+        db.session.commit()
+        total_rows += len(memos)
+        total_events += len(events)
+        click.echo(f"{total_rows} 件の日記から {total_events} 件の記録を移しました")
+
+    click.echo(f"完了: {total_rows} 件の日記 / {total_events} 件の記録")
+
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """静的ファイルを指紋付きの名前でビルドし、gzip / brotli 版を作る"""
+    manifest = build_assets(current_app.static_folder, assets.directory)
+    assets.load_manifest()
+    for name, hashed in sorted(manifest.items()):
+        click.echo(f"{name} -> {hashed}")
+    click.echo(f"完了: {len(manifest)} ファイル（{assets.directory}）")
+
+
+@click.command('build-snapshots')
+@click.option('--night', 'night_text', default=None, help='この夜だけ書き出す（YYYY-MM-DD）')
+@click.option('--force', is_flag=True, help='書き出し済みの夜も書き直す')
+@with_appcontext
+def build_snapshots(night_text, force):
+    """終わった夜のスナップショット（HTML / JSON）を書き出す"""
+    if night_text:
+        nights = [date.fromisoformat(night_text)]
+    else:
+        oldest = db.session.query(db.func.min(Diary.created_at)).scalar()
+        if oldest is None:
+            click.echo("日記がありません")
+            return
+        last = snapshots.night_of(datetime.now()) - timedelta(days=1)
+        first = snapshots.night_of(oldest)
+        nights = [first + timedelta(days=i) for i in range((last - first).days + 1)]
+
+    built = 0
+    for night in nights:
+        if not snapshots.is_complete(night):
+            click.echo(f"{night}: まだ終わっていない夜です")
+            continue
+        if not force and os.path.exists(snapshots.path_for(night, 'html')):
+            continue
+        count = snapshots.build(night)
+        if count:
+            built += 1
+            click.echo(f"{night}: {count} 件")
+    click.echo(f"完了: {built} 夜（{snapshots.directory}）")
+
+
+@click.command('archive-nights')
+@click.option('--older-than-days', type=int, default=None, help='この日数より前の夜を移す（既定は ARCHIVE_AFTER_DAYS）')
+@click.option('--dry-run', is_flag=True, help='移す夜と件数を数えるだけ')
+@with_appcontext
+def archive_nights(older_than_days, dry_run):
+    """古い夜の日記を冷たい保管庫へ移す（移す前に /archive/ のスナップショットを書き出す）"""
+    if older_than_days is None:
+        older_than_days = current_app.config['ARCHIVE_AFTER_DAYS']
+    cutoff = snapshots.night_of(datetime.now()) - timedelta(days=older_than_days)
+    cutoff_start, _ = night_bounds(cutoff, snapshots.boundary_hour)
+
+    oldest = db.session.query(db.func.min(Diary.created_at)) \
+        .filter(Diary.created_at < cutoff_start).scalar()
+    if oldest is None:
+        click.echo("移す夜はありません")
+        return
+
+    night = snapshots.night_of(oldest)
+    total_nights = 0
+    total_rows = 0
+    while night < cutoff:
+        start, end = night_bounds(night, snapshots.boundary_hour)
+        if dry_run:
+            count = db.session.query(db.func.count(Diary.id)) \
+                .filter(Diary.created_at >= start, Diary.created_at < end).scalar()
+        else:
+            count = archive_night(night)
+        if count:
+            total_nights += 1
+            total_rows += count
+            click.echo(f"{night}: {count} 件")
+        night += timedelta(days=1)
+
+    if not dry_run:
+        # PostgreSQL で月ごとに分割していれば、空になった古い月を消す
+        for name in drop_empty_partitions(cutoff_start):
+            click.echo(f"{name}: 空になったパーティションを消しました")
+    click.echo(f"完了: {total_nights} 夜 / {total_rows} 件{'（数えただけ）' if dry_run else ''}")
+
+
+@click.command('restore-night')
+@click.argument('night_text')
+@with_appcontext
+def restore_night_command(night_text):
+    """冷たい保管庫の夜を diaries に戻す（消火・再点火したいときなど）"""
+    night = date.fromisoformat(night_text)
+    if db.session.get(ArchivedNight, night) is None:
+        click.echo(f"{night}: 保管庫にありません")
+        return
+    count = restore_night(night)
+    click.echo(f"完了: {night} の {count} 件を戻しました")
+
+
+@click.command('partition-diaries')
+@click.option('--months-ahead', type=int, default=None, help='先に作っておく月の数（既定は PARTITION_MONTHS_AHEAD）')
+@with_appcontext
+def partition_diaries_command(months_ahead):
+    """diaries を月ごとに分割する（PostgreSQL のみ。分割済みなら先の月を足す）"""
+    if db.engine.dialect.name != 'postgresql':
+        click.echo("分割は PostgreSQL のみです（SQLite は archive-nights で保管庫ファイルへ移します）")
+        return
+    if months_ahead is None:
+        months_ahead = current_app.config['PARTITION_MONTHS_AHEAD']
+    names = partition_diaries(months_ahead)
+    click.echo(f"完了: {len(names)} 個のパーティション（{names[0]} 〜 {names[-1]}）" if names else "完了")
+
+
+def _open_text(path, mode):
+    """'-' なら標準入出力、.gz で終わるなら gzip として開く"""
+    if path == '-':
+        return sys.stdout if 'w' in mode else sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+@click.command('export-diaries')
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)), default='ndjson', show_default=True)
+@click.option('-o', '--output', default='-', show_default=True, help='書き出し先（.gz なら圧縮。- は標準出力）')
+@click.option('--since', type=click.DateTime(['%Y-%m-%d']), default=None, help='この日以降の投稿（YYYY-MM-DD）')
+@click.option('--until', type=click.DateTime(['%Y-%m-%d']), default=None, help='この日までの投稿（YYYY-MM-DD）')
+@click.option('--hidden/--visible', default=None, help='消火済みだけ / 表示中だけ（指定しなければ両方）')
+@click.option('--ip-hash', default=None, help='この IP Hash の投稿だけ')
+@click.option('--include-archived', is_flag=True, help='冷たい保管庫に移した夜も含める')
+@with_appcontext
+def export_diaries(fmt, output, since, until, hidden, ip_hash, include_archived):
+    """日記を NDJSON / CSV で書き出す（少しずつ読んで書くので、件数が多くてもメモリは一定）"""
+    chunks = iter_export(
+        fmt,
+        since=since.date() if since else None,
+        until=until.date() if until else None,
+        hidden=hidden,
+        ip_hash=ip_hash,
+        include_archived=include_archived,
+    )
+    out = _open_text(output, 'w')
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if output != '-':
+        click.echo(f"完了: {output}")
+
+
+@click.command('import-diaries')
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)), default=None, help='省略時は拡張子で判断')
+@click.option('--batch-size', default=1000, show_default=True, help='1回のコミットで入れる件数')
+@with_appcontext
+def import_diaries(path, fmt, batch_size):
+    """export-diaries の書き出しを読み込む（同じID・同じ uuid の日記があれば飛ばす）"""
+    if fmt is None:
+        fmt = 'csv' if path.removesuffix('.gz').endswith('.csv') else 'ndjson'
+
+    source = _open_text(path, 'r')
+    try:
+        inserted, skipped = import_records(
+            read_records(source, fmt),
+            batch_size=batch_size,
+            on_batch=lambda inserted, skipped: click.echo(f"{inserted} 件を入れました（{skipped} 件は既存）", err=True),
+        )
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    click.echo(f"完了: {inserted} 件（{skipped} 件は既存のため飛ばしました）")
+
+
+@click.command('bot-ignite')
+@click.option('--count', type=click.IntRange(1, 50), default=None, help='灯す数（既定は BOT_BATCH_SIZE）')
+@with_appcontext
+def bot_ignite(count):
+    """火の番のバッチをこの場で1回走らせる（公開は、時刻が来てから Web 側の裏スレッドが行う）"""
+    if not firekeeper.acquire():
+        click.echo("ほかのバッチが走っています", err=True)
+        sys.exit(1)
+    try:
+        result = firekeeper.run_batch(count or firekeeper.batch_size)
+    finally:
+        firekeeper.release()
+    for release_at in result['release_at']:
+        click.echo(f"{release_at} に灯ります")
+    click.echo(f"完了: {result['queued']} 件（安全確認で除外 {result['unsafe']} 件 / 失敗 {result['failed']} 件）")
+
+
+@click.command('rebuild-stats')
+@click.option('--quiet', is_flag=True, help='夜ごとの件数を表示しない')
+@with_appcontext
+def rebuild_stats_command(quiet):
+    """夜ごとの統計を、日記（冷たい保管庫も含む）から数え直す"""
+    nights = rebuild_stats(iter_stat_records(), echo=None if quiet else click.echo)
+    click.echo(f"完了: {nights} 夜ぶんを数え直しました")
+
+
+@click.command('profile-token')
+@click.option('--mode', type=click.Choice(['sample', 'cprofile']), default='sample', show_default=True)
+@with_appcontext
+def profile_token(mode):
+    """X-Profile ヘッダに入れる、署名付きトークンを作る（PROFILE_TOKEN_MAX_AGE 秒有効）"""
+    if not profiler.enabled:
+        click.echo("PROFILER_ENABLED=1 にしてください", err=True)
+        sys.exit(1)
+    click.echo(profiler.make_token(mode))
+
+
+@click.command('add-ng-word')
+@click.argument('words', nargs=-1, required=True)
+@click.option('--category', type=click.Choice(ng_words.CATEGORIES), default='general', show_default=True)
+def add_ng_word(words, category):
+    """NG_WORDS_PATH の追加リストに言葉を足す（書き換えは一瞬で差し替えるので、動いているワーカーにもそのまま効く）"""
+    if not ng_words.NG_WORDS_PATH:
+        click.echo("NG_WORDS_PATH を設定してください", err=True)
+        sys.exit(1)
+    current = {category_name: [] for category_name in ng_words.CATEGORIES}
+    if os.path.exists(ng_words.NG_WORDS_PATH):
+        try:
+            current = ng_words._load_extra_words(ng_words.NG_WORDS_PATH)
+        except (OSError, ValueError) as e:
+            click.echo(f"{ng_words.NG_WORDS_PATH} を読めません: {e}", err=True)
+            sys.exit(1)
+    added = [word for word in words if word not in current[category]]
+    current[category].extend(added)
+    ng_words.save_extra_words(current)
+    click.echo(f"完了: {category} に {len(added)} 語を足しました")
+
+
+@click.command('write-queue-dead')
+@click.option('--requeue', is_flag=True, help='すべてジャーナルに積み直す（原因を直してから）')
+@with_appcontext
+def write_queue_dead(requeue):
+    """書き込みキューで入れられなかった投稿（dead_diaries）を表示する"""
+    if requeue:
+        click.echo(f"完了: {write_queue.requeue_dead()} 件を積み直しました")
+        return
+    rows = write_queue.dead_letters()
+    for seq, row, error, failed_at in rows:
+        click.echo(f"#{seq} {failed_at:%Y-%m-%d %H:%M:%S} {row['uuid']} {(row.get('content') or '')[:30]!r}")
+        click.echo(f"    {error.splitlines()[0] if error else ''}")
+    click.echo(f"{len(rows)} 件")
+
+
+def register_commands(app):
+    """アプリにコマンドを登録する"""
+    app.cli.add_command(upgrade_schema_command)
+    app.cli.add_command(backfill_aikotoba_hash)
+    app.cli.add_command(backfill_content_fields)
+    app.cli.add_command(split_memo_events)
+    app.cli.add_command(build_assets_command)
+    app.cli.add_command(build_snapshots)
+    app.cli.add_command(archive_nights)
+    app.cli.add_command(restore_night_command)
+    app.cli.add_command(partition_diaries_command)
+    app.cli.add_command(export_diaries)
+    app.cli.add_command(import_diaries)
+    app.cli.add_command(bot_ignite)
+    app.cli.add_command(rebuild_stats_command)
+    app.cli.add_command(profile_token)
+    app.cli.add_command(add_ng_word)
+    app.cli.add_command(write_queue_dead)
@@ -21,4 +21,120 @@ class Config:
     SQLALCHEMY_ENGINE_OPTIONS = { "pool_pre_ping": True }
 
     # 管理者キー（環境変数から取得）
-    ADMIN_KEY = os.environ.get('ADMIN_KEY', 'local_secret_open')
\ No newline at end of file
+    ADMIN_KEY = os.environ.get('ADMIN_KEY', 'local_secret_open')
+    # 関係者チケット（環境変数から取得）
+    TICKET_KEY = os.environ.get('TICKET_KEY', 'local_secret_ticket')
+
+    # 営業時間（OPEN_HOUR 時〜翌 CLOSE_HOUR 時）
+    OPEN_HOUR = 19
+    CLOSE_HOUR = 1
+    # 休業中の案内を「深夜」と「昼間」で分ける境目
+    MIDNIGHT_END_HOUR = 6
+    # 営業時間を判定するタイムゾーン（例: 'Asia/Tokyo'）。未指定ならサーバーの現地時刻
+    SITE_TIMEZONE = os.environ.get('SITE_TIMEZONE')
+    # 休業中でも一般客に開けておくパス（前方一致）
+    ALWAYS_OPEN_PATHS = ('/static/', '/assets/', '/manual', '/rules', '/metrics')
+
+    # タイムラインの1ページあたりの件数
+    TIMELINE_PER_PAGE = 10
+
+    # 種火検索を、種火の文字列ではなくハッシュ列（固定長）の一致で引く
+    # 既存の日記は `flask backfill-aikotoba-hash` でハッシュを埋めてから有効にしてください
+    AIKOTOBA_HASH_LOOKUP = os.environ.get('AIKOTOBA_HASH_LOOKUP', '0') == '1'
+
+    # 管理者検索の1ページあたりの件数
+    ADMIN_SEARCH_PER_PAGE = 20
+
+    # 公開タイムラインの描画キャッシュ
+    # 'lru'（中身はプロセス内） / 'sqlite'（中身もgunicornの複数ワーカーで共有） / 'none'
+    # 世代番号（無効化の合図）は、どれでも TIMELINE_CACHE_PATH のファイルでワーカー間に共有する
+    TIMELINE_CACHE_BACKEND = os.environ.get('TIMELINE_CACHE_BACKEND', 'lru')
+    TIMELINE_CACHE_PATH = os.environ.get('TIMELINE_CACHE_PATH')  # 未指定なら instance/ 配下（lru / none でも使う）
+    TIMELINE_CACHE_MAX_ENTRIES = 256
+    TIMELINE_CACHE_TTL = 300  # 秒
+
+    # 連投制限（直近 RATE_LIMIT_WINDOW 秒間に RATE_LIMIT_POSTS 本まで）
+    # 'memory'（ワーカーごと） / 'sqlite'（gunicornの複数ワーカーで共有）
+    RATE_LIMIT_POSTS = int(os.environ.get('RATE_LIMIT_POSTS', 5))
+    RATE_LIMIT_WINDOW = int(os.environ.get('RATE_LIMIT_WINDOW', 3600))
+    RATE_LIMIT_STORAGE = os.environ.get('RATE_LIMIT_STORAGE', 'memory')
+    RATE_LIMIT_PATH = os.environ.get('RATE_LIMIT_PATH')  # 未指定なら instance/ 配下
+
+    # 書き込みの後回し（ライトビハインド）
+    # 有効にすると、投稿はローカルのジャーナルに積まれ、裏でまとめて本番DBに書き込まれます
+    WRITE_BEHIND_ENABLED = os.environ.get('WRITE_BEHIND_ENABLED', '0') == '1'
+    WRITE_QUEUE_PATH = os.environ.get('WRITE_QUEUE_PATH')  # 未指定なら instance/ 配下
+    WRITE_BATCH_SIZE = 50  # この件数たまったらすぐ流す
+    WRITE_FLUSH_INTERVAL = 0.5  # 秒。件数がたまらなくても、この間隔で流す
+
+    # 計測（/metrics で Prometheus 形式）
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    METRICS_DIR = os.environ.get('METRICS_DIR')  # ワーカー間で集約するための置き場。未指定なら instance/ 配下
+    METRICS_FLUSH_INTERVAL = 5  # 秒。各ワーカーが値を書き出す間隔
+    # 管理者セッションが無くても /metrics を読めるトークン（Authorization: Bearer <token>）
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # 静的ファイル（指紋付きファイル名・事前圧縮・1年キャッシュで /assets/ から配信）
+    ASSETS_DIR = os.environ.get('ASSETS_DIR')  # ビルド結果の置き場。未指定なら instance/ 配下
+    # 起動時に、ビルドが無いか古ければ作り直す（デプロイ時に `flask build-assets` するなら '0' に）
+    ASSETS_BUILD_ON_START = os.environ.get('ASSETS_BUILD_ON_START', '1') == '1'
+
+    # 新しい火の差分配信（/api/embers と /api/embers/stream）
+    # SSE は接続を開きっぱなしにするので、gevent などの非同期ワーカーで動かすときだけ '1' に
+    EMBERS_STREAM_ENABLED = os.environ.get('EMBERS_STREAM_ENABLED', '0') == '1'
+    EMBERS_POLL_INTERVAL = 2.0  # 秒。プロセスごとの裏スレッドがDBを見にいく間隔
+    EMBERS_STREAM_MAX_SECONDS = 300  # 1本の接続を保つ最長時間（ブラウザは自動で再接続する）
+    EMBERS_CLIENT_POLL_SECONDS = 30  # SSE が無効のとき、ブラウザが /api/embers を読みにいく間隔
+
+    # 過去の夜のスナップショット（/archive/ で DB に触れずに返す）
+    SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR')  # 未指定なら instance/ 配下
+    SNAPSHOT_MAX_AGE = 600  # 秒。消火で書き直されることがあるので、短めにキャッシュさせる
+
+    # 古い夜の保管（`flask archive-nights` で、ARCHIVE_AFTER_DAYS 日より前の夜を冷たい保管庫へ移す）
+    # 移した夜も /archive/ のスナップショットと、管理者の保管庫検索からは読めます
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 90))
+    COLD_STORAGE_PATH = os.environ.get('COLD_STORAGE_PATH')  # SQLite のとき ATTACH する保管庫ファイル。未指定なら instance/ 配下
+    PARTITION_MONTHS_AHEAD = 3  # PostgreSQL：先に作っておく月ごとのパーティションの数
+
+    # 火の番のボット（/api/bot/ignite で、生成から公開までを裏で行う）
+    BOT_SECRET = os.environ.get('AI_BOT_SECRET')  # X-Bot-Secret ヘッダと照合する
+    # 生成に使う裏方：'gemini' / 'stub'（APIを呼ばない試験用。明示したときだけ） / 'パッケージ.モジュール:クラス'
+    BOT_GENERATOR = os.environ.get('BOT_GENERATOR', 'gemini')
+    GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+    BOT_GEMINI_MODEL = os.environ.get('BOT_GEMINI_MODEL', 'gemini-2.5-flash')
+    BOT_BATCH_SIZE = int(os.environ.get('BOT_BATCH_SIZE', 1))  # 1回の呼び出しで灯す数
+    BOT_CONCURRENCY = 4  # 同時に生成する数
+    BOT_TIMEOUT = 30  # 秒。生成1回あたりの待ち時間の上限
+    BOT_RETRIES = 2  # 失敗したときに生成し直す回数
+    BOT_RELEASE_SPREAD = int(os.environ.get('BOT_RELEASE_SPREAD', 420))  # 秒。この間にばらして公開する
+    BOT_LOCK_PATH = os.environ.get('BOT_LOCK_PATH')  # バッチをワーカーをまたいで1つにするロックファイル。未指定なら instance/ 配下
+
+    # 連投（ほぼ同じ文面の繰り返し）の検知
+    # 'hide'（受け付けて消火しておく） / 'reject'（断る） / 'off'
+    FLOOD_ACTION = os.environ.get('FLOOD_ACTION', 'hide')
+    FLOOD_WINDOW = 86400  # 秒。この間の投稿と比べる
+    FLOOD_SIMILARITY = 0.6  # 2文字ずつの断片の重なり（Jaccard 係数）がこれ以上なら「似ている」
+    FLOOD_MAX_SIMILAR = 2  # 似た投稿がすでにこの件数あれば、連投とみなす
+    FLOOD_MIN_CHARS = 15  # これより短い本文（挨拶など、誰が書いても似るもの）は比べない
+
+    # 混雑時の受け付け制限（19:00 の開店直後など）
+    # しきい値を超えたら、優先度の低いリクエストを DB・テンプレートに触れずに 503 + Retry-After で帰す
+    # （管理者・投稿・ボットの API は断らない）
+    ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', '1') == '1'
+    ADMISSION_MAX_INFLIGHT = int(os.environ.get('ADMISSION_MAX_INFLIGHT', 16))  # ワーカー1つで同時に処理する数の上限
+    ADMISSION_MAX_LATENCY = float(os.environ.get('ADMISSION_MAX_LATENCY', 2.0))  # 秒。応答時間の移動平均の上限
+    # 秒。手前のプロキシが付けた X-Request-Start からの待ち時間の上限（ヘッダが無ければ見ない）
+    ADMISSION_MAX_QUEUE_WAIT = float(os.environ.get('ADMISSION_MAX_QUEUE_WAIT', 3.0))
+    ADMISSION_RETRY_AFTER = 10  # 秒。Retry-After の基本値（一斉に戻ってこないよう、最大2倍までばらす）
+    ADMISSION_EXEMPT_PATHS = ('/static/', '/assets/', '/metrics', '/api/embers/stream')  # 数えも断りもしない
+
+    # 本番のリクエストのプロファイル（'0' のときはフックを登録しないので負担なし）
+    # 管理者の ?_profile=1、署名付きの X-Profile ヘッダ（flask profile-token）、抜き取りで測る
+    PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', '0') == '1'
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')  # 結果の置き場。未指定なら instance/ 配下
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))  # 抜き取る割合（0〜1。管理画面から一時的に変えられる）
+    # 抜き取るエンドポイント（カンマ区切り。空ならすべて）。指名したリクエストはどれでも測る
+    PROFILE_ENDPOINTS = tuple(filter(None, os.environ.get('PROFILE_ENDPOINTS', 'main.index,main.search').split(',')))
+    PROFILE_INTERVAL = 0.005  # 秒。スタックを覗く間隔
+    PROFILE_KEEP = 100  # 残しておく件数
+    PROFILE_TOKEN_MAX_AGE = 3600  # 秒。X-Profile のトークンの有効期限
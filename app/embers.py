@@ -0,0 +1,216 @@
+import json
+import os
+import queue
+import threading
+import time
+from datetime import timedelta
+
+"""
+新しい火（差分）の配信
+- /api/embers        : しおり（最後に見た日記ID・操作記録ID）より新しい分だけをJSONで返す
+- /api/embers/stream : 同じ差分を Server-Sent Events で押し出す
+
+SSE の接続はそれぞれ1本のリクエストを開きっぱなしにするため、
+gunicorn の sync ワーカーでは接続数だけワーカーが埋まってしまいます。
+EMBERS_STREAM_ENABLED は gevent などの非同期ワーカー（gunicorn -k gevent）で動かすときだけ有効にしてください。
+無効のあいだ、ブラウザは /api/embers を間隔をあけて読みにいきます。
+
+DBを見にいくのは、プロセスごとに1本だけの裏スレッド（EmberBroadcaster）です。
+接続が何百本あっても、DBへの問い合わせは EMBERS_POLL_INTERVAL 秒に1回のままです。
+"""
+
+# 1回の応答で返す日記の上限（しばらく離れていた人が一度に受け取りすぎないように）
+MAX_EMBERS = 50
+# SSE の接続で、しおりから追いつくために続けて読むページ数の上限
+CATCH_UP_PAGES = 20
+
+# しおりの日記よりこれ以上前の日時の日記は、新しい火として扱わない（管理者が過去の日時で書いた分など）。
+# 書き込みキューを通ると、IDの順と投稿日時の順は少し入れ違うことがあるので、その分は見逃す
+BACKDATE_GRACE = timedelta(minutes=5)
+
+
+def latest_cursor():
+    """いまの最新のしおり (日記ID, 操作記録ID)"""
+    from .extensions import db
+    from .models import Diary, ModerationEvent
+
+    newest_id = db.session.query(db.func.max(Diary.id)).scalar() or 0
+    newest_event = db.session.query(db.func.max(ModerationEvent.id)).scalar() or 0
+    return newest_id, newest_event
+
+
+def fetch_delta(after_id, after_event, limit=MAX_EMBERS):
+    """
+    しおりより後の変化を dict で返す。
+    - embers : 新しく灯った（表示中の）日記。古い順。しおりの日記より前の日時のものは除く
+    - events : 消火・再点火の記録。消火された日記はブラウザ側で取り除く
+    - cursor : 次に渡すしおり
+    - since  : 渡されたしおり（この差分がどこからの分か）
+    - truncated : 上限で切ったので、cursor から続きがある
+    """
+    from .extensions import db
+    from .models import Diary, ModerationEvent
+
+    query = Diary.timeline_query().filter(Diary.id > after_id, Diary.is_hidden == False)
+    floor = db.session.query(Diary.created_at) \
+        .filter(Diary.id <= after_id).order_by(Diary.id.desc()).limit(1).scalar()
+    if floor is not None:
+        query = query.filter(Diary.created_at >= floor - BACKDATE_GRACE)
+    rows = query.order_by(Diary.id.asc()).limit(limit).all()
+
+    event_limit = limit * 4
+    events = db.session.query(ModerationEvent.id, ModerationEvent.diary_id, ModerationEvent.action) \
+        .filter(ModerationEvent.id > after_event) \
+        .order_by(ModerationEvent.id.asc()).limit(event_limit).all()
+
+    return {
+        'embers': [
+            {
+                'id': row.id,
+                'created_at': row.created_at.isoformat(timespec='seconds'),
+                'content': row.content,
+                'is_long': bool(row.is_long),
+            }
+            for row in rows
+        ],
+        'events': [{'id': e.id, 'diary_id': e.diary_id, 'action': e.action} for e in events],
+        'cursor': {
+            'after': rows[-1].id if rows else after_id,
+            'events_after': events[-1].id if events else after_event,
+        },
+        'since': {'after': after_id, 'events_after': after_event},
+        'truncated': len(rows) >= limit or len(events) >= event_limit,
+    }
+
+
+def catch_up(after_id, after_event, max_pages=CATCH_UP_PAGES):
+    """
+    しおりから、上限で切られないページが返るまで続けて読む（差分を順に返す）。
+    続きをここで読むページの truncated は False にする。max_pages で打ち切った最後のページだけが True のまま
+    """
+    for page in range(max_pages):
+        delta = fetch_delta(after_id, after_event)
+        if not delta['truncated']:
+            yield delta
+            return
+        if page < max_pages - 1:
+            delta['truncated'] = False
+        yield delta
+        after_id, after_event = delta['cursor']['after'], delta['cursor']['events_after']
+
+
+def has_gap(delta, after_id, after_event):
+    """配信係の差分が、この接続のしおりより先から始まっている（間の分を受け取っていない）か"""
+    return delta['since']['after'] > after_id or delta['since']['events_after'] > after_event
+
+
+def format_sse(data, event=None, event_id=None):
+    """Server-Sent Events の1メッセージ"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    for line in json.dumps(data, ensure_ascii=False).splitlines():
+        lines.append(f"data: {line}")
+    return '\n'.join(lines) + '\n\n'
+
+
+class EmberBroadcaster:
+    """
+    Flask拡張の形をとった、プロセスに1つの配信係（extensions.py で空の箱を作り init_app で中身を入れる）。
+    裏スレッドがDBの差分を見つけたら、購読中の全接続のキューに配る。
+    購読者がいなくなると裏スレッドは止まり、次の購読で再び起動する。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.interval = 2.0
+        self.max_queue = 100
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+        self._cursor = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('EMBERS_STREAM_ENABLED', False)
+        self.interval = app.config.get('EMBERS_POLL_INTERVAL', 2.0)
+        app.extensions['embers'] = self
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.max_queue)
+        with self._lock:
+            self._subscribers.add(q)
+            pid = os.getpid()
+            if self._thread is None or not self._thread.is_alive() or self._thread_pid != pid:
+                self._thread = threading.Thread(target=self._run, name='ember-broadcaster', daemon=True)
+                self._thread_pid = pid
+                self._thread.start()
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def _publish(self, delta):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(delta)
+            except queue.Full:
+                # 読めていない接続は切る（ブラウザは自動で再接続し、しおりから取り直す）
+                self.unsubscribe(q)
+                try:
+                    q.get_nowait()
+                    q.put_nowait(None)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    # 次に起動したときは、その時点の最新から見始める
+                    self._thread = None
+                    self._cursor = None
+                    return
+            with self.app.app_context():
+                try:
+                    if self._cursor is None:
+                        self._cursor = latest_cursor()
+                    delta = fetch_delta(*self._cursor)
+                    self._cursor = (delta['cursor']['after'], delta['cursor']['events_after'])
+                    if delta['embers'] or delta['events']:
+                        self._publish(delta)
+                except Exception as e:
+                    self.app.logger.error(f"ember broadcaster failed: {e}")
+                finally:
+                    from .extensions import db
+                    db.session.remove()
+            time.sleep(self.interval)
+
+
+def narrow_delta(delta, after_id, after_event):
+    """配信係が配った差分から、この接続のしおりより後の分だけを取り出す"""
+    embers = [e for e in delta['embers'] if e['id'] > after_id]
+    events = [e for e in delta['events'] if e['id'] > after_event]
+    return {
+        'embers': embers,
+        'events': events,
+        'cursor': {
+            'after': embers[-1]['id'] if embers else after_id,
+            'events_after': events[-1]['id'] if events else after_event,
+        },
+        'since': {'after': after_id, 'events_after': after_event},
+        'truncated': False,
+    }
@@ -0,0 +1,292 @@
+import csv
+import io
+import json
+import uuid
+from datetime import datetime, time, timedelta
+from sqlalchemy import select, insert, text
+from .extensions import db, timeline_cache, snapshots
+from .models import Diary, ArchivedNight
+from .cold_storage import to_record, from_record, unpack
+from .stats import record_posts
+from .utils import hash_aikotoba, derive_content_fields
+
+"""
+日記の書き出し・読み込み（監査・バックアップ・移行用）
+書き出しは、DBのカーソルから少しずつ読んでは書くので、何百万件あってもメモリ使用量は一定です。
+- NDJSON : 1行に1件のJSON（冷たい保管庫と同じ形）
+- CSV    : 1行目が列名。日時は ISO 8601、真偽は 1 / 0、空欄は NULL
+           表計算ソフトで式として実行されないよう、= + - @ などで始まる文字列は先頭に ' を付けます
+           （' で始まる文字列にも付けるので、読み込み時に先頭の ' を1つ外せば元に戻ります）
+
+    flask --app run export-diaries --format csv --since 2025-01-01 -o audit.csv.gz
+    flask --app run import-diaries backup.ndjson.gz
+
+読み込みは、同じID・同じ uuid の日記がすでにあれば飛ばします（何度流しても同じ結果）。
+PostgreSQL では COPY、それ以外ではまとめての INSERT（executemany）で入れます。
+"""
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+# カーソルから1度に受け取る件数
+FETCH_SIZE = 1000
+
+# CSV で先頭に ' を付ける文字（表計算ソフトが式・DDEとして扱うもの。' 自体は元に戻すため）
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r', "'")
+
+
+def _columns():
+    return list(Diary.__table__.columns)
+
+
+def _conditions(since=None, until=None, hidden=None, ip_hash=None):
+    """絞り込み条件（since / until は投稿日の date。until の日も含む）"""
+    table = Diary.__table__
+    conditions = []
+    if since is not None:
+        conditions.append(table.c.created_at >= datetime.combine(since, time()))
+    if until is not None:
+        conditions.append(table.c.created_at < datetime.combine(until + timedelta(days=1), time()))
+    if hidden is not None:
+        conditions.append(table.c.is_hidden.is_(hidden))
+    if ip_hash:
+        conditions.append(table.c.ip_hash == ip_hash)
+    return conditions
+
+
+def _record_matches(record, since=None, until=None, hidden=None, ip_hash=None):
+    """保管庫の1件が絞り込み条件に合うか（_conditions と同じ意味）"""
+    created_at = datetime.fromisoformat(record['created_at']) if record.get('created_at') else None
+    if since is not None and (created_at is None or created_at.date() < since):
+        return False
+    if until is not None and (created_at is None or created_at.date() > until):
+        return False
+    if hidden is not None and bool(record.get('is_hidden')) != hidden:
+        return False
+    if ip_hash and record.get('ip_hash') != ip_hash:
+        return False
+    return True
+
+
+def iter_records(since=None, until=None, hidden=None, ip_hash=None, include_archived=False):
+    """
+    条件に合う日記を dict で1件ずつ返す（ID順）。
+    include_archived なら、冷たい保管庫に移した夜（古い分）を先に返す
+    """
+    if include_archived:
+        nights = db.session.query(ArchivedNight.night, ArchivedNight.payload).order_by(ArchivedNight.night)
+        if since is not None:
+            nights = nights.filter(ArchivedNight.night >= since - timedelta(days=1))
+        if until is not None:
+            nights = nights.filter(ArchivedNight.night <= until)
+        for _night, payload in nights.yield_per(1):
+            for record in unpack(payload):
+                if _record_matches(record, since, until, hidden, ip_hash):
+                    yield record
+
+    table = Diary.__table__
+    statement = select(table).where(*_conditions(since, until, hidden, ip_hash)).order_by(table.c.id)
+    # サーバー側カーソルで、FETCH_SIZE 件ずつ受け取る（全件をメモリに載せない）
+    rows = db.session.execute(statement.execution_options(stream_results=True, yield_per=FETCH_SIZE))
+    for row in rows:
+        yield to_record(row)
+
+
+def iter_ndjson(records):
+    """dict の列を NDJSON の文字列片にする（FETCH_SIZE 件ずつまとめて返す）"""
+    chunk = []
+    for record in records:
+        chunk.append(json.dumps(record, ensure_ascii=False) + '\n')
+        if len(chunk) >= FETCH_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _to_csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return value
+
+
+def _escape_formula(value):
+    """表計算ソフトで開いたときに式として実行されないよう、先頭に ' を付ける"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _unescape_formula(value):
+    return value[1:] if value.startswith("'") else value
+
+
+def iter_csv(records):
+    """dict の列を CSV の文字列片にする（1行目は列名。FETCH_SIZE 件ずつまとめて返す）"""
+    names = [column.key for column in _columns()]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    count = 0
+    for record in records:
+        writer.writerow([_escape_formula(_to_csv_value(record.get(name))) for name in names])
+        count += 1
+        if count % FETCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_export(fmt, **filters):
+    records = iter_records(**filters)
+    return iter_csv(records) if fmt == 'csv' else iter_ndjson(records)
+
+
+# --- 読み込み ---
+
+def _from_csv_row(row):
+    """CSV の1行（すべて文字列）を、NDJSON と同じ型の dict にする"""
+    record = {}
+    for column in _columns():
+        value = row.get(column.key)
+        if value is None or value == '':
+            record[column.key] = None
+        elif isinstance(column.type, db.Boolean):
+            record[column.key] = value in ('1', 'true', 'True')
+        elif isinstance(column.type, db.Integer):
+            record[column.key] = int(value)
+        else:
+            record[column.key] = _unescape_formula(value)
+    return record
+
+
+def read_records(stream, fmt):
+    """テキストのストリームから dict を1件ずつ読む"""
+    if fmt == 'csv':
+        for row in csv.DictReader(stream):
+            yield _from_csv_row(row)
+        return
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def _complete(values):
+    """古い書き出しに無い列（導出値・ハッシュ・uuid）を埋める"""
+    if values.get('search_text') is None and values.get('content') is not None:
+        values.update(derive_content_fields(values['content']))
+    if values.get('aikotoba_hash') is None and values.get('aikotoba') is not None:
+        values['aikotoba_hash'] = hash_aikotoba(values['aikotoba'])
+    if values.get('uuid') is None:
+        values['uuid'] = str(uuid.uuid4())
+    if values.get('created_at') is None:
+        values['created_at'] = datetime.now()
+    if values.get('updated_at') is None:
+        values['updated_at'] = values['created_at']
+    if values.get('is_hidden') is None:
+        values['is_hidden'] = False
+    return values
+
+
+def _copy_rows(batch):
+    """PostgreSQL の COPY で流し込む。COPY が使えないドライバなら False"""
+    names = [column.key for column in _columns()]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for values in batch:
+        writer.writerow([
+            r'\N' if values[name] is None else _to_csv_value(values[name])
+            for name in names
+        ])
+    buffer.seek(0)
+
+    cursor = db.session.connection().connection.cursor()
+    statement = f"COPY diaries ({', '.join(names)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    try:
+        if hasattr(cursor, 'copy_expert'):  # psycopg2
+            cursor.copy_expert(statement, buffer)
+        elif hasattr(cursor, 'copy'):  # psycopg 3
+            with cursor.copy(statement) as copy:
+                copy.write(buffer.getvalue())
+        else:
+            return False
+    finally:
+        cursor.close()
+    return True
+
+
+def import_records(records, batch_size=1000, on_batch=None):
+    """
+    dict の列を diaries に入れ、(入れた件数, 飛ばした件数) を返す。
+    同じID・同じ uuid がすでにあれば（同じ読み込みの中で重なった場合も）飛ばす。
+    batch_size 件ごとにコミットし、on_batch(入れた件数, 飛ばした件数) を呼ぶ
+    """
+    use_copy = db.engine.dialect.name == 'postgresql'
+    inserted = skipped = 0
+    nights = set()
+
+    def flush(batch):
+        nonlocal inserted, skipped
+        ids = [values['id'] for values in batch if values.get('id') is not None]
+        uuids = [values['uuid'] for values in batch]
+        existing_ids = {
+            diary_id for (diary_id,) in db.session.query(Diary.id).filter(Diary.id.in_(ids))
+        } if ids else set()
+        # uuid は外に出しているIDなので、IDが違っても同じ uuid の日記は入れない
+        existing_uuids = {
+            diary_uuid for (diary_uuid,) in db.session.query(Diary.uuid).filter(Diary.uuid.in_(uuids))
+        }
+        fresh = []
+        for values in batch:
+            if values.get('id') in existing_ids or values['uuid'] in existing_uuids:
+                continue
+            fresh.append(values)
+            if values.get('id') is not None:
+                existing_ids.add(values['id'])
+            existing_uuids.add(values['uuid'])
+        skipped += len(batch) - len(fresh)
+        if fresh:
+            # 列をそろえる（executemany は全行が同じ列を持つ必要がある）
+            names = [column.key for column in _columns()]
+            with_id = [{name: values.get(name) for name in names} for values in fresh if values.get('id') is not None]
+            # IDの無い行は、IDを振らせる
+            without_id = [{name: values.get(name) for name in names if name != 'id'}
+                          for values in fresh if values.get('id') is None]
+            if with_id and not (use_copy and _copy_rows(with_id)):
+                db.session.execute(insert(Diary.__table__), with_id)
+            if without_id:
+                db.session.execute(insert(Diary.__table__), without_id)
+            nights.update(snapshots.night_of(values['created_at']) for values in fresh)
+            record_posts(fresh)
+        db.session.commit()
+        inserted += len(fresh)
+        if on_batch is not None:
+            on_batch(inserted, skipped)
+
+    batch = []
+    for record in records:
+        batch.append(_complete(from_record(record)))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    if inserted:
+        if db.engine.dialect.name == 'postgresql':
+            # IDを指定して入れた分、シーケンスを追いつかせる
+            db.session.execute(text(
+                "SELECT setval(pg_get_serial_sequence('diaries', 'id'), (SELECT max(id) FROM diaries))"
+            ))
+            db.session.commit()
+        timeline_cache.bump()
+        for night in nights:
+            if snapshots.is_complete(night):
+                snapshots.invalidate_night(night)
+    return inserted, skipped
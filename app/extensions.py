@@ -1,6 +1,26 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_wtf.csrf import CSRFProtect
+from .cache import TimelineCache
+from .rate_limit import SlidingWindowLimiter
+from .write_queue import WriteQueue
+from .metrics import Metrics
+from .assets import Assets
+from .embers import EmberBroadcaster
+from .snapshots import NightSnapshots
+from .firekeeper import FireKeeper
+from .flood import FloodDetector
+from .profiling import RequestProfiler
 
 # アプリ本体とは紐付けずに、空のインスタンスを作っておきます
 db = SQLAlchemy()
-csrf = CSRFProtect()
\ No newline at end of file
+csrf = CSRFProtect()
+timeline_cache = TimelineCache()
+post_limiter = SlidingWindowLimiter()
+write_queue = WriteQueue()
+metrics = Metrics()
+assets = Assets()
+embers = EmberBroadcaster()
+snapshots = NightSnapshots()
+firekeeper = FireKeeper()
+flood_guard = FloodDetector()
+profiler = RequestProfiler()
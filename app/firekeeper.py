@@ -0,0 +1,335 @@
+import importlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows では、ワーカーをまたいだ排他はできない（同じプロセスの中だけ）
+    fcntl = None
+
+try:
+    import google.generativeai as genai
+except ImportError:  # Gemini を使わない環境（stub で試すときなど）では入っていなくてよい
+    genai = None
+
+"""
+火の番のボット（AI FireKeeper）
+以前は /api/bot/ignite のリクエストの中で Gemini を呼んでいたため、
+生成を待つ間 gunicorn のワーカーが1つふさがり、1回の呼び出しで1件しか灯せませんでした。
+
+いまは次の流れを裏で行い、/api/bot/ignite はすぐに 202 を返します。
+1. 生成：BOT_BATCH_SIZE 件を、BOT_CONCURRENCY 本のスレッドで同時に作る（失敗・時間切れは BOT_RETRIES 回まで作り直す）
+2. 確認：本文・種火を check_text_safety にかけ、通らないものは捨てる
+3. 公開：残りをまとめて書き込みキューのジャーナルに積む。公開時刻は BOT_RELEASE_SPREAD 秒の間にばらす
+   （時刻が来た分から、裏スレッドが本番DBへ流す）
+
+生成の裏方は BOT_GENERATOR で差し替えられます。'stub' はAPIを呼ばずに文例から返す試験用で、
+明示的に指定したときだけ使います（鍵が無いまま本番で文例が灯らないように）。
+
+同時に走るバッチは、ホスト全体で1つだけです（BOT_LOCK_PATH のファイルロック）。
+cron の呼び出しが別々の gunicorn ワーカーに届いても、後から来た方は 409 で断ります。
+"""
+
+SYSTEM_PROMPT = """
+あなたは「夜焚き火」という静かな日記共有サイトの住人です。
+以下の制約を守り、架空の日記（薪）と合言葉（種火）を1つ生成してください。
+
+【制約】
+1. 出力は必ず JSON形式 {"content": "...", "aikotoba": "..."} で行うこと。余計なmarkdown装飾は不要。
+2. 日記の内容（content）:
+   - 20文字〜80文字程度の短い独り言。
+   - 日常生活であったこと、楽しかったこと、悲しかったこと、美味しかった食べ物、日々の疲れ、など雑多な独り言。
+   - 無理に詩的にせず、素朴な書き方で。
+   - 誰かに語りかける必要はない。独り言のように。
+   - AIであることを明かしてはいけない。
+   - 攻撃的、政治的、公序良俗に反する内容は禁止。
+3. 合言葉（aikotoba）:
+   - 英数字のランダムな羅列ではなく、意味のある単語やフレーズを入れる（例: "雨の匂い", "midnight_blue", "1998年の夏"など）。
+   - 日本語でも英語でも可。
+
+【出力例】
+{"content": "コンビニの帰り道、月がやけに綺麗で立ち止まった。アイスが溶けるのも忘れて見上げていた。", "aikotoba": "MeltingIce"}
+"""
+
+# ボットの投稿の IP Hash のもとにする固定値
+BOT_IP_LABEL = 'AI_FIRE_KEEPER_BOT'
+BOT_USER_AGENT = 'Yotakibi AI FireKeeper/1.0'
+
+# 作り直すまでの待ち時間（秒）。回数ごとに倍にする
+RETRY_BACKOFF = 1.0
+
+
+class GenerationError(Exception):
+    """生成に失敗した（形式の誤り・設定不足など）"""
+
+
+def parse_generated(text):
+    """生成結果の JSON から {'content', 'aikotoba'} を取り出す"""
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError) as e:
+        raise GenerationError(f"JSON として読めません: {e}")
+    content = (data.get('content') or '').strip() if isinstance(data, dict) else ''
+    aikotoba = (data.get('aikotoba') or '').strip() if isinstance(data, dict) else ''
+    if not content or not aikotoba:
+        raise GenerationError("'content' か 'aikotoba' がありません")
+    return {'content': content, 'aikotoba': aikotoba[:50]}
+
+
+class StubGenerator:
+    """試験用：APIを呼ばず、文例から1つ選んで返す"""
+
+    SAMPLES = (
+        ('コンビニの帰り道、月がやけに綺麗で立ち止まった。アイスが溶けるのも忘れて見上げていた。', 'MeltingIce'),
+        ('今日は洗濯物を取り込み忘れた。夜風で乾いたことにしておく。', '夜干し'),
+        ('久しぶりに湯船に浸かった。それだけで一日がまるく収まった気がする。', '柚子の湯'),
+        ('駅前のたい焼き屋が閉まっていた。明日こそ。', '明日のしっぽ'),
+        ('帰りの電車で寝過ごして、知らない駅のホームで缶コーヒーを飲んだ。', '終点の灯り'),
+    )
+
+    def __init__(self, app):
+        self._random = random.Random()
+
+    def generate(self, timeout):
+        content, aikotoba = self._random.choice(self.SAMPLES)
+        return {'content': content, 'aikotoba': aikotoba}
+
+
+class GeminiGenerator:
+    """Gemini（google-generativeai）で生成する"""
+
+    def __init__(self, app):
+        if genai is None:
+            raise GenerationError("google-generativeai が入っていません")
+        api_key = app.config.get('GEMINI_API_KEY')
+        if not api_key:
+            raise GenerationError("GEMINI_API_KEY が設定されていません")
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(app.config.get('BOT_GEMINI_MODEL', 'gemini-2.5-flash'))
+
+    def generate(self, timeout):
+        response = self.model.generate_content(
+            contents=SYSTEM_PROMPT,
+            generation_config={"response_mime_type": "application/json"},
+            request_options={"timeout": timeout},
+        )
+        return parse_generated(response.text)
+
+
+GENERATORS = {
+    'stub': StubGenerator,
+    'gemini': GeminiGenerator,
+}
+
+
+def load_generator(name, app):
+    """BOT_GENERATOR の名前（または 'モジュール:クラス'）から裏方を作る"""
+    if name in GENERATORS:
+        factory = GENERATORS[name]
+    else:
+        module_name, _, attr = name.partition(':')
+        if not attr:
+            raise GenerationError(f"生成の裏方が見つかりません: {name}")
+        factory = getattr(importlib.import_module(module_name), attr)
+    return factory(app)
+
+
+def release_times(count, spread, start=None):
+    """count 件の公開時刻（UNIX時刻）を、spread 秒の間にばらして返す（古い順）"""
+    start = time.time() if start is None else start
+    if count <= 0:
+        return []
+    step = spread / count
+    return [start + step * (i + random.random()) for i in range(count)]
+
+
+class FireKeeper:
+    """
+    Flask拡張の形をとった火の番のボット（extensions.py で空の箱を作り init_app で中身を入れる）。
+    生成はプロセスごとのスレッドプールで行い、同時に走るバッチは（ワーカーをまたいで）1つだけ。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.batch_size = 1
+        self.concurrency = 4
+        self.timeout = 30
+        self.retries = 2
+        self.release_spread = 420
+        self._generator = None
+        self._executor = None
+        self._executor_pid = None
+        self._busy = threading.Lock()
+        self.lock_path = None
+        self._lock_file = None
+        self.last_result = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config.get('BOT_BATCH_SIZE', 1)
+        self.concurrency = app.config.get('BOT_CONCURRENCY', 4)
+        self.timeout = app.config.get('BOT_TIMEOUT', 30)
+        self.retries = app.config.get('BOT_RETRIES', 2)
+        self.release_spread = app.config.get('BOT_RELEASE_SPREAD', 420)
+        self.lock_path = app.config.get('BOT_LOCK_PATH') or os.path.join(app.instance_path, 'firekeeper.lock')
+        app.extensions['firekeeper'] = self
+
+    @property
+    def generator(self):
+        # Gemini の準備は、最初に灯すときまで遅らせる
+        if self._generator is None:
+            self._generator = load_generator(self.app.config.get('BOT_GENERATOR', 'gemini'), self.app)
+        return self._generator
+
+    def _pool(self):
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='firekeeper')
+            self._executor_pid = pid
+        return self._executor
+
+    # --- 呼び出し口 ---
+
+    @property
+    def busy(self):
+        return self._busy.locked()
+
+    def acquire(self):
+        """バッチを走らせる権利をとる（このプロセス・ほかのワーカーで走っていれば False）"""
+        if not self._busy.acquire(blocking=False):
+            return False
+        if fcntl is None:
+            return True
+        try:
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+            lock_file = open(self.lock_path, 'a')
+        except OSError:
+            self._busy.release()
+            raise
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            self._busy.release()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def release(self):
+        lock_file, self._lock_file = self._lock_file, None
+        if lock_file is not None:
+            # 閉じればロックも外れる
+            lock_file.close()
+        self._busy.release()
+
+    def ignite(self, count=None):
+        """バッチを裏で始める。すでに走っていれば何もせず False"""
+        if not self.acquire():
+            return False
+        thread = threading.Thread(
+            target=self._run_in_background, args=(count or self.batch_size,),
+            name='firekeeper-batch', daemon=True,
+        )
+        try:
+            thread.start()
+        except RuntimeError:
+            self.release()
+            raise
+        return True
+
+    def _run_in_background(self, count):
+        try:
+            with self.app.app_context():
+                try:
+                    self.run_batch(count)
+                except Exception as e:
+                    self.app.logger.error(f"firekeeper batch failed: {e}")
+                finally:
+                    from .extensions import db
+                    db.session.remove()
+        finally:
+            self.release()
+
+    # --- 1バッチ ---
+
+    def _generate_with_retry(self, generator):
+        last_error = None
+        for attempt in range(self.retries + 1):
+            try:
+                return generator.generate(self.timeout)
+            except Exception as e:
+                last_error = e
+                if attempt < self.retries:
+                    time.sleep(RETRY_BACKOFF * (2 ** attempt) + random.random())
+        raise last_error
+
+    def run_batch(self, count):
+        """
+        count 件を同時に生成し、安全確認を通った分を時間をずらしてジャーナルに積む（app context 内で呼ぶ）。
+        結果の集計 dict を返す
+        """
+        from .extensions import write_queue, metrics
+        from .ng_words import check_text_safety
+        from .utils import get_ip_hash, derive_content_fields
+
+        result = {'requested': count, 'queued': 0, 'unsafe': 0, 'failed': 0, 'release_at': []}
+        # 裏方の準備（設定不足ならここで失敗させる）
+        generator = self.generator
+        futures = [self._pool().submit(self._generate_with_retry, generator) for _ in range(count)]
+
+        # 1件ごとの作り直しと待ち時間を見込んだ締め切り。過ぎたものは諦める（スレッドは裏で終わる）
+        deadline = time.monotonic() + self.timeout * (self.retries + 1) + RETRY_BACKOFF * 2 ** (self.retries + 1)
+        generated = []
+        for future in futures:
+            try:
+                generated.append(future.result(timeout=max(deadline - time.monotonic(), 0)))
+            except FutureTimeout:
+                future.cancel()
+                result['failed'] += 1
+                self.app.logger.warning("firekeeper generation timed out")
+            except Exception as e:
+                result['failed'] += 1
+                self.app.logger.warning(f"firekeeper generation failed: {e}")
+
+        safe = []
+        for item in generated:
+            ok_content, _ = check_text_safety(item['content'])
+            ok_aikotoba, _ = check_text_safety(item['aikotoba'], check_reserved=True)
+            if ok_content and ok_aikotoba:
+                safe.append(item)
+            else:
+                result['unsafe'] += 1
+                self.app.logger.warning(f"firekeeper unsafe content dropped: {item['content']}")
+
+        if safe:
+            release_ats = release_times(len(safe), self.release_spread)
+            ip_hash = get_ip_hash(BOT_IP_LABEL)
+            rows = [
+                dict(
+                    content=item['content'],
+                    aikotoba=item['aikotoba'],
+                    # 公開された時刻に灯ったことにする
+                    created_at=datetime.fromtimestamp(release_at),
+                    ip_hash=ip_hash,
+                    user_agent=BOT_USER_AGENT,
+                    is_hidden=False,
+                    **derive_content_fields(item['content'])
+                )
+                for item, release_at in zip(safe, release_ats)
+            ]
+            write_queue.enqueue_many(rows, release_ats)
+            result['queued'] = len(rows)
+            result['release_at'] = [datetime.fromtimestamp(t).isoformat(timespec='seconds') for t in release_ats]
+
+        for outcome in ('queued', 'unsafe', 'failed'):
+            if result[outcome]:
+                metrics.registry.inc('yotakibi_bot_posts_total', {'outcome': outcome}, result[outcome])
+        self.last_result = dict(result, finished_at=datetime.now().isoformat(timespec='seconds'))
+        return result
@@ -0,0 +1,250 @@
+import os
+import re
+from hashlib import blake2b
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+from .ng_words import normalize_text
+
+"""
+連投（ほぼ同じ文面の繰り返し）の検知
+IPごとの回数制限（rate_limit.py）は、プロキシを替えながらの連投や、
+少しずつ書き換えたコピペの連投をすり抜けられてしまいます。
+そこで直近 FLOOD_WINDOW 秒の投稿の「文面の指紋」をメモリに持ち、新しい投稿と似たものを探します。
+
+- 指紋：正規化した本文を2文字ずつの断片（シングル）に分け、MinHash の署名を作る
+  （ハッシュは断片ごとに1回だけ。BINS 個の箱に振り分けて箱ごとの最小値をとる one permutation hashing）
+  ハッシュには組み込みの hash() ではなく blake2b を使う（hash() はプロセスごとに種が変わり、
+  ワーカーや再起動のたびに判定が揺れてしまうため）
+- 索引：署名を BANDS 本の帯に分け、帯ごとの辞書に入れる（LSH）。どれかの帯が一致した投稿だけを候補にする
+- 判定：候補との実際の重なり（Jaccard 係数）が FLOOD_SIMILARITY 以上なら「似ている」。
+  似た投稿がすでに FLOOD_MAX_SIMILAR 件あれば連投とみなす
+
+索引はワーカーごとに持ち、起動後の最初の判定で直近の投稿をDBから読み込みます。
+その後は判定のたびに、ほかのワーカーが入れた分（IDが進んだ分）だけを読み足します。
+"""
+
+# 断片の長さ（日本語は1文字の書き換えで消える断片が少ないよう、2文字に）
+SHINGLE = 2
+# 署名の長さ = 帯の数 × 1本の帯の行数
+# 似ている度合い 0.6 の組が候補に上がる確率は約 0.6（1組あたり）。連投は何件も似たものがあるので取りこぼさない
+BANDS = 7
+ROWS = 4
+BINS = BANDS * ROWS
+# 照合の前に取り除く文字（空白・記号。水増しの区切りに使われやすい）
+_NOISE = re.compile(r'[\W_]+')
+# 起動時・追いつき時に1回で読む件数
+SYNC_BATCH = 2000
+
+Match = namedtuple('Match', ['diary_id', 'key', 'similarity'])
+
+
+def clean(text):
+    """照合用の文字列：正規化してから空白・記号を落とす"""
+    return _NOISE.sub('', normalize_text(text or ''))
+
+
+def shingles(cleaned):
+    if len(cleaned) <= SHINGLE:
+        return frozenset([cleaned]) if cleaned else frozenset()
+    return frozenset(cleaned[i:i + SHINGLE] for i in range(len(cleaned) - SHINGLE + 1))
+
+
+def _piece_hash(piece):
+    """断片の64ビットハッシュ（プロセスをまたいで同じ値になる）"""
+    return int.from_bytes(blake2b(piece.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def signature(pieces):
+    """断片の集合から MinHash の署名（BINS 個）を作る。空の箱は右隣の箱の値で埋める"""
+    bins = [None] * BINS
+    for piece in pieces:
+        h = _piece_hash(piece)
+        index = h % BINS
+        value = h // BINS
+        if bins[index] is None or value < bins[index]:
+            bins[index] = value
+
+    filled = [i for i, value in enumerate(bins) if value is not None]
+    if not filled:
+        return None
+    if len(filled) < BINS:
+        for i in range(BINS):
+            if bins[i] is None:
+                # 次に埋まっている箱（一周する）と、その距離
+                j = next((k for k in filled if k > i), filled[0])
+                bins[i] = (bins[j], (j - i) % BINS)
+    return bins
+
+
+def band_keys(sig):
+    return [(band, tuple(sig[band * ROWS:(band + 1) * ROWS])) for band in range(BANDS)]
+
+
+class FloodVerdict:
+    """判定結果。matches は似ていた投稿（似ている順）"""
+
+    def __init__(self, matches=(), is_flood=False):
+        self.matches = list(matches)
+        self.is_flood = is_flood
+
+    def describe(self, limit=3):
+        """管理者向けの説明（admin_memo・ログ用）"""
+        if not self.matches:
+            return ''
+        refs = ', '.join(
+            f"#{m.diary_id}" if m.diary_id else '(反映待ち)'
+            for m in self.matches[:limit]
+        )
+        more = f" ほか{len(self.matches) - limit}件" if len(self.matches) > limit else ''
+        return f"連投検知: {refs}{more} と類似（最大 {self.matches[0].similarity:.2f}）"
+
+
+_Entry = namedtuple('_Entry', ['key', 'diary_id', 'timestamp', 'shingles', 'bands'])
+
+
+class FloodDetector:
+    """Flask拡張の形をとった連投検知（extensions.py で空の箱を作り init_app で中身を入れる）"""
+
+    def __init__(self, app=None):
+        self.action = 'off'
+        self.window = 86400
+        self.similarity = 0.6
+        self.max_similar = 2
+        self.min_chars = 15
+        self._lock = threading.Lock()
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.action = app.config.get('FLOOD_ACTION', 'hide')
+        self.window = app.config.get('FLOOD_WINDOW', 86400)
+        self.similarity = app.config.get('FLOOD_SIMILARITY', 0.6)
+        self.max_similar = app.config.get('FLOOD_MAX_SIMILAR', 2)
+        self.min_chars = app.config.get('FLOOD_MIN_CHARS', 15)
+        app.extensions['flood'] = self
+
+    @property
+    def enabled(self):
+        return self.action in ('hide', 'reject')
+
+    def _reset(self):
+        self._entries = {}
+        self._order = deque()
+        self._buckets = {}
+        self._last_id = None
+        self._pid = os.getpid()
+
+    # --- 索引の出し入れ（ロックの中で呼ぶ） ---
+
+    def _insert(self, key, diary_id, timestamp, pieces):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.diary_id is None and diary_id is not None:
+                # このワーカーが先に入れていた分に、DBで振られたIDを書き足す
+                self._entries[key] = entry._replace(diary_id=diary_id)
+            return
+        sig = signature(pieces)
+        if sig is None:
+            return
+        entry = _Entry(key, diary_id, timestamp, pieces, band_keys(sig))
+        self._entries[key] = entry
+        self._order.append(entry)
+        for band in entry.bands:
+            self._buckets.setdefault(band, set()).add(key)
+
+    def _evict(self, now):
+        limit = now - self.window
+        while self._order and self._order[0].timestamp < limit:
+            entry = self._order.popleft()
+            current = self._entries.get(entry.key)
+            if current is None or current.timestamp != entry.timestamp:
+                continue
+            self._entries.pop(entry.key, None)
+            for band in entry.bands:
+                bucket = self._buckets.get(band)
+                if bucket is not None:
+                    bucket.discard(entry.key)
+                    if not bucket:
+                        del self._buckets[band]
+
+    # --- DBからの読み込み ---
+
+    def sync(self):
+        """DBに入った投稿のうち、まだ索引に無い分を読み足す（app context 内で呼ぶ）"""
+        from .extensions import db
+        from .models import Diary
+
+        if self._pid != os.getpid():
+            with self._lock:
+                self._reset()
+
+        since = datetime.now() - timedelta(seconds=self.window)
+        if self._last_id is None:
+            # 起動直後：窓の中で最も古い投稿の手前から読み始める（古い行を端からなめない）
+            first = db.session.query(db.func.min(Diary.id)).filter(Diary.created_at >= since).scalar()
+            if first is None:
+                first = (db.session.query(db.func.max(Diary.id)).scalar() or 0) + 1
+            self._last_id = first - 1
+        while True:
+            rows = db.session.query(Diary.id, Diary.uuid, Diary.search_text, Diary.created_at) \
+                .filter(Diary.id > self._last_id, Diary.created_at >= since) \
+                .order_by(Diary.id).limit(SYNC_BATCH).all()
+            if not rows:
+                return
+            with self._lock:
+                for row in rows:
+                    cleaned = _NOISE.sub('', row.search_text or '')
+                    if len(cleaned) >= self.min_chars:
+                        self._insert(row.uuid, row.id, row.created_at.timestamp(), shingles(cleaned))
+                self._last_id = max(self._last_id, rows[-1].id)
+            if len(rows) < SYNC_BATCH:
+                return
+
+    # --- 判定 ---
+
+    def check(self, content, now=None):
+        """本文を索引と照らし、FloodVerdict を返す（app context 内で呼ぶ）"""
+        cleaned = clean(content)
+        if not self.enabled or len(cleaned) < self.min_chars:
+            return FloodVerdict()
+        self.sync()
+        return self.match(cleaned, now)
+
+    def match(self, cleaned, now=None):
+        """DBを見ずに、いまの索引だけで判定する"""
+        now = time.time() if now is None else now
+        pieces = shingles(cleaned)
+        sig = signature(pieces)
+        if sig is None:
+            return FloodVerdict()
+
+        matches = []
+        with self._lock:
+            self._evict(now)
+            candidates = set()
+            for band in band_keys(sig):
+                candidates.update(self._buckets.get(band, ()))
+            for key in candidates:
+                entry = self._entries[key]
+                similarity = len(pieces & entry.shingles) / len(pieces | entry.shingles)
+                if similarity >= self.similarity:
+                    matches.append(Match(entry.diary_id, key, similarity))
+
+        matches.sort(key=lambda m: m.similarity, reverse=True)
+        return FloodVerdict(matches, len(matches) >= self.max_similar)
+
+    def add(self, key, content, created_at=None, diary_id=None):
+        """受け付けた投稿を索引に入れる（DBに入る前の分も、uuid を key にして先に入れておく）"""
+        cleaned = clean(content)
+        if not self.enabled or len(cleaned) < self.min_chars:
+            return
+        timestamp = (created_at or datetime.now()).timestamp()
+        with self._lock:
+            self._insert(key, diary_id, timestamp, shingles(cleaned))
+
+    @property
+    def size(self):
+        return len(self._entries)
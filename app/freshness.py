@@ -0,0 +1,81 @@
+import hashlib
+import os
+from flask import current_app, request, make_response
+from sqlalchemy import select, func
+from werkzeug.http import is_resource_modified
+from .extensions import db, timeline_cache, assets
+from .models import Diary
+
+"""
+条件付きGET（ETag / Last-Modified）
+公開タイムラインと種火検索は、誰が見ても同じページになるため、
+「前回から何も変わっていなければ 304 だけ返す」ことができます。
+
+検証子は、行を読む前に次の値だけで決めます。
+- 日記の最新の updated_at と最大ID（どちらもインデックスの端を1回読むだけ）
+  投稿・消火・再点火は、どれも updated_at を進めます
+- タイムラインキャッシュの世代番号（行の削除など、上の2つに出ない変化の分）
+- テンプレートと静的ファイルの中身（デプロイで見た目が変わった分）
+"""
+
+
+def _release_id():
+    """テンプレートと静的ファイルのマニフェストから作る、見た目のバージョン（プロセスごとに1度だけ計算）"""
+    release = current_app.extensions.get('release_id')
+    if release is None:
+        digest = hashlib.sha1()
+        template_dir = os.path.join(current_app.root_path, current_app.template_folder)
+        for root, _dirs, files in sorted(os.walk(template_dir)):
+            for filename in sorted(files):
+                with open(os.path.join(root, filename), 'rb') as f:
+                    digest.update(f.read())
+        digest.update(repr(sorted(assets.manifest.items())).encode('utf-8'))
+        release = current_app.extensions['release_id'] = digest.hexdigest()[:12]
+    return release
+
+
+def timeline_validator(generation=None):
+    """このURLの検証子 (etag, last_modified) を返す。SELECT は1回だけ（generation は読み済みの世代番号）"""
+    # 1文に max() を2つ並べると SQLite はインデックスの端を使えないため、スカラー副問い合わせに分ける
+    newest_update, newest_id = db.session.query(
+        select(func.max(Diary.updated_at)).scalar_subquery(),
+        select(func.max(Diary.id)).scalar_subquery(),
+    ).one()
+
+    raw = '|'.join([
+        _release_id(),
+        str(timeline_cache.generation if generation is None else generation),
+        str(newest_id),
+        newest_update.isoformat() if newest_update else '',
+        request.full_path,
+    ])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20], newest_update
+
+
+def _http_datetime(value):
+    """DBの日時（サーバーの現地時刻）を、HTTPヘッダ用のタイムゾーン付き日時にする"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.astimezone()
+    return value.replace(microsecond=0)
+
+
+def with_validator(response, validator):
+    """レスポンスに ETag / Last-Modified をつける（ブラウザには毎回確認させる）"""
+    if validator is None:
+        return response
+    response = make_response(response)
+    etag, last_modified = validator
+    response.set_etag(etag, weak=True)
+    response.last_modified = _http_datetime(last_modified)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def not_modified(validator):
+    """If-None-Match / If-Modified-Since が一致すれば 304 のレスポンス、そうでなければ None"""
+    etag, last_modified = validator
+    if is_resource_modified(request.environ, etag=etag, last_modified=_http_datetime(last_modified)):
+        return None
+    return with_validator(current_app.response_class(status=304), validator)
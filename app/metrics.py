@@ -0,0 +1,326 @@
+import json
+import os
+import threading
+import time
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+"""
+計測（リクエスト・SQL・テンプレート）
+- リクエストごとの処理時間（Blueprintのエンドポイント別）
+- 1リクエストで発行されたSQLの数と合計時間（N+1 や COUNT の発見用）
+- テンプレートの描画時間
+をヒストグラムに集計し、/metrics で Prometheus のテキスト形式として返します。
+
+gunicorn の複数ワーカーの値は、各ワーカーが METRICS_DIR に書き出すスナップショットを
+/metrics で足し合わせて1つにします。
+もういないワーカー（再起動・前のデプロイ）のスナップショットは、足さずに消します。
+しばらく書き出していないワーカーの現在値（ゲージ）は、古いかもしれないので足しません。
+"""
+
+# 処理時間（秒）のバケット
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 1リクエストあたりのSQL数のバケット
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+# この回数ぶんの書き出し間隔より古いスナップショットのゲージは足さない
+STALE_FLUSHES = 10
+
+HELP = {
+    'yotakibi_request_duration_seconds': ('histogram', 'リクエストの処理時間'),
+    'yotakibi_request_sql_queries': ('histogram', '1リクエストで発行されたSQLの数'),
+    'yotakibi_request_sql_seconds': ('histogram', '1リクエストでSQLにかかった合計時間'),
+    'yotakibi_sql_duration_seconds': ('histogram', 'SQL1文ごとの実行時間'),
+    'yotakibi_template_render_seconds': ('histogram', 'テンプレートの描画時間'),
+    'yotakibi_requests_total': ('counter', 'リクエスト数'),
+    'yotakibi_sse_connections': ('gauge', '開いている SSE（/api/embers/stream）の接続数'),
+    'yotakibi_flood_posts_total': ('counter', '連投とみなした投稿（hide / reject）'),
+    'yotakibi_bot_posts_total': ('counter', '火の番のボットの生成結果（queued / unsafe / failed）'),
+    'yotakibi_write_queue_dead_total': ('counter', '書き込みキューで入れられず dead_diaries に移した投稿'),
+    'yotakibi_inflight_requests': ('gauge', '処理中のリクエスト数（静的ファイル・/metrics を除く）'),
+    'yotakibi_request_queue_wait_seconds': ('histogram', 'プロキシが受けてからワーカーが取り出すまでの待ち時間（X-Request-Start）'),
+    'yotakibi_shed_requests_total': ('counter', '混雑のため 503 で断ったリクエスト（inflight / latency / queue）'),
+}
+
+
+def _labels_key(labels):
+    return json.dumps(sorted(labels.items()), ensure_ascii=False)
+
+
+class Registry:
+    """このプロセスの集計値。スレッドセーフ"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, value, labels, buckets=DURATION_BUCKETS):
+        key = _labels_key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            entry = series.get(key)
+            if entry is None:
+                entry = series[key] = {'le': list(buckets), 'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(entry['le']):
+                if value <= bound:
+                    entry['buckets'][i] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def inc(self, name, labels, amount=1):
+        key = _labels_key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def set_gauge(self, name, value, labels=None):
+        """現在値（ワーカー間では合計される）"""
+        key = _labels_key(labels or {})
+        with self._lock:
+            self.gauges.setdefault(name, {})[key] = value
+
+    def snapshot(self):
+        with self._lock:
+            return json.loads(json.dumps({
+                'histograms': self.histograms,
+                'counters': self.counters,
+                'gauges': self.gauges,
+            }))
+
+
+def merge_snapshots(snapshots, without_gauges=()):
+    """複数ワーカーのスナップショットを足し合わせる（without_gauges の番号のものはゲージを足さない）"""
+    merged = {'histograms': {}, 'counters': {}, 'gauges': {}}
+    for index, snap in enumerate(snapshots):
+        for name, series in snap.get('histograms', {}).items():
+            target = merged['histograms'].setdefault(name, {})
+            for key, entry in series.items():
+                if key not in target:
+                    target[key] = {'le': entry['le'], 'buckets': list(entry['buckets']),
+                                   'sum': entry['sum'], 'count': entry['count']}
+                    continue
+                current = target[key]
+                current['buckets'] = [a + b for a, b in zip(current['buckets'], entry['buckets'])]
+                current['sum'] += entry['sum']
+                current['count'] += entry['count']
+        for kind in ('counters', 'gauges'):
+            if kind == 'gauges' and index in without_gauges:
+                continue
+            for name, series in snap.get(kind, {}).items():
+                target = merged[kind].setdefault(name, {})
+                for key, value in series.items():
+                    target[key] = target.get(key, 0) + value
+    return merged
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    inner = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+    return '{' + inner + '}'
+
+
+def render_prometheus(snapshot):
+    """スナップショットを Prometheus のテキスト形式にする"""
+    lines = []
+
+    def header(name, default_type):
+        kind, help_text = HELP.get(name, (default_type, name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for name, series in sorted(snapshot['histograms'].items()):
+        header(name, 'histogram')
+        for key, entry in sorted(series.items()):
+            pairs = [tuple(p) for p in json.loads(key)]
+            for bound, count in zip(entry['le'], entry['buckets']):
+                lines.append(f"{name}_bucket{_format_labels(pairs + [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{_format_labels(pairs + [('le', '+Inf')])} {entry['count']}")
+            lines.append(f"{name}_sum{_format_labels(pairs)} {entry['sum']}")
+            lines.append(f"{name}_count{_format_labels(pairs)} {entry['count']}")
+
+    for kind in ('counters', 'gauges'):
+        for name, series in sorted(snapshot[kind].items()):
+            header(name, 'counter' if kind == 'counters' else 'gauge')
+            for key, value in sorted(series.items()):
+                pairs = [tuple(p) for p in json.loads(key)]
+                lines.append(f"{name}{_format_labels(pairs)} {value}")
+
+    return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    """Flask拡張の形をとった計測（extensions.py で空の箱を作り init_app で中身を入れる）"""
+
+    def __init__(self, app=None):
+        self.registry = Registry()
+        self.enabled = False
+        self.directory = None
+        self.flush_interval = 5
+        self._last_flush = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+
+        self.directory = app.config.get('METRICS_DIR') or os.path.join(app.instance_path, 'metrics')
+        self.flush_interval = app.config.get('METRICS_FLUSH_INTERVAL', 5)
+        os.makedirs(self.directory, exist_ok=True)
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        if self.registry not in _registries:
+            _registries.append(self.registry)
+
+    # --- リクエスト ---
+
+    def _before_request(self):
+        g._metrics_started = time.perf_counter()
+        g._metrics_sql_count = 0
+        g._metrics_sql_seconds = 0.0
+
+    def _record(self, status):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return
+
+        endpoint = request.endpoint or 'unknown'
+        elapsed = time.perf_counter() - started
+        self.registry.observe('yotakibi_request_duration_seconds', elapsed, {
+            'endpoint': endpoint, 'method': request.method,
+        })
+        self.registry.inc('yotakibi_requests_total', {
+            'endpoint': endpoint, 'method': request.method, 'status': str(status),
+        })
+        self.registry.observe('yotakibi_request_sql_queries', g.get('_metrics_sql_count', 0),
+                              {'endpoint': endpoint}, buckets=QUERY_COUNT_BUCKETS)
+        self.registry.observe('yotakibi_request_sql_seconds', g.get('_metrics_sql_seconds', 0.0),
+                              {'endpoint': endpoint})
+        self.maybe_flush()
+
+    def _after_request(self, response):
+        self._record(response.status_code)
+        return response
+
+    def _teardown_request(self, exc):
+        # 例外で after_request まで届かなかったリクエストも数える
+        if '_metrics_started' in g:
+            self._record(500)
+
+    # --- テンプレート ---
+
+    def _before_render(self, sender, template, context, **extra):
+        if has_request_context():
+            g.setdefault('_metrics_templates', []).append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        if not has_request_context():
+            return
+        stack = g.get('_metrics_templates')
+        if stack:
+            elapsed = time.perf_counter() - stack.pop()
+            self.registry.observe('yotakibi_template_render_seconds', elapsed,
+                                  {'template': template.name or 'unknown'})
+
+    # --- ワーカー間の集約 ---
+
+    def _snapshot_path(self, pid=None):
+        return os.path.join(self.directory, f"{pid or os.getpid()}.json")
+
+    def flush(self):
+        """このプロセスの値をファイルに書き出す（書き換えは一瞬で入れ替える）"""
+        path = self._snapshot_path()
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.registry.snapshot(), f, ensure_ascii=False)
+        os.replace(tmp, path)
+        self._last_flush = time.monotonic()
+
+    def maybe_flush(self):
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def collect(self):
+        """全ワーカーの値を足し合わせたスナップショット"""
+        if not self.enabled:
+            return self.registry.snapshot()
+        self.flush()
+        snapshots = []
+        stale = set()
+        stale_before = time.time() - self.flush_interval * STALE_FLUSHES
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            pid = name[:-5]
+            if pid.isdigit() and not _pid_alive(int(pid)):
+                # 終わったワーカーの分は、足し続けないよう消しておく
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                modified = os.path.getmtime(path)
+                with open(path, encoding='utf-8') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+            if modified < stale_before:
+                stale.add(len(snapshots) - 1)
+        return merge_snapshots(snapshots, without_gauges=stale)
+
+
+def _pid_alive(pid):
+    """このホストで pid のプロセスが動いているか"""
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        # 別ユーザーのプロセス（pid の使い回し）などは、生きているものとして扱う
+        return True
+    return True
+
+
+# SQLのイベントはエンジン単位でしか拾えないため、登録済みの集計先をここに持つ
+_registries = []
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_metrics_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stack = conn.info.get('_metrics_query_start')
+    if not stack:
+        return
+    elapsed = time.perf_counter() - stack.pop()
+
+    endpoint = 'background'
+    if has_request_context():
+        endpoint = request.endpoint or 'unknown'
+        if '_metrics_sql_count' in g:
+            g._metrics_sql_count += 1
+            g._metrics_sql_seconds += elapsed
+
+    for registry in _registries:
+        registry.observe('yotakibi_sql_duration_seconds', elapsed, {'endpoint': endpoint})
@@ -0,0 +1,351 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from http.cookies import SimpleCookie
+from flask import render_template
+from .extensions import metrics
+
+"""
+WSGIミドルウェア（Flaskの手前で動く門番）
+Flask のルーティングやセッション処理に入る前に片付けられるリクエストはここで返します。
+"""
+
+
+def _parse_cookie(environ, name):
+    raw = environ.get('HTTP_COOKIE')
+    if not raw or name not in raw:
+        return None
+    try:
+        cookie = SimpleCookie()
+        cookie.load(raw)
+    except Exception:
+        return None
+    morsel = cookie.get(name)
+    return morsel.value if morsel else None
+
+
+class SessionPeeker:
+    """
+    Flaskのセッションクッキーを、Flaskを通さずに覗いて「管理者・関係者か」だけを判定する。
+    署名の検証結果は小さなキャッシュに持っておきます。
+    """
+
+    def __init__(self, flask_app, max_entries=1024):
+        self.flask_app = flask_app
+        self.max_entries = max_entries
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def session_data(self, environ):
+        """クッキーの中身（dict）。無い・壊れている場合は空のdict"""
+        name = self.flask_app.config.get('SESSION_COOKIE_NAME', 'session')
+        value = _parse_cookie(environ, name)
+        if not value:
+            return {}
+
+        with self._lock:
+            cached = self._cache.get(value)
+        if cached is not None:
+            return cached
+
+        serializer = self.flask_app.session_interface.get_signing_serializer(self.flask_app)
+        try:
+            max_age = int(self.flask_app.permanent_session_lifetime.total_seconds())
+            data = dict(serializer.loads(value, max_age=max_age)) if serializer else {}
+        except Exception:
+            data = {}
+
+        with self._lock:
+            if len(self._cache) >= self.max_entries:
+                self._cache.clear()
+            self._cache[value] = data
+        return data
+
+    def is_privileged(self, environ):
+        data = self.session_data(environ)
+        return bool(data.get('is_admin') or data.get('debug_visitor'))
+
+
+class ClosedHoursMiddleware:
+    """
+    休業時間中の一般客には、描画済みの「おやすみ中」ページをそのまま返す。
+    Flask に渡すのは次の場合だけです。
+    - 営業時間中
+    - 管理者・関係者のセッションを持っている
+    - 役の切り替え（?admin_key= / ?ticket= / ?guest=）
+    - 静的ファイル・マニュアル・ルールなど、いつでも見られるページ
+    /api/ には、ページの代わりに 503 の JSON（Retry-After 付き）を返します（JS が HTML を受け取らないように）。
+    """
+
+    ROLE_SWITCH_PARAMS = ('admin_key=', 'ticket=', 'guest=')
+    API_PREFIX = '/api/'
+
+    def __init__(self, wsgi_app, flask_app, schedule):
+        self.wsgi_app = wsgi_app
+        self.flask_app = flask_app
+        self.schedule = schedule
+        self.sessions = SessionPeeker(flask_app)
+        self.always_open_paths = tuple(flask_app.config.get('ALWAYS_OPEN_PATHS', ('/static/',)))
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        is_open, reason, _ = self.schedule.state()
+        if is_open or self._should_pass(environ):
+            return self.wsgi_app(environ, start_response)
+        return self._serve_sleeping(environ, start_response, reason)
+
+    def _should_pass(self, environ):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(self.always_open_paths):
+            return True
+
+        query = environ.get('QUERY_STRING', '')
+        if query and any(param in query for param in self.ROLE_SWITCH_PARAMS):
+            return True
+
+        return self.sessions.is_privileged(environ)
+
+    def _render(self, environ, reason):
+        """おやすみ中ページを1度だけ描画する（ホストごと。クッキーは渡さない）"""
+        key = (reason, environ.get('HTTP_HOST'), environ.get('wsgi.url_scheme'))
+        page = self._pages.get(key)
+        if page is not None:
+            return page
+
+        anonymous = dict(environ, HTTP_COOKIE='', PATH_INFO='/sleeping', QUERY_STRING='', REQUEST_METHOD='GET')
+        with self.flask_app.request_context(anonymous):
+            body = render_template('sleeping.html', reason=reason).encode('utf-8')
+        page = (body, '"%s"' % hashlib.sha1(body).hexdigest())
+
+        with self._lock:
+            # Host ヘッダを変えられても増え続けないように
+            if len(self._pages) >= 32:
+                self._pages.clear()
+            self._pages[key] = page
+        return page
+
+    def _serve_sleeping(self, environ, start_response, reason):
+        if environ.get('PATH_INFO', '').startswith(self.API_PREFIX):
+            return self._serve_api_closed(start_response, reason)
+
+        body, etag = self._render(environ, reason)
+        # 次に火が灯るまで（最大1時間）はブラウザ・CDNに持っておいてもらう
+        max_age = int(min(self.schedule.seconds_until_open(), 3600))
+        headers = [
+            ('Cache-Control', f'public, max-age={max_age}'),
+            ('Vary', 'Cookie'),
+            ('ETag', etag),
+        ]
+
+        if environ.get('HTTP_IF_NONE_MATCH') == etag:
+            start_response('304 Not Modified', headers)
+            return [b'']
+
+        headers += [
+            ('Content-Type', 'text/html; charset=utf-8'),
+            ('Content-Length', str(len(body))),
+        ]
+        start_response('200 OK', headers)
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return [b'']
+        return [body]
+
+    def _serve_api_closed(self, start_response, reason):
+        retry_after = int(self.schedule.seconds_until_open())
+        body = json.dumps({'error': 'closed', 'reason': reason, 'retry_after': retry_after}).encode('utf-8')
+        start_response('503 Service Unavailable', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Retry-After', str(retry_after)),
+            ('Cache-Control', 'no-store'),
+        ])
+        return [body]
+
+
+class AdmissionControlMiddleware:
+    """
+    混雑時の受け付け制限（19:00 の開店直後など、待っていた人が一斉に / を開くとき）。
+    処理中のリクエスト数と最近の応答時間を見て、しきい値を超えていたら
+    優先度の低いリクエストを、DB にもテンプレートにも触れずに 503 + Retry-After で帰します。
+
+    - 処理中の数   : このワーカーで同時に処理している数（ADMISSION_MAX_INFLIGHT まで）
+    - 応答時間     : 応答を始めるまでの時間の指数移動平均（ADMISSION_MAX_LATENCY 秒まで）。
+                    リクエストが来ない間も半減期 LATENCY_HALF_LIFE 秒で下がるので、断り続けて固まることはない
+    - 待ち時間     : 手前のプロキシが付けた X-Request-Start からの経過（ADMISSION_MAX_QUEUE_WAIT 秒まで）。
+                    sync ワーカーでは、ワーカーが空くまでの列の長さはここにしか現れない
+
+    管理者のセッション・投稿（POST /write）・ボットの API・役の切り替え（?admin_key=）は断りません。
+    静的ファイル・/metrics・SSE は数にも入れません（長く開きっぱなしの接続で平均が狂わないように）。
+    """
+
+    PRIORITY_PATHS = ('/api/bot/',)
+    ROLE_SWITCH_PARAMS = ('admin_key=',)
+    # 応答時間の移動平均の重み（新しい1件の割合）
+    LATENCY_WEIGHT = 0.2
+    # リクエストが来ない間に、移動平均が半分になるまでの秒数
+    LATENCY_HALF_LIFE = 5.0
+
+    BODY = (
+        '<!DOCTYPE html><html lang="ja"><head><meta charset="utf-8">'
+        '<meta name="viewport" content="width=device-width, initial-scale=1">'
+        '<title>夜焚き火</title></head>'
+        '<body style="background:#111;color:#ddd;font-family:sans-serif;text-align:center;padding-top:20vh;">'
+        '<p>焚き火が混み合っています。</p><p style="opacity:.6;">少し経ってから、もう一度お越しください。</p>'
+        '</body></html>'
+    ).encode('utf-8')
+
+    def __init__(self, wsgi_app, flask_app):
+        self.wsgi_app = wsgi_app
+        config = flask_app.config
+        self.enabled = config.get('ADMISSION_ENABLED', True)
+        self.max_inflight = config.get('ADMISSION_MAX_INFLIGHT', 16)
+        self.max_latency = config.get('ADMISSION_MAX_LATENCY', 2.0)
+        self.max_queue_wait = config.get('ADMISSION_MAX_QUEUE_WAIT', 3.0)
+        self.retry_after = config.get('ADMISSION_RETRY_AFTER', 10)
+        self.exempt_paths = tuple(config.get('ADMISSION_EXEMPT_PATHS', ('/static/', '/assets/', '/metrics')))
+        self.sessions = SessionPeeker(flask_app)
+
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self._latency = 0.0
+        self._latency_at = time.monotonic()
+
+    # --- 負荷の見積もり ---
+
+    def latency(self, now=None):
+        """応答時間の移動平均（最後に測ってからの経過ぶん、減らした値）"""
+        now = time.monotonic() if now is None else now
+        return self._latency * 0.5 ** ((now - self._latency_at) / self.LATENCY_HALF_LIFE)
+
+    def _observe_latency(self, elapsed):
+        now = time.monotonic()
+        with self._lock:
+            current = self.latency(now)
+            self._latency = current + (elapsed - current) * self.LATENCY_WEIGHT
+            self._latency_at = now
+
+    @staticmethod
+    def queue_wait(environ, now=None):
+        """X-Request-Start（t=秒 / ミリ秒 / マイクロ秒）からの待ち時間。ヘッダが無ければ None"""
+        raw = environ.get('HTTP_X_REQUEST_START')
+        if not raw:
+            return None
+        try:
+            started = float(raw.strip().removeprefix('t='))
+        except ValueError:
+            return None
+        if started > 1e14:
+            started /= 1e6
+        elif started > 1e11:
+            started /= 1e3
+        return max((time.time() if now is None else now) - started, 0.0)
+
+    def overload_reason(self, environ):
+        """断るべき理由（'inflight' / 'latency' / 'queue'）。空いていれば None"""
+        if self.inflight >= self.max_inflight:
+            return 'inflight'
+        if self.latency() > self.max_latency:
+            return 'latency'
+        wait = self.queue_wait(environ)
+        if wait is not None and wait > self.max_queue_wait:
+            return 'queue'
+        return None
+
+    def is_priority(self, environ):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(self.PRIORITY_PATHS):
+            return True
+        if path == '/write' and environ.get('REQUEST_METHOD') == 'POST':
+            return True
+        query = environ.get('QUERY_STRING', '')
+        if query and any(param in query for param in self.ROLE_SWITCH_PARAMS):
+            return True
+        return bool(self.sessions.session_data(environ).get('is_admin'))
+
+    # --- 本体 ---
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if not self.enabled or path.startswith(self.exempt_paths):
+            return self.wsgi_app(environ, start_response)
+
+        wait = self.queue_wait(environ)
+        if wait is not None:
+            metrics.registry.observe('yotakibi_request_queue_wait_seconds', wait, {})
+
+        # 空いているときは、クッキーを覗かずにそのまま通す
+        reason = self.overload_reason(environ)
+        priority = reason is not None and self.is_priority(environ)
+        if reason is not None and not priority:
+            return self._shed(start_response, reason)
+        return self._admit(environ, start_response, 'high' if priority else 'normal')
+
+    def _set_inflight(self, delta):
+        with self._lock:
+            self.inflight += delta
+            inflight = self.inflight
+        metrics.registry.set_gauge('yotakibi_inflight_requests', inflight)
+
+    def _admit(self, environ, start_response, priority):
+        started = time.perf_counter()
+        self._set_inflight(1)
+
+        def timed_start_response(status, headers, exc_info=None):
+            # ストリーミングの応答でも、最初の1バイトまでを応答時間とする
+            self._observe_latency(time.perf_counter() - started)
+            return start_response(status, headers, exc_info)
+
+        try:
+            result = self.wsgi_app(environ, timed_start_response)
+        except BaseException:
+            self._set_inflight(-1)
+            raise
+        return _ClosingIterator(result, lambda: self._set_inflight(-1))
+
+    def _shed(self, start_response, reason):
+        metrics.registry.inc('yotakibi_shed_requests_total', {'reason': reason})
+        metrics.maybe_flush()
+        # 一斉に戻ってこないよう、待ってほしい秒数を最大2倍までばらす
+        retry_after = self.retry_after + random.randint(0, self.retry_after)
+        start_response('503 Service Unavailable', [
+            ('Content-Type', 'text/html; charset=utf-8'),
+            ('Content-Length', str(len(self.BODY))),
+            ('Retry-After', str(retry_after)),
+            ('Cache-Control', 'no-store'),
+        ])
+        return [self.BODY]
+
+
+class _ClosingIterator:
+    """
+    WSGI の応答を包み、送り終えた（最後まで読まれた・close された）ときに on_close を1度だけ呼ぶ。
+    close を呼ばない相手（テストクライアントなど）でも、読み切った時点で数が戻るように
+    """
+
+    def __init__(self, iterable, on_close):
+        self.iterable = iterable
+        self._on_close = on_close
+        self._lock = threading.Lock()
+
+    def _release(self):
+        with self._lock:
+            on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            on_close()
+
+    def __iter__(self):
+        try:
+            yield from self.iterable
+        finally:
+            # 読み切ったとき・途中で捨てられたとき（ジェネレータが閉じられる）
+            self._release()
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self._release()
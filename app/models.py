@@ -1,18 +1,44 @@
 import uuid
 from datetime import datetime
 from .extensions import db  # ステップ4で作ったファイルからdbを読み込む
+from .utils import hash_aikotoba, derive_content_fields
+
+
+def _derived_default(name):
+    """本文から導く列の既定値（書き込み側で計算済みの値が渡されていれば使われない）"""
+    def default(ctx):
+        return derive_content_fields(ctx.get_current_parameters().get('content'))[name]
+    return default
 
 class Diary(db.Model):
     __tablename__ = 'diaries'
+    __table_args__ = (
+        # タイムライン用：is_hidden で絞ってから (created_at, id) の降順でシークする
+        db.Index('ix_diaries_timeline', 'is_hidden', 'created_at', 'id'),
+        # 種火検索用：種火で絞ってから (created_at, id) の新しい順に読む（同じ日時でも並べ替えが要らないよう id まで）
+        db.Index('ix_diaries_aikotoba_lookup', 'aikotoba', 'is_hidden', 'created_at', 'id'),
+        db.Index('ix_diaries_aikotoba_hash_lookup', 'aikotoba_hash', 'is_hidden', 'created_at', 'id'),
+    )
 
     # 内部管理用ID
     id = db.Column(db.Integer, primary_key=True)
     # 外部公開用ID
-    uuid = db.Column(db.String(36), unique=True, default=lambda: str(uuid.uuid4()))
+    # ※ group='admin' の列は画面に出すのが管理者だけなので、必要になるまで読まない（admin_query で一緒に読む）
+    uuid = db.deferred(db.Column(db.String(36), unique=True, default=lambda: str(uuid.uuid4())), group='admin')
 
     # コンテンツ
     content = db.Column(db.Text, nullable=False)
     aikotoba = db.Column(db.String(50), nullable=False)
+    # 種火のハッシュ（固定長で比較できるように。保存時に自動で入る）
+    aikotoba_hash = db.deferred(db.Column(
+        db.String(64), nullable=True,
+        default=lambda ctx: hash_aikotoba(ctx.get_current_parameters().get('aikotoba'))
+    ), group='admin')
+
+    # --- 本文から導く値（書き込み時に derive_content_fields で計算して保存する） ---
+    is_long = db.Column(db.Boolean, nullable=True, default=_derived_default('is_long'))
+    # 検索用の正規化済みテキスト（全角半角・大文字小文字・カタカナひらがなの揺れを吸収）
+    search_text = db.deferred(db.Column(db.Text, nullable=True, default=_derived_default('search_text')))
 
     # --- 公開・利用設定 ---
     # is_timeline_public = db.Column(db.Boolean, default=False)
@@ -22,12 +48,101 @@ class Diary(db.Model):
 
     # --- 管理・モデレーション ---
     is_hidden = db.Column(db.Boolean, default=False)
-    admin_memo = db.Column(db.Text, nullable=True)
+    # 管理者の自由記述メモ（消火・再点火の履歴は ModerationEvent に記録する）
+    admin_memo = db.deferred(db.Column(db.Text, nullable=True), group='admin')
     
     # --- セキュリティ・監査ログ ---
-    ip_hash = db.Column(db.String(64), nullable=True)
-    user_agent = db.Column(db.String(255), nullable=True)
+    ip_hash = db.deferred(db.Column(db.String(64), nullable=True), group='admin')
+    user_agent = db.deferred(db.Column(db.String(255), nullable=True), group='admin')
 
     # メタデータ
     created_at = db.Column(db.DateTime, default=datetime.now, index=True)
-    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
\ No newline at end of file
+    # 条件付きGETの検証子（freshness.py）で最新値を引くためにインデックスを張る
+    updated_at = db.deferred(db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now, index=True), group='admin')
+
+    # 一般向けの画面（タイムライン・種火検索）で使う列
+    TIMELINE_COLUMNS = ('id', 'created_at', 'content', 'is_hidden', 'is_long')
+
+    @classmethod
+    def timeline_query(cls):
+        """
+        一般向け：画面に出す列だけを読むクエリ。
+        結果はORMオブジェクトではなく、列名で読める軽い行（Row）になり、セッションにも追跡されない
+        """
+        return db.session.query(*[getattr(cls, name) for name in cls.TIMELINE_COLUMNS])
+
+    @classmethod
+    def admin_query(cls):
+        """管理者向け：後回しにしている管理用の列も1回のSELECTでまとめて読むクエリ"""
+        return cls.query.options(db.undefer_group('admin'))
+
+
+
+class ModerationEvent(db.Model):
+    """
+    消火・再点火などの管理操作の記録（追記のみ）
+    日記の行を書き換えずに済むよう、別テーブルに1操作1行で積みます。
+    """
+    __tablename__ = 'moderation_events'
+    __table_args__ = (
+        # 日記ごとの履歴を新しい順に読む
+        db.Index('ix_moderation_events_diary_time', 'diary_id', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    # 日記の行とは独立に残す記録なので、外部キーは張らない
+    diary_id = db.Column(db.Integer, nullable=False)
+    # 'hide'（消火） / 'restore'（再点火）
+    action = db.Column(db.String(20), nullable=False)
+    # 補足（一括操作の条件など）
+    note = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False, index=True)
+
+    ACTION_LABELS = {
+        'hide': '消火（非表示）',
+        'restore': '再点火（表示再開）',
+    }
+
+    @property
+    def action_label(self):
+        return self.ACTION_LABELS.get(self.action, self.action)
+
+
+class ArchivedNight(db.Model):
+    """
+    冷たい保管庫：古い夜の日記を、夜ごとに1行にまとめて圧縮したもの（cold_storage.py）
+    SQLite では ATTACH した別ファイル、PostgreSQL では archive スキーマに置きます。
+    """
+    __tablename__ = 'archived_nights'
+    __table_args__ = {'schema': 'archive'}
+
+    night = db.Column(db.Date, primary_key=True)
+    row_count = db.Column(db.Integer, nullable=False)
+    # 日記1件を1行のJSONにして並べ、zlib で圧縮したもの
+    payload = db.Column(db.LargeBinary, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+
+
+class NightStat(db.Model):
+    """夜ごとの集計（stats.py が書き込み・消火のたびに足し引きする）"""
+    __tablename__ = 'night_stats'
+
+    night = db.Column(db.Date, primary_key=True)
+    posts = db.Column(db.Integer, nullable=False, default=0)
+    hidden = db.Column(db.Integer, nullable=False, default=0)
+    # 灯した人（IP Hash）の数を数えるための HyperLogLog のレジスタ
+    ip_sketch = db.Column(db.LargeBinary, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class NightAikotobaStat(db.Model):
+    """夜ごとの種火の使われた回数"""
+    __tablename__ = 'night_aikotoba_stats'
+    __table_args__ = (
+        # 夜ごとの上位を読む
+        db.Index('ix_night_aikotoba_stats_rank', 'night', 'posts'),
+    )
+
+    night = db.Column(db.Date, primary_key=True)
+    aikotoba = db.Column(db.String(50), primary_key=True)
+    posts = db.Column(db.Integer, nullable=False, default=0)
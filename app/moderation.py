@@ -0,0 +1,133 @@
+import re
+from datetime import datetime
+from sqlalchemy import update, insert
+from .extensions import db, timeline_cache, snapshots
+from .models import Diary, ModerationEvent
+from .stats import record_hidden_change
+
+"""
+消火・再点火（モデレーション）
+状態の変更と、操作の記録（moderation_events への追記）を1つのトランザクションで行います。
+一括操作は UPDATE ... RETURNING で変えた行を受け取り、その行だけの記録を積みます
+（絞り込みを1度しか読まないので、途中で別の書き込みがあっても記録・集計と実際の変更がずれません）。
+"""
+
+# 1回で指定できるIDの上限（貼り付けミス対策）
+MAX_IDS = 1000
+
+TARGET_TYPES = {
+    'ids': 'ID指定',
+    'range': 'ID範囲',
+    'ip_hash': 'IP Hash',
+    'aikotoba': '種火',
+}
+
+
+def build_criterion(target_type, value):
+    """
+    画面から来た指定を WHERE 条件にする。不正な指定なら ValueError
+    - ids      : "12, 15 #20" のようなID列
+    - range    : "100-150"（main.search の範囲検索と同じ書き方）
+    - ip_hash  : IP Hash（完全一致）
+    - aikotoba : 種火（完全一致）
+    """
+    value = (value or '').strip()
+    if not value:
+        raise ValueError('対象が指定されていません。')
+
+    if target_type == 'ids':
+        ids = [int(token) for token in re.findall(r'\d+', value)]
+        if not ids:
+            raise ValueError('IDが読み取れませんでした。')
+        if len(ids) > MAX_IDS:
+            raise ValueError(f'一度に指定できるIDは{MAX_IDS}件までです。')
+        return Diary.id.in_(ids)
+
+    if target_type == 'range':
+        match = re.fullmatch(r'#?(\d+)\s*-\s*#?(\d+)', value)
+        if not match:
+            raise ValueError('範囲は「100-150」の形で指定してください。')
+        start, end = sorted((int(match.group(1)), int(match.group(2))))
+        return Diary.id.between(start, end)
+
+    if target_type == 'ip_hash':
+        return Diary.ip_hash == value
+
+    if target_type == 'aikotoba':
+        return Diary.aikotoba == value
+
+    raise ValueError('対象の種類が不正です。')
+
+
+def set_hidden(diary, hidden, note=None):
+    """1件の日記を消火（hidden=True）／再点火し、記録を1行積む（コミットまで行う）"""
+    now = datetime.now()
+    if bool(diary.is_hidden) != hidden:
+        record_hidden_change([diary.created_at], hidden)
+    diary.is_hidden = hidden
+    db.session.add(ModerationEvent(
+        diary_id=diary.id,
+        action='hide' if hidden else 'restore',
+        note=note,
+        created_at=now,
+    ))
+    db.session.commit()
+    timeline_cache.bump()
+    snapshots.invalidate([diary.created_at])
+
+
+def bulk_set_hidden(criterion, hidden, note=None):
+    """
+    条件に合う日記のうち、状態が変わるものだけを消火（hidden=True）／再点火する。
+    UPDATE ... RETURNING で実際に変わった行を受け取り、その行ぶんの記録を積んで、変わった件数を返す。
+    """
+    now = datetime.now()
+    changed = db.session.execute(
+        update(Diary)
+        .where(criterion, Diary.is_hidden.is_distinct_from(hidden))
+        .values(is_hidden=hidden, updated_at=now)
+        .returning(Diary.id, Diary.created_at)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    if changed:
+        db.session.execute(insert(ModerationEvent), [
+            {'diary_id': diary_id, 'action': 'hide' if hidden else 'restore', 'note': note, 'created_at': now}
+            for diary_id, _created_at in changed
+        ])
+    # 書き出し済みの夜のうち、書き直しが必要な夜
+    touched = [created_at for _diary_id, created_at in changed]
+    record_hidden_change(touched, hidden)
+    db.session.commit()
+
+    if changed:
+        timeline_cache.bump()
+        snapshots.invalidate(touched)
+    return len(changed)
+
+
+# 以前 admin_memo に追記していた操作記録の書式
+#   [2025-01-01 21:30] 管理操作による消火
+#   [2025-01-01 21:30] 一括管理操作による再点火
+MEMO_LOG_PATTERN = re.compile(r'^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2})\] (一括)?管理操作による(消火|再点火)\s*$')
+
+
+def split_memo_log(memo):
+    """
+    admin_memo から操作記録の行を取り出す。
+    (記録のリスト [(日時, action, note)], 残りの自由記述メモ or None) を返す
+    """
+    events = []
+    remaining = []
+    for line in (memo or '').splitlines():
+        match = MEMO_LOG_PATTERN.match(line.strip())
+        if not match:
+            remaining.append(line)
+            continue
+        created_at = datetime.strptime(match.group(1), '%Y-%m-%d %H:%M')
+        action = 'hide' if match.group(3) == '消火' else 'restore'
+        note = '一括操作' if match.group(2) else None
+        events.append((created_at, action, note))
+
+    rest = '\n'.join(remaining).strip()
+    return events, (rest or None)
@@ -1,9 +1,18 @@
+import json
+import logging
+import os
 import re
+import threading
+import time
+import unicodedata
 
 """
 NGワードおよび予約語を管理するファイル
 方針：立ち上げ期のため、制限は「なりすまし」と「犯罪予告」のみに絞る。
 　　　場の空気は管理人の目視（火の番）によって守る。
+
+判定は、全リストから一度だけ組み立てた Aho-Corasick オートマトンで
+正規化済みテキストを1回なめるだけで行います（全角・半角、大文字小文字、カタカナ・ひらがなの揺れも吸収）。
 """
 
 # ==========================================
@@ -11,6 +20,7 @@ NGワードおよび予約語を管理するファイル
 # ==========================================
 # 管理人（Falo）へのなりすましは、信頼に関わるため厳禁。
 # 大文字小文字問わず禁止。
+# ※正規表現ではなく、ただの文字列として照合します。
 ADMIN_EXCLUSIVE_PATTERNS = [
     r"falo", 
 ]
@@ -36,29 +46,240 @@ GENERAL_NG_WORDS = [
 ]
 
 
+# ==========================================
+# 4. 追加のワードリスト（ホットリロード）
+# ==========================================
+# 環境変数 NG_WORDS_PATH にJSONファイルを指定すると、上のリストに追加して使います。
+#   {"general": [...], "admin": [...], "reserved": [...]}
+# ファイルが更新されると、ワーカーを再起動しなくても次の判定から反映されます。
+# 読めないファイル（書きかけ・JSONの誤り）のときは、ログを残して直前のリストのまま判定を続けます。
+# 書き換えは save_extra_words（一時ファイルに書いてから差し替える）か `flask add-ng-word` で。
+NG_WORDS_PATH = os.environ.get('NG_WORDS_PATH')
+
+# ファイルの更新確認は最短でこの秒数おき
+RELOAD_CHECK_INTERVAL = 5
+
+
+# カタカナ（ァ〜ヶ）→ ひらがな の変換表
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord('ァ'), ord('ヶ') + 1)}
+
+
+def normalize_text(text):
+    """
+    照合用の正規化：NFKC（全角英数→半角など）→ 大文字小文字の統一 → カタカナをひらがなへ
+    """
+    return unicodedata.normalize('NFKC', text).casefold().translate(_KATAKANA_TO_HIRAGANA)
+
+
+class NGWordMatcher:
+    """
+    カテゴリ付きのワードリストから組み立てる Aho-Corasick オートマトン。
+    find() はテキストを1回なめて、カテゴリごとに最初に見つかった言葉（元の表記）を返します。
+    """
+
+    def __init__(self, words_by_category):
+        # ノードごとの遷移表・失敗リンク・出力（カテゴリ, 元の言葉）
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        for category, words in words_by_category.items():
+            seen = set()
+            for word in words:
+                key = normalize_text(word)
+                if not key or key in seen:
+                    continue
+                seen.add(key)
+                self._add(key, (category, word))
+
+        self._build_failure_links()
+
+        # 根にいる間は「どの言葉の1文字目でもない文字」を re（C実装）で読み飛ばす
+        first_chars = ''.join(self._goto[0])
+        self._skip = re.compile(f"[{re.escape(first_chars)}]") if first_chars else None
+
+    def _add(self, key, payload):
+        node = 0
+        for ch in key:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = nxt
+        self._output[node].append(payload)
+
+    def _build_failure_links(self):
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                # 失敗先で終わる言葉も、ここで見つかったことにする
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def find(self, text, categories=None):
+        """
+        正規化したテキストから、カテゴリごとに最初に見つかった言葉を返す。
+        categories を渡すと、そのカテゴリが全部見つかった時点で打ち切ります。
+        """
+        found = {}
+        if self._skip is None:
+            return found
+
+        goto, fail, output = self._goto, self._fail, self._output
+        text = normalize_text(text)
+        length = len(text)
+        node = 0
+        pos = 0
+        while pos < length:
+            if not node:
+                match = self._skip.search(text, pos)
+                if match is None:
+                    break
+                pos = match.start()
+
+            ch = text[pos]
+            pos += 1
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+
+            if output[node]:
+                for category, word in output[node]:
+                    if category not in found:
+                        found[category] = word
+                if categories and all(c in found for c in categories):
+                    break
+        return found
+
+
+CATEGORIES = ('general', 'admin', 'reserved')
+
+logger = logging.getLogger(__name__)
+
+
+def _load_extra_words(path):
+    """追加ワードリスト（JSON）を読む。形が違えば ValueError"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("JSON の一番外側はオブジェクトにしてください")
+    words = {}
+    for category in CATEGORIES:
+        values = data.get(category, [])
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise ValueError(f"'{category}' は文字列のリストにしてください")
+        words[category] = list(values)
+    return words
+
+
+def save_extra_words(words, path=None):
+    """
+    追加ワードリストを書き出す。一時ファイルに書いてから差し替えるので、
+    ほかのワーカーが書きかけのファイルを読むことはありません
+    """
+    path = path or NG_WORDS_PATH
+    data = {category: list(words.get(category, [])) for category in CATEGORIES}
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+_matcher = None
+_matcher_mtime = None
+_last_checked = 0.0
+_reload_lock = threading.Lock()
+
+
+def reload_words(path=None):
+    """
+    ワードリストからオートマトンを組み立て直し、丸ごと差し替える。
+    組み立て中も古いオートマトンで判定を続けられます。
+    追加リストが読めなければ、ログを残して今のオートマトン（初回は組み込みのリストだけ）を使い続けます
+    （同じファイルを何度も読み直さないよう、更新時刻は覚えておく）。
+    """
+    global _matcher, _matcher_mtime
+
+    path = path or NG_WORDS_PATH
+    words = {
+        'general': list(GENERAL_NG_WORDS),
+        'admin': list(ADMIN_EXCLUSIVE_PATTERNS),
+        'reserved': list(RESERVED_AIKOTOBA_WORDS),
+    }
+    mtime = None
+    if path and os.path.exists(path):
+        try:
+            mtime = os.path.getmtime(path)
+            extra_words = _load_extra_words(path)
+        except (OSError, ValueError) as e:
+            logger.error(f"ng_words: {path} を読めません（前のリストのまま判定します）: {e}")
+            if _matcher is None:
+                _matcher = NGWordMatcher(words)
+            _matcher_mtime = mtime
+            return _matcher
+        for category, extra in extra_words.items():
+            words[category].extend(extra)
+
+    _matcher = NGWordMatcher(words)
+    _matcher_mtime = mtime
+    return _matcher
+
+
+def get_matcher():
+    """現在のオートマトンを返す。追加リストが更新されていれば組み立て直す"""
+    global _last_checked
+
+    if NG_WORDS_PATH:
+        now = time.monotonic()
+        if now - _last_checked >= RELOAD_CHECK_INTERVAL:
+            _last_checked = now
+            try:
+                mtime = os.path.getmtime(NG_WORDS_PATH)
+            except OSError:
+                mtime = None
+            if mtime != _matcher_mtime:
+                with _reload_lock:
+                    if mtime != _matcher_mtime:
+                        reload_words()
+    return _matcher
+
+
+reload_words()
+
+
 def check_text_safety(text, check_reserved=False, is_admin=False):
     """
     テキストが安全かどうかを判定する関数
     """
     if not text:
         return True, None
-        
+
+    # 1回なめるだけで全カテゴリを拾う（共通NGが見つかれば、その時点で結論が出るので打ち切る）
+    found = get_matcher().find(text, categories=('general',))
+
     # 1. 共通NGワードチェック
-    for word in GENERAL_NG_WORDS:
-        if word in text:
-            return False, "その言葉は、薪としてくべることはできません。"
+    if 'general' in found:
+        return False, "その言葉は、薪としてくべることはできません。"
 
     # 2. 管理者権限チェック
     if not is_admin:
         # A. 管理人名（Falo）のなりすましチェック
-        for pattern in ADMIN_EXCLUSIVE_PATTERNS:
-            if re.search(pattern, text, re.IGNORECASE):
-                return False, "その言葉（管理人の名前）は使用できません。"
+        if 'admin' in found:
+            return False, "その言葉（管理人の名前）は使用できません。"
 
         # B. 予約語（種火）チェック
-        if check_reserved:
-            for word in RESERVED_AIKOTOBA_WORDS:
-                if word in text: 
-                    return False, f"「{word}」を含む種火は、管理人が使用するため予約されています。"
+        if check_reserved and 'reserved' in found:
+            return False, f"「{found['reserved']}」を含む種火は、管理人が使用するため予約されています。"
 
-    return True, None
\ No newline at end of file
+    return True, None
@@ -0,0 +1,89 @@
+import base64
+from datetime import datetime
+from sqlalchemy import tuple_
+
+"""
+カーソル（キーセット）方式のページ送り
+(created_at, id) の組を「しおり」として次のページを探すため、
+COUNT(*) も OFFSET も使わず、1ページ目でも10000ページ目でも同じコストで読めます。
+"""
+
+
+def encode_cursor(created_at, diary_id):
+    """(created_at, id) を URL に載せられる不透明なトークンにする"""
+    raw = f"{created_at.isoformat()}|{diary_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """トークンを (created_at, id) に戻す。壊れていれば None"""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        ts, diary_id = raw.split('|', 1)
+        return datetime.fromisoformat(ts), int(diary_id)
+    except (ValueError, UnicodeError):
+        return None
+
+
+class KeysetPage:
+    """
+    1ページ分の結果。テンプレートからは Flask-SQLAlchemy の Pagination と
+    同じ感覚で has_prev / has_next を見て、リンクは prev_params / next_params で作ります。
+    """
+
+    def __init__(self, items, has_prev, has_next, extra_params=None):
+        self.items = items
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.extra_params = extra_params or {}
+
+    @property
+    def prev_params(self):
+        """より新しい火（前のページ）へのURLパラメータ"""
+        if not self.has_prev or not self.items:
+            return None
+        first = self.items[0]
+        return dict(self.extra_params, after=encode_cursor(first.created_at, first.id))
+
+    @property
+    def next_params(self):
+        """より古い火（次のページ）へのURLパラメータ"""
+        if not self.has_next or not self.items:
+            return None
+        last = self.items[-1]
+        return dict(self.extra_params, before=encode_cursor(last.created_at, last.id))
+
+
+def keyset_paginate(query, created_col, id_col, per_page, before=None, after=None, extra_params=None):
+    """
+    新しい順のタイムラインを (created_at, id) でシークして1ページ分だけ取得する。
+
+    before: このトークンより古いものを取る（「次の夜」方向）
+    after : このトークンより新しいものを取る（「前の夜」方向）
+    どちらも無ければ先頭ページ。1件だけ余分に読んで続きがあるかを判定します。
+    """
+    key = tuple_(created_col, id_col)
+    before_cursor = decode_cursor(before)
+    after_cursor = decode_cursor(after) if before_cursor is None else None
+
+    if after_cursor is not None:
+        # 新しい方向へは昇順で読んでから並べ直す
+        rows = query.filter(key > tuple_(*after_cursor)) \
+            .order_by(created_col.asc(), id_col.asc()) \
+            .limit(per_page + 1).all()
+        if len(rows) > per_page:
+            items = list(reversed(rows[:per_page]))
+            return KeysetPage(items, has_prev=True, has_next=True, extra_params=extra_params)
+        # 先頭まで戻ってきた場合は、件数が揃うように先頭ページとして読み直す
+        return keyset_paginate(query, created_col, id_col, per_page, extra_params=extra_params)
+
+    if before_cursor is not None:
+        query = query.filter(key < tuple_(*before_cursor))
+
+    rows = query.order_by(created_col.desc(), id_col.desc()).limit(per_page + 1).all()
+    has_next = len(rows) > per_page
+    items = rows[:per_page]
+    return KeysetPage(items, has_prev=before_cursor is not None, has_next=has_next, extra_params=extra_params)
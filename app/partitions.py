@@ -0,0 +1,130 @@
+import re
+from datetime import date
+from sqlalchemy import text
+from .extensions import db
+from .models import Diary
+
+"""
+diaries の月ごとの分割（PostgreSQL のみ）
+PostgreSQL の宣言的パーティショニングで、diaries を created_at の月ごとに分けます。
+タイムラインや夜ごとの読み出しは、新しい月のパーティションだけを読めば済み、
+冷たい保管庫へ移し終えた古い月は、パーティションごと DROP できます（DELETE の後始末が要らない）。
+
+分割したテーブルでは、主キー・一意制約に分割キー（created_at）を含める必要があるため、
+主キーは (id, created_at)、uuid の一意制約は (uuid, created_at) になります。
+ID は今までどおり同じシーケンスから振られるので、アプリからは id だけで引けます。
+
+    flask --app run partition-diaries
+（初回は既存の diaries を分割したテーブルへ作り直し、2回目以降は先の月のパーティションを足すだけ）
+"""
+
+PARTITION_NAME = re.compile(r'^diaries_p(\d{4})(\d{2})$')
+
+
+def _month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _partition_name(month):
+    return f"diaries_p{month:%Y%m}"
+
+
+def is_partitioned(conn):
+    return conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('diaries'))"
+    )).scalar()
+
+
+def _create_month(conn, month):
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {_partition_name(month)} PARTITION OF diaries"
+        f" FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+    ))
+
+
+def _create_months(conn, first, months_ahead):
+    """first の月から、今月の months_ahead か月先までのパーティションを作る"""
+    month = _month_start(first)
+    last = _month_start(date.today())
+    for _ in range(months_ahead):
+        last = _next_month(last)
+    created = []
+    while month <= last:
+        _create_month(conn, month)
+        created.append(_partition_name(month))
+        month = _next_month(month)
+    return created
+
+
+def partition_diaries(months_ahead=3):
+    """
+    diaries を月ごとに分割したテーブルへ作り直す（分割済みなら先の月を足すだけ）。
+    作った（または確かめた）パーティション名のリストを返す。PostgreSQL 以外では何もしない
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return []
+
+    with db.engine.begin() as conn:
+        if is_partitioned(conn):
+            return _create_months(conn, date.today(), months_ahead)
+
+        conn.execute(text('LOCK TABLE diaries IN ACCESS EXCLUSIVE MODE'))
+        oldest = conn.execute(text('SELECT min(created_at) FROM diaries')).scalar()
+        sequence = conn.execute(text("SELECT pg_get_serial_sequence('diaries', 'id')")).scalar()
+
+        conn.execute(text('ALTER TABLE diaries RENAME TO diaries_unpartitioned'))
+        conn.execute(text(
+            'CREATE TABLE diaries (LIKE diaries_unpartitioned INCLUDING DEFAULTS)'
+            ' PARTITION BY RANGE (created_at)'
+        ))
+        # どの月にも当てはまらない行（日時の入力ミスなど）の受け皿
+        conn.execute(text('CREATE TABLE IF NOT EXISTS diaries_default PARTITION OF diaries DEFAULT'))
+        created = _create_months(conn, oldest or date.today(), months_ahead)
+
+        conn.execute(text('INSERT INTO diaries SELECT * FROM diaries_unpartitioned'))
+        if sequence:
+            # 古いテーブルと一緒にシーケンスが消えないよう、持ち主を付け替える
+            conn.execute(text(f'ALTER SEQUENCE {sequence} OWNED BY diaries.id'))
+        conn.execute(text('DROP TABLE diaries_unpartitioned'))
+
+        # 索引・制約は、行を入れ終えてから（古いテーブルと一緒に名前が空いてから）作る
+        conn.execute(text('ALTER TABLE diaries ADD PRIMARY KEY (id, created_at)'))
+        conn.execute(text('ALTER TABLE diaries ADD CONSTRAINT diaries_uuid_key UNIQUE (uuid, created_at)'))
+        for index in Diary.__table__.indexes:
+            index.create(bind=conn)
+
+    # 管理者検索のトライグラム索引も作り直す
+    from .search import setup_search_index
+    setup_search_index()
+    return created
+
+
+def drop_empty_partitions(before):
+    """before（datetime）より前で終わる月のうち、空になったパーティションを消す。消した名前のリストを返す"""
+    if db.engine.dialect.name != 'postgresql':
+        return []
+
+    dropped = []
+    with db.engine.begin() as conn:
+        if not is_partitioned(conn):
+            return []
+        names = conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid"
+            " WHERE i.inhparent = to_regclass('diaries')"
+        )).scalars().all()
+        for name in sorted(names):
+            match = PARTITION_NAME.match(name)
+            if not match:
+                continue
+            month = date(int(match.group(1)), int(match.group(2)), 1)
+            if _next_month(month) > before.date():
+                continue
+            if conn.execute(text(f'SELECT EXISTS (SELECT 1 FROM {name})')).scalar():
+                continue
+            conn.execute(text(f'DROP TABLE {name}'))
+            dropped.append(name)
+    return dropped
@@ -0,0 +1,364 @@
+import cProfile
+import json
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from flask import g, has_request_context, request, session
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+"""
+本番のリクエストのプロファイル（どこで時間を使っているかを、デプロイし直さずに見る）
+PROFILER_ENABLED が '0'（既定）のときはフックを1つも登録しないので、何の負担もかかりません。
+
+有効にすると、次のリクエストを測ります。
+- 抜き取り：PROFILE_SAMPLE_RATE の割合（管理画面から、時間を区切って割合を変えられる）
+- 指名    ：管理者セッションで ?_profile=1（cProfile で測るなら ?_profile=cprofile）
+- 指名    ：X-Profile ヘッダに `flask profile-token` で作った署名付きトークン
+
+測り方
+- sample  : 裏のスレッドが PROFILE_INTERVAL 秒ごとに、測っているスレッドのスタックを覗く（低負荷）。
+            結果は flamegraph.pl / speedscope でそのまま読める collapsed 形式（.folded）
+- cprofile: 全関数の呼び出しを数える（重い。指名したときだけ）。結果は pstats 形式（.pstats）
+
+どちらも、エンドポイント・所要時間・SQL の数と遅かった文を .json に添えて PROFILE_DIR に置き、
+新しい PROFILE_KEEP 件だけを残します。応答の X-Profile-Id ヘッダが、その名前です。
+"""
+
+MODES = ('sample', 'cprofile')
+# 添えておく、遅かったSQLの数
+SLOWEST_SQL = 10
+# 抜き取りの割合（管理画面で変えたもの）を読み直す間隔（秒）
+CONTROL_CHECK_INTERVAL = 2.0
+PROFILE_ID = re.compile(r'^[0-9]{8}-[0-9]{6}-[0-9]+-[0-9a-f]{6}$')
+EXTENSIONS = {
+    'json': 'application/json',
+    'folded': 'text/plain',
+    'pstats': 'application/octet-stream',
+}
+
+
+# コードオブジェクトごとの表示名（毎回組み立てない）
+_labels = {}
+
+
+def _frame_label(code):
+    label = _labels.get(code)
+    if label is None:
+        path = code.co_filename.replace('\\', '/').split('/')
+        label = _labels[code] = f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+    return label
+
+
+def collapse(frame):
+    """フレームを、外側から ';' でつないだ1行（collapsed 形式のスタック）にする"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+
+class StackSampler:
+    """登録されたスレッドのスタックを、1本の裏スレッドで interval 秒ごとに数える"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._targets = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def start(self, thread_id):
+        counter = Counter()
+        with self._lock:
+            self._targets[thread_id] = counter
+            # fork した子には、親の裏スレッドが無い
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+        self._wake.set()
+        return counter
+
+    def stop(self, thread_id):
+        with self._lock:
+            counter = self._targets.pop(thread_id, None)
+        return Counter(counter) if counter is not None else Counter()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                targets = list(self._targets.items())
+            if not targets:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            frames = sys._current_frames()
+            for thread_id, counter in targets:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    counter[collapse(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+class RequestProfiler:
+    """Flask拡張の形をとったプロファイラ（extensions.py で空の箱を作り init_app で中身を入れる）"""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.directory = None
+        self.sample_rate = 0.0
+        self.endpoints = ()
+        self.keep = 100
+        self.token_max_age = 3600
+        self.sampler = StackSampler()
+        self._serializer = None
+        self._control = (0.0, 0.0)
+        self._control_checked = 0.0
+        self._control_mtime = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('PROFILER_ENABLED', False)
+        app.extensions['profiler'] = self
+        if not self.enabled:
+            return
+
+        self.directory = app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+        self.sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0.0)
+        self.endpoints = tuple(app.config.get('PROFILE_ENDPOINTS', ()))
+        self.keep = app.config.get('PROFILE_KEEP', 100)
+        self.token_max_age = app.config.get('PROFILE_TOKEN_MAX_AGE', 3600)
+        self.sampler.interval = app.config.get('PROFILE_INTERVAL', 0.005)
+        self._serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='yotakibi-profile')
+        os.makedirs(self.directory, exist_ok=True)
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    # --- 署名付きトークン ---
+
+    def make_token(self, mode='sample'):
+        return self._serializer.dumps({'mode': mode})
+
+    def _token_mode(self, token):
+        try:
+            data = self._serializer.loads(token, max_age=self.token_max_age)
+        except BadSignature:
+            return None
+        mode = data.get('mode') if isinstance(data, dict) else None
+        return mode if mode in MODES else None
+
+    # --- 抜き取りの割合（ワーカー間で共有するため、PROFILE_DIR のファイルに置く） ---
+
+    def _control_path(self):
+        return os.path.join(self.directory, 'sampling.json')
+
+    def set_sampling(self, rate, seconds):
+        """seconds 秒の間だけ、抜き取りの割合を rate にする（全ワーカーに効く）"""
+        path = self._control_path()
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'rate': rate, 'until': time.time() + seconds}, f)
+        os.replace(tmp, path)
+        self._control_checked = 0.0
+
+    def sampling(self):
+        """いまの抜き取りの割合と、管理画面で変えた割合の期限（無ければ None）"""
+        now = time.monotonic()
+        if now - self._control_checked >= CONTROL_CHECK_INTERVAL:
+            self._control_checked = now
+            path = self._control_path()
+            try:
+                mtime = os.stat(path).st_mtime
+                if mtime != self._control_mtime:
+                    with open(path, encoding='utf-8') as f:
+                        data = json.load(f)
+                    self._control = (float(data['rate']), float(data['until']))
+                    self._control_mtime = mtime
+            except (OSError, ValueError, KeyError, TypeError):
+                self._control = (0.0, 0.0)
+                self._control_mtime = None
+        rate, until = self._control
+        if until > time.time():
+            return rate, datetime.fromtimestamp(until)
+        return self.sample_rate, None
+
+    # --- 1リクエスト ---
+
+    def _requested_mode(self):
+        """測るなら (測り方, きっかけ)、測らないなら None"""
+        wanted = request.args.get('_profile')
+        if wanted and session.get('is_admin'):
+            return ('cprofile' if wanted == 'cprofile' else 'sample'), 'admin'
+        token = request.headers.get('X-Profile')
+        if token:
+            mode = self._token_mode(token)
+            if mode:
+                return mode, 'header'
+        rate, _ = self.sampling()
+        if rate > 0 and random.random() < rate:
+            if not self.endpoints or request.endpoint in self.endpoints:
+                return 'sample', 'sampled'
+        return None
+
+    def _before_request(self):
+        requested = self._requested_mode()
+        if requested is None:
+            return
+        mode, trigger = requested
+        state = {
+            'mode': mode,
+            'trigger': trigger,
+            'started_at': datetime.now(),
+            'started': time.perf_counter(),
+            'sql': [],
+        }
+        if mode == 'cprofile':
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                state['profile'] = profile
+            except ValueError:
+                # ほかのスレッドで cProfile が動いている（Python 3.12 以降は同時に1つだけ）
+                state['mode'] = mode = 'sample'
+        if mode == 'sample':
+            state['thread_id'] = threading.get_ident()
+            state['counter'] = self.sampler.start(state['thread_id'])
+        g._profile = state
+
+    def _after_request(self, response):
+        state = g.get('_profile')
+        if state is not None:
+            state['status'] = response.status_code
+            state['id'] = self._new_id()
+            response.headers['X-Profile-Id'] = state['id']
+        return response
+
+    def _teardown_request(self, exc):
+        state = g.pop('_profile', None)
+        if state is None:
+            return
+        duration = time.perf_counter() - state['started']
+        stacks = None
+        profile = state.get('profile')
+        if profile is not None:
+            profile.disable()
+        else:
+            stacks = self.sampler.stop(state['thread_id'])
+
+        profile_id = state.get('id') or self._new_id()
+        sql = state['sql']
+        meta = {
+            'id': profile_id,
+            'mode': state['mode'],
+            'trigger': state['trigger'],
+            'endpoint': request.endpoint or 'unknown',
+            'method': request.method,
+            'path': request.path,
+            'status': state.get('status', 500),
+            'started_at': state['started_at'].isoformat(timespec='milliseconds'),
+            'duration': round(duration, 6),
+            'interval': self.sampler.interval if stacks is not None else None,
+            'samples': sum(stacks.values()) if stacks is not None else None,
+            'sql': {
+                'count': len(sql),
+                'seconds': round(sum(seconds for _, seconds in sql), 6),
+                'slowest': [
+                    {'statement': statement, 'seconds': round(seconds, 6)}
+                    for statement, seconds in sorted(sql, key=lambda item: item[1], reverse=True)[:SLOWEST_SQL]
+                ],
+            },
+        }
+        try:
+            self._save(meta, stacks, profile)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _new_id():
+        return f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}-{secrets.token_hex(3)}"
+
+    # --- 保存・一覧 ---
+
+    def path_for(self, profile_id, extension):
+        if not PROFILE_ID.match(profile_id) or extension not in EXTENSIONS:
+            return None
+        return os.path.join(self.directory, f"{profile_id}.{extension}")
+
+    def _save(self, meta, stacks, profile):
+        profile_id = meta['id']
+        if stacks is not None:
+            with open(self.path_for(profile_id, 'folded'), 'w', encoding='utf-8') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        if profile is not None:
+            profile.dump_stats(self.path_for(profile_id, 'pstats'))
+        # 一覧は .json を見るので、最後に置く
+        path = self.path_for(profile_id, 'json')
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+        self._prune()
+
+    def _ids(self):
+        names = os.listdir(self.directory)
+        return sorted((name[:-5] for name in names if name.endswith('.json') and PROFILE_ID.match(name[:-5])),
+                      reverse=True)
+
+    def _prune(self):
+        for profile_id in self._ids()[self.keep:]:
+            for extension in EXTENSIONS:
+                try:
+                    os.remove(self.path_for(profile_id, extension))
+                except OSError:
+                    pass
+
+    def recent(self, limit=50):
+        """新しいプロファイルの概要（dict）を limit 件"""
+        if not self.enabled:
+            return []
+        profiles = []
+        for profile_id in self._ids()[:limit]:
+            try:
+                with open(self.path_for(profile_id, 'json'), encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            meta['files'] = [
+                extension for extension in EXTENSIONS
+                if os.path.exists(self.path_for(profile_id, extension))
+            ]
+            profiles.append(meta)
+        return profiles
+
+
+# SQLのイベントはエンジン単位でしか拾えないため、測っているリクエストだけ g に書き込む
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and '_profile' in g:
+        conn.info.setdefault('_profile_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not (has_request_context() and '_profile' in g):
+        return
+    stack = conn.info.get('_profile_query_start')
+    if stack:
+        g._profile['sql'].append((' '.join(statement.split())[:500], time.perf_counter() - stack.pop()))
@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from .cache import _connect_shared
+
+"""
+連投制限（スライディングウィンドウ方式）
+「直近 window 秒間に limit 回まで」を、DB（diaries テーブル）に一切触れずに判定します。
+
+- memory : ワーカープロセスごとのメモリ（開発用。ワーカー数ぶん制限が緩くなる）
+- sqlite : ローカルのSQLiteファイル（gunicornの複数ワーカーで共有）
+
+「数えて、枠があれば記録する」は1つの操作（hit）で行うので、同時に送られた投稿がまとめて枠をすり抜けることはありません。
+投稿をやめたキーの記録は、SWEEP_INTERVAL 秒おきにまとめて捨てます。
+"""
+
+# 窓から外れた記録を、全キーについて掃除する間隔（秒）
+SWEEP_INTERVAL = 60
+
+
+class MemoryStorage:
+    """キーごとに直近の記録時刻を持つ。スレッドセーフ"""
+
+    def __init__(self):
+        self._hits = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def try_add(self, key, timestamp, since, limit):
+        """since 以降の記録が limit 未満なら記録して True（数えるのと記録するのを同じロックの中で）"""
+        with self._lock:
+            hits = self._hits[key]
+            while hits and hits[0] < since:
+                hits.popleft()
+            if len(hits) >= limit:
+                return False
+            hits.append(timestamp)
+            return True
+
+    def sweep(self, since):
+        """since より前の記録しか無いキーを捨てる"""
+        with self._lock:
+            for key in [key for key, hits in self._hits.items() if not hits or hits[-1] < since]:
+                del self._hits[key]
+
+
+class SQLiteStorage:
+    """ローカルSQLiteファイルに記録時刻を持つ。プロセスをまたいで共有できる"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute('CREATE TABLE IF NOT EXISTS rate_hits (key TEXT NOT NULL, ts REAL NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_rate_hits_key_ts ON rate_hits (key, ts)')
+
+    def _connect(self):
+        return _connect_shared(self._local, self.path)
+
+    def try_add(self, key, timestamp, since, limit):
+        """since 以降の記録が limit 未満なら記録して True（書き込みロックをとってから数える）"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM rate_hits WHERE key = ? AND ts < ?', (key, since))
+            count = conn.execute('SELECT COUNT(*) FROM rate_hits WHERE key = ? AND ts >= ?', (key, since)).fetchone()[0]
+            allowed = count < limit
+            if allowed:
+                conn.execute('INSERT INTO rate_hits (key, ts) VALUES (?, ?)', (key, timestamp))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed
+
+    def sweep(self, since):
+        self._connect().execute('DELETE FROM rate_hits WHERE ts < ?', (since,))
+
+
+class SlidingWindowLimiter:
+    """Flask拡張の形をとった連投制限（extensions.py で空の箱を作り init_app で中身を入れる）"""
+
+    def __init__(self, app=None):
+        self.storage = MemoryStorage()
+        self.limit = 5
+        self.window = 3600
+        self._next_sweep = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.limit = app.config.get('RATE_LIMIT_POSTS', 5)
+        self.window = app.config.get('RATE_LIMIT_WINDOW', 3600)
+
+        if app.config.get('RATE_LIMIT_STORAGE', 'memory') == 'sqlite':
+            path = app.config.get('RATE_LIMIT_PATH') or os.path.join(app.instance_path, 'rate_limit.sqlite3')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.storage = SQLiteStorage(path)
+        else:
+            self.storage = MemoryStorage()
+
+        app.extensions['post_limiter'] = self
+
+    def hit(self, key):
+        """枠が残っていれば1回ぶん記録して True、残っていなければ記録せずに False"""
+        now = time.time()
+        since = now - self.window
+        if now >= self._next_sweep:
+            self._next_sweep = now + SWEEP_INTERVAL
+            self.storage.sweep(since)
+        return self.storage.try_add(str(key), now, since, self.limit)
+
+    def describe(self):
+        """利用者向けの「1時間に5本まで」の言い回し"""
+        window = self.window
+        if window % 86400 == 0:
+            span = '1日' if window == 86400 else f'{window // 86400}日'
+        elif window % 3600 == 0:
+            span = '1時間' if window == 3600 else f'{window // 3600}時間'
+        elif window % 60 == 0:
+            span = f'{window // 60}分'
+        else:
+            span = f'{window}秒'
+        return f'{span}に{self.limit}本まで'
@@ -0,0 +1,148 @@
+from datetime import date, datetime
+from flask import (Blueprint, render_template, request, current_app, abort, Response, stream_with_context, jsonify,
+                   send_file, redirect, url_for, flash)
+from ..models import Diary, ModerationEvent
+from ..cold_storage import search_cold
+from ..export import FORMATS, iter_export
+from ..extensions import profiler
+from ..profiling import EXTENSIONS as PROFILE_FILES
+from ..search import SearchPage
+from ..stats import night_summaries
+from ..utils import admin_required
+
+# 'admin' という名前のBlueprintを作成（管理者専用ページ）
+bp = Blueprint('admin', __name__, url_prefix='/admin')
+
+@bp.route('/diaries/<int:diary_id>/history')
+@admin_required
+def history(diary_id):
+    """1件の日記の消火・再点火の履歴（新しい順）"""
+    diary = Diary.admin_query().get_or_404(diary_id)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = current_app.config['ADMIN_SEARCH_PER_PAGE']
+
+    rows = ModerationEvent.query.filter_by(diary_id=diary_id) \
+        .order_by(ModerationEvent.created_at.desc(), ModerationEvent.id.desc()) \
+        .offset((page - 1) * per_page).limit(per_page + 1).all()
+    pagination = SearchPage(rows[:per_page], page, len(rows) > per_page, {'diary_id': diary_id})
+
+    return render_template('history.html', diary=diary, events=pagination.items, pagination=pagination)
+
+
+@bp.route('/cold')
+@admin_required
+def cold_search():
+    """冷たい保管庫（古い夜）の検索"""
+    query_text = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    pagination = None
+    if query_text:
+        pagination = search_cold(query_text, page, current_app.config['ADMIN_SEARCH_PER_PAGE'])
+    return render_template('cold_search.html', search_query=query_text, pagination=pagination,
+                           diaries=pagination.items if pagination else [])
+
+
+@bp.route('/export')
+@admin_required
+def export():
+    """日記を NDJSON / CSV で書き出す（少しずつ読んで送るので、件数が多くてもメモリは一定）"""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        abort(400)
+    try:
+        since = date.fromisoformat(request.args['from']) if request.args.get('from') else None
+        until = date.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        abort(400)
+    hidden = {'1': True, '0': False}.get(request.args.get('hidden', ''))
+
+    chunks = iter_export(
+        fmt,
+        since=since,
+        until=until,
+        hidden=hidden,
+        ip_hash=request.args.get('ip_hash') or None,
+        include_archived=request.args.get('archived') == '1',
+    )
+    filename = f"yotakibi-diaries-{datetime.now():%Y%m%d-%H%M}.{fmt}"
+    response = Response(stream_with_context(chunks), mimetype=FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    # nginx などの手前のプロキシに溜め込ませない
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# 統計で1ページに出す夜の数
+STATS_NIGHTS = 30
+
+
+def _stats_args():
+    """?before=YYYY-MM-DD（この夜より前）と ?nights=数"""
+    try:
+        before = date.fromisoformat(request.args['before']) if request.args.get('before') else None
+    except ValueError:
+        abort(400)
+    limit = min(max(request.args.get('nights', STATS_NIGHTS, type=int), 1), 366)
+    return before, limit
+
+
+@bp.route('/stats')
+@admin_required
+def stats():
+    """夜ごとの統計（集計行だけを読むので、日記が何件あっても軽い）"""
+    before, limit = _stats_args()
+    summaries, totals = night_summaries(limit, before)
+    older = summaries[-1]['night'] if len(summaries) == limit else None
+    return render_template('admin_stats.html', summaries=summaries, totals=totals, older=older, before=before)
+
+
+@bp.route('/stats.json')
+@admin_required
+def stats_json():
+    """夜ごとの統計の JSON（older を次の ?before= に渡すと、さらに古い夜を読める）"""
+    before, limit = _stats_args()
+    summaries, totals = night_summaries(limit, before)
+    older = summaries[-1]['night'] if len(summaries) == limit else None
+    response = jsonify({'nights': summaries, 'totals': totals, 'older': older})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@bp.route('/profiles')
+@admin_required
+def profiles():
+    """最近のプロファイルの一覧"""
+    rate, until = profiler.sampling() if profiler.enabled else (0.0, None)
+    return render_template('admin_profiles.html', profiles=profiler.recent(), enabled=profiler.enabled,
+                           rate=rate, until=until, endpoints=profiler.endpoints)
+
+
+@bp.route('/profiles/sampling', methods=['POST'])
+@admin_required
+def profiles_sampling():
+    """抜き取りの割合を、時間を区切って変える（全ワーカーに効く）"""
+    if not profiler.enabled:
+        abort(404)
+    rate = request.form.get('rate', type=float)
+    minutes = request.form.get('minutes', 10, type=int)
+    if rate is None or not 0 <= rate <= 1 or not 1 <= minutes <= 24 * 60:
+        flash('割合は 0〜1、時間は 1〜1440 分で指定してください。', 'error')
+        return redirect(url_for('admin.profiles'))
+    profiler.set_sampling(rate, minutes * 60)
+    flash(f'{minutes} 分間、{rate:.1%} のリクエストを測ります。', 'success')
+    return redirect(url_for('admin.profiles'))
+
+
+@bp.route('/profiles/<profile_id>.<extension>')
+@admin_required
+def profile_file(profile_id, extension):
+    """プロファイルのファイル（.folded / .pstats / .json）"""
+    path = profiler.path_for(profile_id, extension) if profiler.enabled else None
+    if path is None:
+        abort(404)
+    try:
+        return send_file(path, mimetype=PROFILE_FILES[extension], as_attachment=extension != 'json',
+                         download_name=f"{profile_id}.{extension}")
+    except FileNotFoundError:
+        abort(404)
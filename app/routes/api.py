@@ -0,0 +1,119 @@
+import queue
+import time
+from flask import Blueprint, request, jsonify, current_app, Response, abort
+from ..embers import latest_cursor, fetch_delta, catch_up, has_gap, narrow_delta, format_sse
+from ..extensions import db
+from ..extensions import embers, metrics
+from ..utils import fire_required
+
+# 'api' という名前のBlueprintを作成（ブラウザの JS から読む JSON / SSE）
+bp = Blueprint('api', __name__, url_prefix='/api')
+
+# SSE の接続が切れていないことを確かめる空行を送る間隔（秒）
+HEARTBEAT_SECONDS = 15
+
+
+def _cursor_from_request():
+    """
+    しおり (日記ID, 操作記録ID) を読む。?after=&events_after= か、SSE の再接続時の Last-Event-ID（"12:3"）。
+    無い方は「いまの最新」から始める
+    """
+    after = request.args.get('after', type=int)
+    events_after = request.args.get('events_after', type=int)
+
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    if ':' in last_event_id:
+        head, _, tail = last_event_id.partition(':')
+        if head.isdigit() and tail.isdigit():
+            after, events_after = int(head), int(tail)
+
+    if after is None or events_after is None:
+        newest_id, newest_event = latest_cursor()
+        after = newest_id if after is None else after
+        events_after = newest_event if events_after is None else events_after
+    return after, events_after
+
+
+@bp.route('/embers')
+@fire_required
+def embers_delta():
+    """しおりより後に灯った火と、消火・再点火の記録（JSON。truncated なら cursor から続きを読む）"""
+    delta = fetch_delta(*_cursor_from_request())
+    delta['stream'] = embers.enabled
+    response = jsonify(delta)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@bp.route('/embers/stream')
+@fire_required
+def embers_stream():
+    """同じ差分を Server-Sent Events で押し出す（EMBERS_STREAM_ENABLED のときだけ）"""
+    if not embers.enabled:
+        abort(404)
+
+    after, events_after = _cursor_from_request()
+    max_seconds = current_app.config.get('EMBERS_STREAM_MAX_SECONDS', 300)
+    app = current_app._get_current_object()
+
+    q = embers.subscribe()
+    metrics.registry.set_gauge('yotakibi_sse_connections', embers.subscriber_count)
+    try:
+        # 接続するまでの間に灯った分は、先にここで（上限で切られなくなるまで）取り戻す
+        first = list(catch_up(after, events_after))
+    except Exception:
+        embers.unsubscribe(q)
+        raise
+
+    def generate():
+        cursor = (after, events_after)
+        deadline = time.monotonic() + max_seconds
+        try:
+            yield 'retry: 5000\n\n'
+            deltas = first
+            while True:
+                for delta in deltas:
+                    cursor = (delta['cursor']['after'], delta['cursor']['events_after'])
+                    if delta['embers'] or delta['events'] or delta['truncated']:
+                        yield format_sse(delta, event='embers', event_id=f"{cursor[0]}:{cursor[1]}")
+                    if delta['truncated']:
+                        # 追いつけないほど離れていた：ブラウザには読みにいく方式で続きを取らせる
+                        return
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    shared = q.get(timeout=min(HEARTBEAT_SECONDS, remaining))
+                except queue.Empty:
+                    deltas = []
+                    yield ': ping\n\n'
+                    continue
+                if shared is None:
+                    # 読み遅れで配信係から外された
+                    return
+                if not has_gap(shared, *cursor):
+                    deltas = [narrow_delta(shared, *cursor)]
+                    continue
+
+                # 配信係の差分が、この接続のしおりより先から始まっている：間の分をDBから取り戻す
+                with app.app_context():
+                    try:
+                        deltas = list(catch_up(*cursor))
+                    finally:
+                        db.session.remove()
+                if deltas and not deltas[-1]['truncated']:
+                    # 取り戻したのは配信係の差分より後なので、その分も含んでいる。しおりを配信係に合わせて進めておく
+                    # （消火済みの投稿などでしおりが配信係より手前に残り、毎回取り戻しにいかないように）
+                    last = deltas[-1]['cursor']
+                    last['after'] = max(last['after'], shared['cursor']['after'])
+                    last['events_after'] = max(last['events_after'], shared['cursor']['events_after'])
+        finally:
+            embers.unsubscribe(q)
+            metrics.registry.set_gauge('yotakibi_sse_connections', embers.subscriber_count)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # nginx などの前段にバッファさせない
+        'X-Accel-Buffering': 'no',
+    })
@@ -0,0 +1,53 @@
+import os
+from datetime import date, timedelta, datetime
+from flask import Blueprint, render_template, abort, current_app
+from ..assets import send_precompressed
+from ..extensions import snapshots
+
+# 'archive' という名前のBlueprintを作成（過去の夜のスナップショット）
+bp = Blueprint('archive', __name__, url_prefix='/archive')
+
+
+def _parse_night(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        abort(404)
+
+
+@bp.route('/')
+def nights():
+    """書き出し済みの夜の一覧（DBには触れない。ただし昨夜の分や、消されて書き直し待ちの夜は書き出す）"""
+    last_night = snapshots.night_of(datetime.now()) - timedelta(days=1)
+    snapshots.ensure(last_night)
+
+    manifest = snapshots.manifest()
+    stale = [night for night, count in manifest.items() if count is None]
+    if stale:
+        for night in stale:
+            snapshots.ensure(date.fromisoformat(night))
+        manifest = snapshots.manifest()
+    nights = [(date.fromisoformat(night), count)
+              for night, count in sorted(manifest.items(), reverse=True) if count is not None]
+    return render_template('archive_index.html', nights=nights)
+
+
+@bp.route('/<night>')
+def night(night):
+    """その夜のスナップショット（HTML）"""
+    path = snapshots.ensure(_parse_night(night))
+    if path is None:
+        abort(404)
+    return send_precompressed(path, f"public, max-age={current_app.config['SNAPSHOT_MAX_AGE']}")
+
+
+@bp.route('/<night>.json')
+def night_json(night):
+    """その夜のスナップショット（JSON）"""
+    parsed = _parse_night(night)
+    if snapshots.ensure(parsed) is None:
+        abort(404)
+    path = snapshots.path_for(parsed, 'json')
+    if not os.path.exists(path):
+        abort(404)
+    return send_precompressed(path, f"public, max-age={current_app.config['SNAPSHOT_MAX_AGE']}")
@@ -1,149 +1,80 @@
-# import os
-# import json
-# import google.generativeai as genai
-# from flask import Blueprint, request, jsonify, current_app
-# from ..models import Diary
-# from ..extensions import db, csrf
-# from ..utils import get_ip_hash
-# from ..ng_words import check_text_safety
-
-# bp = Blueprint('bot', __name__, url_prefix='/api/bot')
-
-# # AIの性格設定（プロンプト）
-# SYSTEM_PROMPT = """
-# あなたは「夜焚き火」という静かな日記共有サイトの住人です。
-# 以下の制約を守り、架空の日記（薪）と合言葉（種火）を1つ生成してください。
-
-# 【制約】
-# 1. 出力は必ず JSON形式 {"content": "...", "aikotoba": "..."} で行うこと。余計なmarkdown装飾は不要。
-# 2. 日記の内容（content）:
-#    - 20文字〜80文字程度の短い独り言。
-#    - 日常生活であったこと、楽しかったこと、悲しかったこと、美味しかった食べ物、日々の疲れ、など雑多な独り言。
-#    - 無理に詩的にせず、素朴な書き方で。
-#    - 誰かに語りかける必要はない。独り言のように。
-#    - AIであることを明かしてはいけない。
-#    - 攻撃的、政治的、公序良俗に反する内容は禁止。
-# 3. 合言葉（aikotoba）:
-#    - 英数字のランダムな羅列ではなく、意味のある単語やフレーズを入れる（例: "雨の匂い", "midnight_blue", "1998年の夏"など）。
-#    - 日本語でも英語でも可。
-
-# 【出力例】
-# {"content": "コンビニの帰り道、月がやけに綺麗で立ち止まった。アイスが溶けるのも忘れて見上げていた。", "aikotoba": "MeltingIce"}
-# """
-
-# @bp.route('/ignite', methods=['POST'])
-# @csrf.exempt
-# def ignite():
-#     # 1. セキュリティチェック
-#     env_secret = os.environ.get('AI_BOT_SECRET')
-#     req_secret = request.headers.get('X-Bot-Secret')
-
-#     # デバッグ用ログ：認証失敗時用
-#     if not env_secret:
-#         print("!!! BOT ERROR !!!: Environment variable 'AI_BOT_SECRET' is not set.", flush=True)
-#         return jsonify({"error": "Configuration error"}), 500
-
-#     if req_secret != env_secret:
-#         print(f"!!! BOT ERROR !!!: Authentication failed. Received: {req_secret}", flush=True)
-#         return jsonify({"error": "Unauthorized"}), 401
-
-#     # 2. Gemini APIの設定
-#     api_key = os.environ.get('GEMINI_API_KEY')
-#     if not api_key:
-#         print("!!! BOT ERROR !!!: Environment variable 'GEMINI_API_KEY' is not set.", flush=True)
-#         return jsonify({"error": "No API Key configured"}), 500
-
-#     genai.configure(api_key=api_key)
-#     model = genai.GenerativeModel("gemini-2.5-flash")
-
-#     try:
-#         # 3. 生成実行
-#         response = model.generate_content(
-#             contents=SYSTEM_PROMPT,
-#             generation_config={"response_mime_type": "application/json"}
-#         )
-        
-#         # 結果をパース
-#         data = json.loads(response.text)
-#         content = data.get('content')
-#         aikotoba = data.get('aikotoba')
-
-#         if not content or not aikotoba:
-#             raise ValueError("Generated JSON is missing 'content' or 'aikotoba'")
-
-#         # 4. 安全性チェック
-#         is_safe, msg = check_text_safety(content)
-#         if not is_safe:
-#             print(f"!!! BOT WARNING !!!: Unsafe content generated -> {content}", flush=True)
-#             return jsonify({"error": "Unsafe content generated", "details": msg}), 400
-
-#         # 5. DBに保存
-#         bot_ip_hash = get_ip_hash("AI_FIRE_KEEPER_BOT")
-        
-#         new_diary = Diary(
-#             content=content,
-#             aikotoba=aikotoba,
-#             ip_hash=bot_ip_hash,
-#             user_agent="Yotakibi AI FireKeeper/1.0",
-#             is_hidden=False
-#         )
-        
-#         db.session.add(new_diary)
-#         db.session.commit()
-        
-#         print(f"!!! BOT SUCCESS !!!: Ignited fire. ID: {new_diary.id}", flush=True)
-
-#         return jsonify({
-#             "message": "Fire ignited successfully.",
-#             "generated": {"content": content, "aikotoba": aikotoba}
-#         })
-
-#     except Exception as e:
-#         # ここでRenderのログにエラーの正体を表示する
-#         print(f"!!! BOT ERROR !!!: {e}", flush=True)
-#         return jsonify({"error": str(e)}), 500
-    
-    
-# # ↓↓↓ ここから追記 ↓↓↓
-
-# @bp.route('/say', methods=['POST'])
-# @csrf.exempt
-# def say():
-#     # 1. セキュリティチェック（igniteと同じ）
-#     env_secret = os.environ.get('AI_BOT_SECRET')
-#     req_secret = request.headers.get('X-Bot-Secret')
-
-#     if not env_secret or req_secret != env_secret:
-#         return jsonify({"error": "Unauthorized"}), 401
-
-#     # 2. 送られてきたメッセージを受け取る
-#     data = request.get_json()
-#     content = data.get('content')
-#     aikotoba = data.get('aikotoba', '管理人') # 指定がなければ「管理人」にする
-
-#     if not content:
-#         return jsonify({"error": "No content provided"}), 400
-
-#     try:
-#         # 3. DBにそのまま保存（AI生成はしない）
-#         # IPハッシュはBot用の固定値
-#         bot_ip_hash = get_ip_hash("SYSTEM_MESSAGE_BOT")
-        
-#         new_diary = Diary(
-#             content=content,
-#             aikotoba=aikotoba,
-#             ip_hash=bot_ip_hash,
-#             user_agent="Yotakibi System/1.0",
-#             is_hidden=False
-#         )
-        
-#         db.session.add(new_diary)
-#         db.session.commit()
-        
-#         print(f"!!! SYSTEM MSG SUCCESS !!!: Posted: {content}", flush=True)
-
-#         return jsonify({"message": "Message posted successfully."})
-
-#     except Exception as e:
-#         print(f"!!! SYSTEM MSG ERROR !!!: {e}", flush=True)
-#         return jsonify({"error": str(e)}), 500
\ No newline at end of file
+import hmac
+from flask import Blueprint, request, jsonify, current_app
+from ..models import Diary
+from ..extensions import db, csrf, timeline_cache, firekeeper
+from ..firekeeper import GenerationError
+from ..stats import record_posts
+from ..utils import get_ip_hash, derive_content_fields
+
+bp = Blueprint('bot', __name__, url_prefix='/api/bot')
+
+# 固定メッセージ（開店・閉店の挨拶など）の投稿者
+SYSTEM_IP_LABEL = 'SYSTEM_MESSAGE_BOT'
+SYSTEM_USER_AGENT = 'Yotakibi System/1.0'
+
+
+def _authorized():
+    """X-Bot-Secret が設定と一致するか。設定が無ければ常に拒否"""
+    secret = current_app.config.get('BOT_SECRET')
+    if not secret:
+        current_app.logger.error("bot: AI_BOT_SECRET is not set")
+        return False
+    return hmac.compare_digest(request.headers.get('X-Bot-Secret', ''), secret)
+
+
+@bp.route('/ignite', methods=['POST'])
+@csrf.exempt
+def ignite():
+    """火の番のバッチを裏で始めてすぐ返す（生成・確認・公開は firekeeper.py）"""
+    if not _authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+
+    data = request.get_json(silent=True) or {}
+    count = data.get('count')
+    if count is not None and (not isinstance(count, int) or not 1 <= count <= 50):
+        return jsonify({"error": "count must be 1-50"}), 400
+
+    try:
+        # 裏方の準備（GEMINI_API_KEY が無いなどの設定不足は、裏に回す前にここで断る）
+        firekeeper.generator
+    except GenerationError as e:
+        current_app.logger.error(f"bot: generator is not configured: {e}")
+        return jsonify({"error": "Generator is not configured", "detail": str(e)}), 500
+
+    if not firekeeper.ignite(count):
+        # 前のバッチがまだ走っている（cron が別のワーカーに重なっても二重には灯さない）
+        return jsonify({"message": "A batch is already burning.", "last": firekeeper.last_result}), 409
+
+    return jsonify({
+        "message": "Batch started.",
+        "count": count or firekeeper.batch_size,
+        "last": firekeeper.last_result,
+    }), 202
+
+
+@bp.route('/say', methods=['POST'])
+@csrf.exempt
+def say():
+    """送られてきたメッセージをそのまま灯す（AI生成はしない）"""
+    if not _authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+
+    data = request.get_json(silent=True) or {}
+    content = data.get('content')
+    aikotoba = data.get('aikotoba', '管理人')  # 指定がなければ「管理人」にする
+    if not content:
+        return jsonify({"error": "No content provided"}), 400
+
+    diary = Diary(
+        content=content,
+        aikotoba=aikotoba,
+        ip_hash=get_ip_hash(SYSTEM_IP_LABEL),
+        user_agent=SYSTEM_USER_AGENT,
+        is_hidden=False,
+        **derive_content_fields(content)
+    )
+    db.session.add(diary)
+    record_posts([diary])
+    db.session.commit()
+    timeline_cache.bump()
+    return jsonify({"message": "Message posted successfully."})
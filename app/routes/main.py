@@ -1,7 +1,10 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session
-from sqlalchemy import or_
+from flask import Blueprint, render_template, request, redirect, url_for, session, current_app
 from ..models import Diary
-from ..utils import fire_required
+from ..extensions import timeline_cache, write_queue
+from ..utils import fire_required, is_public_view, hash_aikotoba
+from ..pagination import keyset_paginate
+from ..search import search_diaries, paginate_by_page
+from ..freshness import timeline_validator, not_modified, with_validator
 
 # 'main' という名前のBlueprintを作成
 bp = Blueprint('main', __name__)
@@ -9,23 +12,56 @@ bp = Blueprint('main', __name__)
 @bp.route('/')
 @fire_required
 def index():
-    page = request.args.get('page', 1, type=int)
-    per_page = 10 
+    per_page = current_app.config['TIMELINE_PER_PAGE']
     
     # 【変更前】
     # query = Diary.query.filter_by(is_hidden=False)
     
     # 【変更後】管理者は隠された火（消火済み）も見れるようにする
     if session.get('is_admin'):
-        query = Diary.query # 全件取得（is_hiddenで絞り込まない）
+        query = Diary.admin_query() # 全件取得（is_hiddenで絞り込まない）
     else:
-        query = Diary.query.filter_by(is_hidden=False) # 一般人は隠された火は見えない
+        # 一般人は隠された火は見えない。画面に出す列だけを軽い行で読む
+        query = Diary.timeline_query().filter(Diary.is_hidden == False)
     
-    pagination = query.order_by(Diary.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
+    # 誰が見ても同じページなら、前回から変わっていなければ304、変わっていても描画済みのHTMLを使い回す
+    cache_key = None
+    validator = None
+    if is_public_view():
+        # 世代番号は行を読む前に1度だけ読み、検証子・キャッシュの読み書きのすべてで同じ値を使う
+        generation = timeline_cache.generation
+        validator = timeline_validator(generation)
+        unchanged = not_modified(validator)
+        if unchanged is not None:
+            return unchanged
+
+        cache_key = f"index:{request.args.get('before', '')}:{request.args.get('after', '')}"
+        cached = timeline_cache.get(cache_key, generation)
+        if cached is not None:
+            return with_validator(cached, validator)
+    
+    # ページ番号ではなく「しおり（カーソル）」で前後に移動する（COUNT/OFFSET 不要）
+    pagination = keyset_paginate(
+        query, Diary.created_at, Diary.id, per_page,
+        before=request.args.get('before'),
+        after=request.args.get('after'),
     )
     
-    return render_template('index.html', diaries=pagination.items, pagination=pagination)
+    # DBへの反映待ちの自分の投稿は、先頭ページの一番上に出しておく
+    pending_diaries = []
+    if session.get('pending_posts'):
+        pending_diaries = write_queue.pending_for(session['pending_posts'])
+        if len(pending_diaries) != len(session['pending_posts']):
+            # 反映済みになったものはセッションから外す
+            session['pending_posts'] = [d.uuid for d in reversed(pending_diaries)]
+        if pagination.has_prev:
+            pending_diaries = []
+    
+    html = render_template('index.html', diaries=pagination.items, pagination=pagination,
+                           pending_diaries=pending_diaries)
+    if cache_key:
+        timeline_cache.set(cache_key, html, generation)
+    return with_validator(html, validator)
 
 @bp.route('/search')
 @fire_required
@@ -36,47 +72,59 @@ def search():
     
     # --- 管理者用のスーパー検索ロジック ---
     if session.get('is_admin'):
-        query_obj = Diary.query
+        page = request.args.get('page', 1, type=int)
+        per_page = current_app.config['ADMIN_SEARCH_PER_PAGE']
+        extra_params = {'q': query_text}
+        query_obj = Diary.admin_query()
         
         # 1. ID検索 (例: "#105") 【変更】#で始まる場合のみID検索
         if query_text.startswith('#') and query_text[1:].isdigit():
             d_id = int(query_text[1:]) # #を取り除いて数値化
             query_obj = query_obj.filter(Diary.id == d_id)
+            pagination = paginate_by_page(query_obj, page, per_page, extra_params)
 
         # 2. 範囲検索 (例: "100-150")
         elif '-' in query_text and query_text.replace('-', '').isdigit():
             try:
                 start, end = map(int, query_text.split('-'))
                 query_obj = query_obj.filter(Diary.id.between(start, end))
+                pagination = paginate_by_page(query_obj, page, per_page, extra_params)
             except ValueError:
                 # パース失敗時は通常検索へ
-                query_obj = query_obj.filter(
-                    or_(
-                        Diary.content.contains(query_text),
-                        Diary.aikotoba.contains(query_text)
-                    )
-                )
+                pagination = search_diaries(query_text, page, per_page)
 
         # 3. 通常検索 (数字だけでもここに来る)
         else:
-            # 本文検索 or 種火検索 (部分一致)
-            query_obj = query_obj.filter(
-                or_(
-                    Diary.content.contains(query_text),
-                    Diary.aikotoba.contains(query_text)
-                )
-            )
+            # 本文検索 or 種火検索 (トライグラム索引で部分一致、関連度順)
+            pagination = search_diaries(query_text, page, per_page)
             
-        results = query_obj.order_by(Diary.created_at.desc()).all()
+        return render_template('index.html', diaries=pagination.items, pagination=pagination, search_query=query_text)
 
     # --- 一般ユーザー用の通常検索ロジック ---
+    validator = None
+    if is_public_view():
+        validator = timeline_validator()
+        unchanged = not_modified(validator)
+        if unchanged is not None:
+            return unchanged
+
+    if current_app.config['AIKOTOBA_HASH_LOOKUP']:
+        condition = Diary.aikotoba_hash == hash_aikotoba(query_text)
     else:
-        results = Diary.query.filter_by(
-            aikotoba=query_text,
-            is_hidden=False
-        ).order_by(Diary.created_at.desc()).all()
+        condition = Diary.aikotoba == query_text
+    query = Diary.timeline_query().filter(condition, Diary.is_hidden == False)
+
+    # タイムラインと同じく、しおり方式で1ページずつ
+    pagination = keyset_paginate(
+        query, Diary.created_at, Diary.id, current_app.config['TIMELINE_PER_PAGE'],
+        before=request.args.get('before'),
+        after=request.args.get('after'),
+        extra_params={'q': query_text},
+    )
     
-    return render_template('index.html', diaries=results, search_query=query_text)
+    html = render_template('index.html', diaries=pagination.items, pagination=pagination, search_query=query_text)
+    return with_validator(html, validator)
+
 @bp.route('/manual')
 def manual():
     source = request.args.get('source', 'index')
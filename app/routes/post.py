@@ -1,10 +1,13 @@
-from datetime import datetime, timedelta
+import uuid
+from datetime import datetime
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash, current_app
 from ..models import Diary
-from ..extensions import db
-from ..utils import get_ip_hash
+from ..extensions import db, timeline_cache, post_limiter, write_queue, snapshots, flood_guard, metrics
+from ..utils import get_ip_hash, derive_content_fields
 
 from ..ng_words import check_text_safety  # 【追加】
+from ..moderation import build_criterion, set_hidden, bulk_set_hidden, TARGET_TYPES
+from ..stats import record_posts
 
 # 'post' という名前のBlueprintを作成
 bp = Blueprint('post', __name__)
@@ -23,19 +26,6 @@ def write():
         ip_hash = get_ip_hash(user_ip)
         user_agent = request.headers.get('User-Agent')
 
-        # --- 連投制限チェック (1時間に5回まで) ---
-        # 管理者は制限を受けない
-        if not session.get('is_admin'):
-            one_hour_ago = datetime.now() - timedelta(hours=1)
-            recent_count = Diary.query.filter(
-                Diary.ip_hash == ip_hash,
-                Diary.created_at >= one_hour_ago
-            ).count()
-
-            if recent_count >= 5:
-                flash('火事にならないように、薪は1時間に5本までとしています。焚き火をゆっくり眺めて、またあとで来てくださいね。', 'error')
-                return render_template('write.html', kept_content=content)
-
         # バリデーション
         if not content or not aikotoba:
             flash('薪と種火が必要です。', 'error')
@@ -71,6 +61,26 @@ def write():
             return render_template('write.html', kept_content=content)
         # ----------------------------------------
 
+        # --- 連投（ほぼ同じ文面の繰り返し）チェック ---
+        # IPを替えたり少し書き換えたりしたコピペの連投を、直近の投稿との文面の近さで見つける
+        flood = None
+        if not session.get('is_admin'):
+            flood = flood_guard.check(content)
+            if flood.is_flood:
+                metrics.registry.inc('yotakibi_flood_posts_total', {'action': flood_guard.action})
+                current_app.logger.warning(f"flood ({flood_guard.action}) ip={ip_hash[:12] if ip_hash else '-'}: {flood.describe()}")
+                if flood_guard.action == 'reject':
+                    flash('よく似た薪が、すでにいくつもくべられています。少し時間をおいてから、また来てくださいね。', 'error')
+                    return render_template('write.html', kept_content=content)
+
+        # --- 連投制限チェック (RATE_LIMIT_WINDOW 秒に RATE_LIMIT_POSTS 回まで) ---
+        # 管理者は制限を受けない。DBには触れずに、数えるのと記録するのを1度に行う
+        # （入力の誤りで断った分は数えないよう、保存の直前で）
+        if not session.get('is_admin'):
+            if not post_limiter.hit(ip_hash):
+                flash(f'火事にならないように、薪は{post_limiter.describe()}としています。焚き火をゆっくり眺めて、またあとで来てくださいね。', 'error')
+                return render_template('write.html', kept_content=content)
+
         # 日時の決定
         # 基本は現在時刻
         post_time = datetime.now()
@@ -86,18 +96,38 @@ def write():
                     pass
 
         # 保存
-        new_diary = Diary(
+        is_flood = flood is not None and flood.is_flood
+        new_diary = dict(
+            uuid=str(uuid.uuid4()),
             content=content, 
             aikotoba=aikotoba, 
             created_at=post_time,
             ip_hash=ip_hash,
             user_agent=user_agent,
-            is_hidden=False
+            # 連投とみなした投稿は、消火した状態で受け付け、似ていた投稿をメモに残す
+            is_hidden=is_flood,
+            admin_memo=flood.describe() if is_flood else None,
+            # 文字数・折りたたみ・検索用テキストなどは、ここで1度だけ計算して保存する
+            **derive_content_fields(content)
         )
         
-        db.session.add(new_diary)
-        db.session.commit()
-        
+        if write_queue.enabled:
+            # ジャーナルに積むだけで返す（DBへは裏でまとめて書き込まれる）
+            # 反映されるまでは、書いた本人にだけセッション経由で見せる
+            new_uuid = write_queue.enqueue(new_diary)
+            session['pending_posts'] = (session.get('pending_posts') or [])[-4:] + [new_uuid]
+        else:
+            db.session.add(Diary(**new_diary))
+            # 夜ごとの集計も同じトランザクションで足す
+            record_posts([new_diary])
+            db.session.commit()
+            timeline_cache.bump()
+            # 管理者が過去の夜の日時で書いた場合は、その夜のスナップショットを書き直させる
+            snapshots.invalidate([post_time])
+
+        # DBに入る前の分も、次の判定から数えられるように索引へ入れておく
+        flood_guard.add(new_diary['uuid'], content, post_time)
+
         session['has_posted'] = True
         session['my_aikotoba'] = aikotoba
         
@@ -115,29 +145,43 @@ def extinguish(diary_id):
     
     # 【変更】トグル機能にする（TrueならFalseへ、FalseならTrueへ）
     # これにより、間違って消してももう一度ボタンを押せば復活できます
-    diary.is_hidden = not diary.is_hidden
-    
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M')
+    # 操作の記録は admin_memo ではなく、操作履歴（moderation_events）に1行積む
+    set_hidden(diary, not diary.is_hidden)
     
     if diary.is_hidden:
         action_name = "消火（非表示）"
-        auto_msg = f"[{timestamp}] 管理操作による消火"
     else:
         action_name = "再点火（表示再開）"
-        auto_msg = f"[{timestamp}] 管理操作による再点火"
-    
-    if diary.admin_memo:
-        diary.admin_memo += f"\n{auto_msg}"
-    else:
-        diary.admin_memo = auto_msg
-        
-    db.session.commit()
 
     flash(f'種火 #{diary.id} を{action_name}しました。', 'success')
     
     # 【変更】直前のページ（検索画面など）に戻る。なければトップへ。
     return redirect(request.referrer or url_for('main.index'))
 
+@bp.route('/extinguish/bulk', methods=['POST'])
+def bulk_extinguish():
+    if not session.get('is_admin'):
+        flash('その操作は許可されていません。', 'error')
+        return redirect(url_for('main.index'))
+
+    target_type = request.form.get('target_type', 'ids')
+    target = request.form.get('target')
+    hidden = request.form.get('action', 'hide') != 'restore'
+
+    try:
+        criterion = build_criterion(target_type, target)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(request.referrer or url_for('main.index'))
+
+    # 状態の書き換えと、1行ごとの操作記録を1つのトランザクションで
+    label = TARGET_TYPES.get(target_type, target_type)
+    count = bulk_set_hidden(criterion, hidden, note=f'一括: {label} {target}'[:255])
+
+    action_name = "消火（非表示）" if hidden else "再点火（表示再開）"
+    flash(f'{label}「{target}」に当てはまる {count} 件の火を{action_name}しました。', 'success')
+    return redirect(request.referrer or url_for('main.index'))
+
 @bp.route('/memo/<int:diary_id>', methods=['POST'])
 def update_memo(diary_id):
     if not session.get('is_admin'):
@@ -149,6 +193,7 @@ def update_memo(diary_id):
     
     diary.admin_memo = new_memo
     db.session.commit()
+    timeline_cache.bump()
     
     flash(f'種火 #{diary.id} の管理者メモを更新しました。', 'success')
     return redirect(url_for('main.index'))
\ No newline at end of file
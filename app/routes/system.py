@@ -1,6 +1,7 @@
-import os
-from datetime import datetime
-from flask import Blueprint, request, session, redirect, url_for, render_template
+import hmac
+from flask import Blueprint, request, session, redirect, url_for, render_template, current_app, Response
+from ..extensions import metrics as metrics_ext
+from ..metrics import render_prometheus
 
 bp = Blueprint('system', __name__)
 
@@ -9,9 +10,14 @@ def check_opening_hours():
     """
     全リクエストの前に実行される門番機能。
     URLパラメータによる「役（ロール）の切り替え」を最優先で処理します。
+    ※休業時間中の一般客の大半は、手前の ClosedHoursMiddleware が先に返しています。
     """
-    env_admin_key = os.environ.get('ADMIN_KEY', 'local_secret_open') 
-    env_ticket_key = os.environ.get('TICKET_KEY', 'local_secret_ticket')
+    # 指紋付きの静的ファイルは誰にでも同じものを返す（セッションに触れず、共有キャッシュに載せる）
+    if request.endpoint == 'assets':
+        return
+
+    env_admin_key = current_app.config['ADMIN_KEY']
+    env_ticket_key = current_app.config['TICKET_KEY']
 
     # --- 1. 役の切り替えスイッチ (Role Switching) ---
     
@@ -53,31 +59,36 @@ def check_opening_hours():
 
     # --- 3. 一般客向けの入場チェック ---
 
-    # 静的ファイルはチェックしない
-    if request.path.startswith('/static'):
+    # 静的ファイルや /metrics など、いつでも開けておくパスはチェックしない
+    if request.path.startswith(tuple(current_app.config['ALWAYS_OPEN_PATHS'])):
         return
 
     # マニュアルとルールはいつでも見れる
     if request.endpoint in ['main.manual', 'main.rules']:
         return
 
-    # 営業時間チェック
-    now = datetime.now()
-    hour = now.hour
-    is_open = (hour >= 19) or (hour < 1)
+    # 営業時間チェック（時刻の表は起動時に作ってある）
+    is_open, reason, _ = current_app.extensions['opening_schedule'].state()
     
     if not is_open:
         if request.endpoint == 'system.sleeping':
             return
         
-        if 0 <= hour < 6:
-            reason = 'midnight'
-        else:
-            reason = 'daytime'
-        
         return redirect(url_for('system.sleeping', reason=reason))
 
 @bp.route('/sleeping')
 def sleeping():
     reason = request.args.get('reason', 'daytime')
-    return render_template('sleeping.html', reason=reason)
\ No newline at end of file
+    return render_template('sleeping.html', reason=reason)
+
+@bp.route('/metrics')
+def metrics():
+    """全ワーカーぶんの計測値を Prometheus のテキスト形式で返す（管理者またはトークン）"""
+    token = current_app.config.get('METRICS_TOKEN')
+    auth = request.headers.get('Authorization', '')
+    has_token = bool(token) and hmac.compare_digest(auth, f'Bearer {token}')
+    if not session.get('is_admin') and not has_token:
+        return Response('Forbidden', status=403, mimetype='text/plain')
+
+    body = render_prometheus(metrics_ext.collect())
+    return Response(body, mimetype='text/plain; version=0.0.4; charset=utf-8')
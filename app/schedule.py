@@ -0,0 +1,75 @@
+import time
+from datetime import datetime, timedelta
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python 3.8 以前
+    ZoneInfo = None
+
+"""
+営業時間（火が灯っている時間）の判定
+24時間ぶんの「開いているか」を起動時に表にしておき、
+さらに「次に状態が変わる時刻」まで判定結果を使い回すので、毎リクエストの計算はほぼゼロです。
+"""
+
+
+class OpeningSchedule:
+    def __init__(self, open_hour=19, close_hour=1, midnight_end_hour=6, timezone=None):
+        self.tz = ZoneInfo(timezone) if (timezone and ZoneInfo) else None
+
+        # 時刻（0〜23時）ごとの営業・休業理由の表
+        self._open_by_hour = tuple(
+            (open_hour <= h or h < close_hour) if open_hour > close_hour else (open_hour <= h < close_hour)
+            for h in range(24)
+        )
+        self._reason_by_hour = tuple(
+            'midnight' if h < midnight_end_hour else 'daytime'
+            for h in range(24)
+        )
+
+        # 判定結果のキャッシュ（この時刻までは同じ結果）
+        self._valid_until = 0.0
+        self._state = (False, 'daytime')
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            open_hour=config.get('OPEN_HOUR', 19),
+            close_hour=config.get('CLOSE_HOUR', 1),
+            midnight_end_hour=config.get('MIDNIGHT_END_HOUR', 6),
+            timezone=config.get('SITE_TIMEZONE'),
+        )
+
+    def now(self):
+        """設定されたタイムゾーンでの現在時刻（未設定ならサーバーの現地時刻）"""
+        return datetime.now(self.tz) if self.tz else datetime.now()
+
+    def _compute(self, now):
+        hour = now.hour
+        is_open = self._open_by_hour[hour]
+        # 次の「時」の境目まで同じ結果になる
+        next_hour = now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        return (is_open, self._reason_by_hour[hour]), (next_hour - now).total_seconds()
+
+    def state(self):
+        """(営業中か, 休業理由 'midnight'/'daytime', 状態が変わるまでの秒数) を返す"""
+        current = time.time()
+        if current >= self._valid_until:
+            self._state, remaining = self._compute(self.now())
+            self._valid_until = current + remaining
+        return self._state[0], self._state[1], self._valid_until - current
+
+    def is_open(self):
+        return self.state()[0]
+
+    def seconds_until_open(self):
+        """次に火が灯るまでの秒数（営業中なら 0）"""
+        is_open, _, remaining = self.state()
+        if is_open:
+            return 0
+        hours = 0
+        hour = (self.now().hour + 1) % 24
+        while not self._open_by_hour[hour] and hours < 24:
+            hours += 1
+            hour = (hour + 1) % 24
+        return remaining + hours * 3600
@@ -0,0 +1,104 @@
+import re
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from .extensions import db
+
+"""
+既存DBのスキーマ追従
+db.create_all() は「無いテーブル」しか作らないため、
+既存テーブルへの列・インデックス追加はここで補います（何度実行しても安全）。
+モデルで列の並びを変えたインデックスは、作り直します。
+
+起動のたびに全ワーカーが同時に ALTER / CREATE INDEX すると、確認から作成までの間に競り合って起動に失敗し、
+PostgreSQL では索引を作り終えるまで diaries への書き込みも止まります。
+そこで追加はデプロイ時に1度だけ `flask upgrade-schema` で行い、起動時は足りないものがあれば警告するだけにします。
+PostgreSQL の索引は CREATE INDEX CONCURRENTLY で、書き込みを止めずに作ります。
+"""
+
+
+def missing_schema():
+    """
+    モデル定義にあって実DBに無い (列のリスト [(表, 列)], インデックスのリスト) を返す。
+    同じ名前でも列の並びがモデルと違うインデックスは、作り直す分としてインデックスのリストに入れる
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+
+    columns, indexes = [], []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {c['name'] for c in inspector.get_columns(table.name)}
+        columns += [(table, column) for column in table.columns if column.name not in existing_columns]
+        existing_indexes = {i['name']: i['column_names'] for i in inspector.get_indexes(table.name)}
+        indexes += [
+            index for index in table.indexes
+            if existing_indexes.get(index.name) != [column.name for column in index.columns]
+        ]
+    return columns, indexes
+
+
+def warn_if_outdated(logger):
+    """足りない列・インデックスがあれば警告する（create_app から呼ぶ。DBは変えない）"""
+    columns, indexes = missing_schema()
+    if columns or indexes:
+        names = [f"{table.name}.{column.name}" for table, column in columns] + [index.name for index in indexes]
+        logger.warning(f"database schema is behind the models ({', '.join(names)}); run `flask upgrade-schema`")
+
+
+def _is_partitioned(conn, table_name):
+    return conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name))"
+    ), {'name': table_name}).scalar()
+
+
+def _create_index_postgresql(conn, index):
+    """
+    書き込みを止めずに索引を作る（conn は自動コミット。トランザクションの中では CONCURRENTLY が使えない）。
+    同じ名前の索引があれば（列の並びが古い・前回 CONCURRENTLY が途中で失敗して無効なまま、など）消してから作る
+    """
+    # パーティション分割した表には CONCURRENTLY が使えない（そのまま作る）
+    concurrently = 'CONCURRENTLY ' if not _is_partitioned(conn, index.table.name) else ''
+    conn.execute(text(f'DROP INDEX {concurrently}IF EXISTS {index.name}'))
+
+    statement = str(CreateIndex(index, if_not_exists=True).compile(dialect=conn.dialect))
+    statement = re.sub(r'^CREATE (UNIQUE )?INDEX ', rf'CREATE \1INDEX {concurrently}', statement)
+    conn.execute(text(statement))
+
+
+def upgrade_schema(echo=print):
+    """モデル定義にあって実DBに無い列・インデックスを追加し、足したものの数を返す"""
+    engine = db.engine
+    columns, indexes = missing_schema()
+    is_postgresql = engine.dialect.name == 'postgresql'
+
+    # 1. 列の追加（どれも NULL 可・既定値なしなので、表を書き直さずにすぐ終わる）
+    with engine.begin() as conn:
+        for table, column in columns:
+            col_type = column.type.compile(dialect=engine.dialect)
+            if_not_exists = 'IF NOT EXISTS ' if is_postgresql else ''
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {if_not_exists}{column.name} {col_type}'))
+            echo(f"列を追加しました: {table.name}.{column.name}")
+
+    # 2. インデックスの追加
+    if is_postgresql:
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            # 前回 CONCURRENTLY が途中で失敗して無効なまま残った索引も作り直す（列の並びは合っているので上では拾えない）
+            names = {index.name for index in indexes}
+            for table in db.metadata.sorted_tables:
+                for index in table.indexes:
+                    if index.name not in names and conn.execute(text(
+                        "SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(:name) AND NOT indisvalid"
+                    ), {'name': index.name}).first() is not None:
+                        indexes.append(index)
+            for index in indexes:
+                _create_index_postgresql(conn, index)
+                echo(f"インデックスを作りました: {index.name}")
+    else:
+        with engine.begin() as conn:
+            for index in indexes:
+                conn.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+                index.create(bind=conn)
+                echo(f"インデックスを作りました: {index.name}")
+
+    return len(columns) + len(indexes)
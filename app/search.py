@@ -0,0 +1,188 @@
+from flask import current_app
+from sqlalchemy import text, or_, and_
+from sqlalchemy.exc import DBAPIError
+from .extensions import db
+from .models import Diary
+from .ng_words import normalize_text
+
+"""
+管理者用の全文検索
+日本語は単語の区切りが無いため、3文字ずつの断片（トライグラム）で索引を作ります。
+
+- PostgreSQL : pg_trgm 拡張 + GIN インデックス（ILIKE '%q%' がインデックスで引ける）
+- SQLite     : FTS5 の trigram トークナイザ（SQLite 3.34 以降）
+どちらも使えない環境や、3文字未満の検索語では従来どおりの部分一致で探します。
+
+本文は書き込み時に正規化しておいた search_text を引くので、
+「ラーメン」で「らーめん」「ﾗｰﾒﾝ」も見つかります（検索語も同じ正規化をかけます）。
+search_text が空の古い日記が残っている間は索引を使わず、その日記は本文の部分一致で探します
+（`flask backfill-content-fields` で埋めたあと、次の起動から索引に切り替わります）。
+"""
+
+# トライグラムで引ける最短の検索語
+MIN_NGRAM_QUERY = 3
+
+# このプロセスで使える検索エンジン（setup_search_index で決まる）
+_engine_kind = 'like'
+
+
+def _run_ddl(statements):
+    """DDLを1文ずつ実行する。権限不足などで失敗したら False"""
+    try:
+        with db.engine.begin() as conn:
+            for statement in statements:
+                conn.execute(text(statement))
+        return True
+    except DBAPIError as e:
+        current_app.logger.warning(f"search index setup skipped: {e}")
+        return False
+
+
+def setup_search_index():
+    """検索用の索引を（無ければ）作る。create_app から毎回呼ばれても安全"""
+    global _engine_kind
+
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        ok = _run_ddl(['CREATE EXTENSION IF NOT EXISTS pg_trgm']) and _run_ddl([
+            'CREATE INDEX IF NOT EXISTS ix_diaries_search_text_trgm ON diaries USING gin (search_text gin_trgm_ops)',
+            'CREATE INDEX IF NOT EXISTS ix_diaries_aikotoba_trgm ON diaries USING gin (aikotoba gin_trgm_ops)',
+        ])
+        _engine_kind = 'pg_trgm' if ok else 'like'
+
+    elif dialect == 'sqlite':
+        with db.engine.connect() as conn:
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'diaries_fts'"
+            )).first() is not None
+
+        ok = _run_ddl([
+            # diaries を中身として参照する外部コンテンツ型の索引
+            "CREATE VIRTUAL TABLE IF NOT EXISTS diaries_fts USING fts5("
+            " search_text, aikotoba, content='diaries', content_rowid='id', tokenize='trigram')",
+            # diaries の変更を索引に追従させるトリガー
+            "CREATE TRIGGER IF NOT EXISTS diaries_fts_ai AFTER INSERT ON diaries BEGIN"
+            " INSERT INTO diaries_fts (rowid, search_text, aikotoba) VALUES (new.id, new.search_text, new.aikotoba);"
+            " END",
+            "CREATE TRIGGER IF NOT EXISTS diaries_fts_ad AFTER DELETE ON diaries BEGIN"
+            " INSERT INTO diaries_fts (diaries_fts, rowid, search_text, aikotoba)"
+            " VALUES ('delete', old.id, old.search_text, old.aikotoba);"
+            " END",
+            "CREATE TRIGGER IF NOT EXISTS diaries_fts_au AFTER UPDATE OF search_text, aikotoba ON diaries BEGIN"
+            " INSERT INTO diaries_fts (diaries_fts, rowid, search_text, aikotoba)"
+            " VALUES ('delete', old.id, old.search_text, old.aikotoba);"
+            " INSERT INTO diaries_fts (rowid, search_text, aikotoba) VALUES (new.id, new.search_text, new.aikotoba);"
+            " END",
+        ])
+        if ok and not exists:
+            # 既存の日記をまとめて索引に入れる
+            _run_ddl(["INSERT INTO diaries_fts (diaries_fts) VALUES ('rebuild')"])
+        _engine_kind = 'fts5' if ok else 'like'
+
+    else:
+        _engine_kind = 'like'
+
+    if _engine_kind != 'like' and _has_unfilled_rows():
+        # 索引は search_text しか見ないので、埋まっていない日記が検索から漏れる
+        current_app.logger.warning(
+            "search index not used: some diaries have no search_text yet; run `flask backfill-content-fields`"
+        )
+        _engine_kind = 'like'
+
+
+def _has_unfilled_rows():
+    """search_text がまだ空の日記があるか"""
+    return db.session.query(Diary.id).filter(Diary.search_text.is_(None)).limit(1).first() is not None
+
+
+class SearchPage:
+    """
+    ページ番号方式の検索結果（関連度順に並べるため、しおり方式は使えない）。
+    テンプレートからは KeysetPage と同じように扱えます。
+    """
+
+    def __init__(self, items, page, has_next, extra_params=None):
+        self.items = items
+        self.page = page
+        self.has_prev = page > 1
+        self.has_next = has_next
+        self.extra_params = extra_params or {}
+
+    @property
+    def prev_params(self):
+        if not self.has_prev:
+            return None
+        return dict(self.extra_params, page=self.page - 1)
+
+    @property
+    def next_params(self):
+        if not self.has_next:
+            return None
+        return dict(self.extra_params, page=self.page + 1)
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _ranked_ids(query_text, limit, offset):
+    """索引を使って、関連度の高い順に日記IDを返す"""
+    normalized = normalize_text(query_text)
+
+    if _engine_kind == 'fts5':
+        # 検索語全体を1つのフレーズとして扱う（FTS5の演算子として解釈させない）
+        def phrase(value):
+            return '"' + value.replace('"', '""') + '"'
+        match = f"search_text : {phrase(normalized)} OR aikotoba : {phrase(query_text)}"
+        rows = db.session.execute(text(
+            'SELECT rowid FROM diaries_fts WHERE diaries_fts MATCH :match'
+            ' ORDER BY bm25(diaries_fts), rowid DESC LIMIT :limit OFFSET :offset'
+        ), {'match': match, 'limit': limit, 'offset': offset})
+        return [row[0] for row in rows]
+
+    # pg_trgm：LIKE / ILIKE はGINインデックスで絞り込み、word_similarity で並べる
+    rows = db.session.execute(text(
+        "SELECT id FROM diaries"
+        " WHERE search_text LIKE :normalized_pattern ESCAPE '\\' OR aikotoba ILIKE :pattern ESCAPE '\\'"
+        " ORDER BY greatest(word_similarity(:normalized, search_text), word_similarity(:q, aikotoba)) DESC,"
+        " created_at DESC, id DESC"
+        " LIMIT :limit OFFSET :offset"
+    ), {
+        'pattern': f"%{_escape_like(query_text)}%", 'q': query_text,
+        'normalized_pattern': f"%{_escape_like(normalized)}%", 'normalized': normalized,
+        'limit': limit, 'offset': offset,
+    })
+    return [row[0] for row in rows]
+
+
+def search_diaries(query_text, page=1, per_page=20):
+    """本文・種火の部分一致検索。関連度順（索引が使えない場合は新しい順）に1ページ分返す"""
+    page = max(page, 1)
+    offset = (page - 1) * per_page
+    extra_params = {'q': query_text}
+
+    if _engine_kind != 'like' and len(query_text) >= MIN_NGRAM_QUERY:
+        ids = _ranked_ids(query_text, per_page + 1, offset)
+        has_next = len(ids) > per_page
+        ids = ids[:per_page]
+        by_id = {d.id: d for d in Diary.admin_query().filter(Diary.id.in_(ids))} if ids else {}
+        items = [by_id[i] for i in ids if i in by_id]
+        return SearchPage(items, page, has_next, extra_params)
+
+    query_obj = Diary.admin_query().filter(
+        or_(
+            Diary.search_text.contains(normalize_text(query_text), autoescape=True),
+            # search_text をまだ埋めていない古い日記は、本文そのもので探す
+            and_(Diary.search_text.is_(None), Diary.content.contains(query_text, autoescape=True)),
+            Diary.aikotoba.contains(query_text, autoescape=True)
+        )
+    )
+    return paginate_by_page(query_obj, page, per_page, extra_params)
+
+
+def paginate_by_page(query_obj, page=1, per_page=20, extra_params=None):
+    """新しい順に並べて1ページ分だけ読む（COUNTはしない）"""
+    page = max(page, 1)
+    rows = query_obj.order_by(Diary.created_at.desc(), Diary.id.desc()) \
+        .offset((page - 1) * per_page).limit(per_page + 1).all()
+    return SearchPage(rows[:per_page], page, len(rows) > per_page, extra_params)
@@ -0,0 +1,233 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta, time as dtime
+from flask import render_template
+from .assets import write_precompressed
+
+"""
+過去の夜のスナップショット
+火が灯るのは 19:00〜25:00 だけなので、終わった夜のタイムラインは
+管理者が消火・再点火しない限り二度と変わりません。
+そこで夜ごとに HTML と JSON を1度だけ書き出し（gzip / brotli 版も）、/archive/ ではファイルをそのまま返します。
+過去の夜を何ページ歩いても、DBには問い合わせません。
+
+夜の区切りは MIDNIGHT_END_HOUR 時（既定 6時）。
+たとえば 10/17 19:00 〜 10/18 5:59 の投稿は「10/17 の夜」です。
+
+消火・再点火・過去の日時での投稿があった夜は、ファイルを消しておき、次に開かれたときに書き直します。
+書き出し中に消された場合に古い中身を置いてしまわないよう、夜ごとの「世代」（<夜>.gen）を
+消すたびに変え、書き出しは一時ファイルに書いてから、世代が変わっていないことを確かめて置き換えます。
+"""
+
+# 夜ごとの件数などをまとめた一覧
+MANIFEST_NAME = 'nights.json'
+
+# 書き出し中に消された場合に、書き直す回数
+BUILD_ATTEMPTS = 3
+
+_SUFFIXES = ('', '.gz', '.br')
+
+
+def night_of(created_at, boundary_hour=6):
+    """投稿日時が属する夜（date）"""
+    return (created_at - timedelta(hours=boundary_hour)).date()
+
+
+def night_bounds(night, boundary_hour=6):
+    """その夜に属する投稿日時の範囲 [start, end)"""
+    start = datetime.combine(night, dtime(hour=boundary_hour))
+    return start, start + timedelta(days=1)
+
+
+class NightSnapshots:
+    """Flask拡張の形をとったスナップショット置き場（extensions.py で空の箱を作り init_app で中身を入れる）"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.directory = None
+        self.boundary_hour = 6
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = app.config.get('SNAPSHOT_DIR') or os.path.join(app.instance_path, 'snapshots')
+        self.boundary_hour = app.config.get('MIDNIGHT_END_HOUR', 6)
+        os.makedirs(self.directory, exist_ok=True)
+        app.extensions['snapshots'] = self
+
+    # --- 夜の判定 ---
+
+    def night_of(self, created_at):
+        return night_of(created_at, self.boundary_hour)
+
+    def is_complete(self, night):
+        """もう投稿が増えない（終わった）夜か"""
+        return night < self.night_of(datetime.now())
+
+    def path_for(self, night, ext):
+        return os.path.join(self.directory, f"{night.isoformat()}.{ext}")
+
+    # --- 一覧 ---
+
+    def manifest(self):
+        """{夜(YYYY-MM-DD): 件数} 。書き出し済みの夜だけ（件数が None の夜は、消されて書き直し待ち）"""
+        try:
+            with open(os.path.join(self.directory, MANIFEST_NAME), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _update_manifest(self, night, count):
+        """count が 0 なら一覧から外す。None なら書き直し待ちにする"""
+        with self._lock:
+            data = self.manifest()
+            if count is None or count:
+                data[night.isoformat()] = count
+            else:
+                data.pop(night.isoformat(), None)
+            path = os.path.join(self.directory, MANIFEST_NAME)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, sort_keys=True)
+            os.replace(tmp, path)
+
+    # --- 世代 ---
+
+    def _generation_path(self, night):
+        return os.path.join(self.directory, f"{night.isoformat()}.gen")
+
+    def generation(self, night):
+        """その夜の世代（消されるたびに変わる値。まだ1度も消されていなければ空文字）"""
+        try:
+            with open(self._generation_path(night), encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return ''
+
+    def _bump_generation(self, night):
+        # 数を足すのではなく毎回ちがう値を書く（別プロセスと同時に変えても、変わったことは必ず分かる）
+        path = self._generation_path(night)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(os.urandom(8).hex())
+        os.replace(tmp, path)
+
+    # --- 書き出し ---
+
+    def build(self, night):
+        """
+        その夜の HTML / JSON を書き出し、件数を返す（0件なら何も書かない）。app context 内で呼ぶ。
+        書いている間にその夜が消されたら、読み直して書き直す
+        """
+        for _ in range(BUILD_ATTEMPTS):
+            generation = self.generation(night)
+            count = self._build_once(night, generation)
+            if count is not None:
+                return count
+        # 消され続けている夜は、次に開かれたときに任せる
+        self._remove_files(night)
+        self._update_manifest(night, None)
+        return 0
+
+    def _build_once(self, night, generation):
+        """1回書き出して件数を返す。途中で世代が変わっていたら None"""
+        from .models import Diary
+        from .cold_storage import archived_rows
+
+        start, end = night_bounds(night, self.boundary_hour)
+        rows = Diary.timeline_query() \
+            .filter(Diary.created_at >= start, Diary.created_at < end, Diary.is_hidden == False) \
+            .order_by(Diary.created_at.desc(), Diary.id.desc()).all()
+        # 冷たい保管庫へ移した夜は、保管庫の分も合わせる
+        cold = [row for row in archived_rows(night) if not row.is_hidden]
+        if cold:
+            rows = sorted(rows + cold, key=lambda row: (row.created_at, row.id), reverse=True)
+
+        if not rows:
+            if self.generation(night) != generation:
+                return None
+            self._remove_files(night)
+            self._update_manifest(night, 0)
+            return 0
+
+        payload = {
+            'night': night.isoformat(),
+            'generated_at': datetime.now().isoformat(timespec='seconds'),
+            'diaries': [
+                {
+                    'id': row.id,
+                    'created_at': row.created_at.isoformat(timespec='seconds'),
+                    'content': row.content,
+                    'is_long': bool(row.is_long),
+                }
+                for row in rows
+            ],
+        }
+        # セッションを持たない一般客として描画する（誰が見ても同じページ）
+        with self.app.test_request_context(f"/archive/{night.isoformat()}"):
+            html = render_template('archive_night.html', night=night, diaries=rows)
+
+        # まず一時ファイルに書く（このプロセス・スレッドだけの名前）
+        tag = f".{os.getpid()}.{threading.get_ident()}.build"
+        write_precompressed(self.path_for(night, 'json') + tag, json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+        write_precompressed(self.path_for(night, 'html') + tag, html.encode('utf-8'))
+
+        if self.generation(night) != generation:
+            self._remove_files(night, tag)
+            return None
+        # JSON を先に置く（HTML があれば JSON もある）
+        for ext in ('json', 'html'):
+            path = self.path_for(night, ext)
+            for suffix in _SUFFIXES:
+                try:
+                    os.replace(path + tag + suffix, path + suffix)
+                except FileNotFoundError:
+                    # brotli が無い環境などで作らなかった版は、前の版も残さない
+                    self._remove(path + suffix)
+        self._update_manifest(night, len(rows))
+
+        # 置き換えている間に消されていたら、置いたものは古いかもしれないので書き直す
+        if self.generation(night) != generation:
+            return None
+        return len(rows)
+
+    def ensure(self, night):
+        """終わった夜なら、書き出されていなければ書き出す。HTMLのパス（無ければ None）を返す"""
+        if not self.is_complete(night):
+            return None
+        path = self.path_for(night, 'html')
+        if not os.path.exists(path) and not self.build(night):
+            return None
+        return path
+
+    # --- 無効化 ---
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _remove_files(self, night, tag=''):
+        for ext in ('html', 'json'):
+            for suffix in _SUFFIXES:
+                self._remove(self.path_for(night, ext) + tag + suffix)
+
+    def invalidate_night(self, night):
+        """その夜のファイルを消し、一覧の件数を書き直し待ちにする"""
+        # 世代を先に変える（いま書き出し中のものが、消した後に古い中身を置かないように）
+        self._bump_generation(night)
+        self._remove_files(night)
+        self._update_manifest(night, None)
+
+    def invalidate(self, created_ats):
+        """この日時の投稿を含む夜のスナップショットを捨てる（次に開かれたときに書き直す）"""
+        nights = {self.night_of(value) for value in created_ats if value is not None}
+        for night in nights:
+            if self.is_complete(night):
+                self.invalidate_night(night)
+        return nights
@@ -148,4 +148,23 @@ function copyPinText(btn) {
     const original = btn.textContent;
     btn.textContent = 'Copied!';
     setTimeout(() => btn.textContent = original, 1000);
-}
\ No newline at end of file
+}
+
+// --- まとめて消火・再点火 ---
+
+// キープ中のIDを対象欄に入れる
+function fillBulkFromPins() {
+    const pins = JSON.parse(localStorage.getItem('yotakibi_pins') || '[]');
+    document.getElementById('bulk-target-type').value = 'ids';
+    document.getElementById('bulk-target').value = pins.map(p => p.id).join(', ');
+}
+
+// 送信前の確認（押されたボタンで文言を変える）
+// macOS の Safari / Firefox ではボタンを押してもフォーカスが移らないので、activeElement ではなく submitter を見る
+function confirmBulk(form, event) {
+    const submitter = event && event.submitter;
+    const action = submitter && submitter.value === 'restore' ? '再点火' : '消火';
+    const target = form.querySelector('#bulk-target').value;
+    if (!target) return false;
+    return confirm(`「${target}」に当てはまる火を、まとめて${action}しますか？`);
+}
@@ -0,0 +1,151 @@
+// 新しい火（差分）の受け取り
+// SSE（/api/embers/stream）が使えればそれで、使えなければ /api/embers を間隔をあけて読みにいきます。
+// 新しい火はすぐには差し込まず、「新しい火が灯りました」を押したときにタイムラインの先頭へ足します。
+
+document.addEventListener('DOMContentLoaded', () => {
+    const feed = document.getElementById('embers-feed');
+    if (!feed) return;
+
+    const list = feed.closest('.diary-list');
+    let after = feed.dataset.after;
+    let eventsAfter = '';
+    let waiting = [];
+
+    const banner = document.createElement('button');
+    banner.type = 'button';
+    banner.className = 'embers-banner';
+    banner.hidden = true;
+    feed.after(banner);
+
+    // 「2026-10-17T21:30:00」→「2026.10.17 21:30」
+    function formatDate(iso) {
+        return iso.slice(0, 10).replace(/-/g, '.') + ' ' + iso.slice(11, 16);
+    }
+
+    function buildCard(ember) {
+        const card = document.createElement('div');
+        card.className = 'diary-card';
+        card.id = 'diary-' + ember.id;
+
+        const meta = document.createElement('div');
+        meta.className = 'diary-meta';
+        const date = document.createElement('span');
+        date.className = 'diary-date';
+        date.textContent = formatDate(ember.created_at);
+        const number = document.createElement('span');
+        number.className = 'ember-id';
+        number.textContent = '#' + ember.id;
+        meta.append(date, number);
+
+        const body = document.createElement('div');
+        body.className = 'diary-body' + (ember.is_long ? ' collapsed' : '');
+        body.id = 'diary-body-' + ember.id;
+        body.textContent = ember.content;
+        card.append(meta, body);
+
+        if (ember.is_long) {
+            const more = document.createElement('button');
+            more.className = 'read-more-btn';
+            more.textContent = 'もっと火にあたる';
+            more.addEventListener('click', () => toggleDiary(String(ember.id), more));
+            card.append(more);
+        }
+        return card;
+    }
+
+    function updateBanner() {
+        banner.hidden = waiting.length === 0;
+        banner.textContent = `🔥 新しい火が ${waiting.length} つ灯りました`;
+    }
+
+    banner.addEventListener('click', () => {
+        // 古い順に受け取っているので、1つずつ先頭に差し込めば新しい順に並ぶ
+        waiting.forEach((ember) => banner.after(buildCard(ember)));
+        waiting = [];
+        updateBanner();
+    });
+
+    function apply(delta) {
+        delta.embers.forEach((ember) => {
+            if (!document.getElementById('diary-' + ember.id)) waiting.push(ember);
+        });
+        delta.events.forEach((event) => {
+            if (event.action !== 'hide') return;
+            const card = document.getElementById('diary-' + event.diary_id);
+            if (card) card.remove();
+            waiting = waiting.filter((ember) => ember.id !== event.diary_id);
+        });
+        after = delta.cursor.after;
+        eventsAfter = delta.cursor.events_after;
+        updateBanner();
+    }
+
+    function cursorQuery() {
+        const params = new URLSearchParams();
+        if (after !== '') params.set('after', after);
+        if (eventsAfter !== '') params.set('events_after', eventsAfter);
+        return params.toString();
+    }
+
+    // --- 間隔をあけて読みにいく ---
+    const pollSeconds = parseInt(feed.dataset.poll, 10) || 30;
+
+    function poll() {
+        if (document.hidden) {
+            setTimeout(poll, pollSeconds * 1000);
+            return;
+        }
+        fetch(feed.dataset.api + '?' + cursorQuery(), { credentials: 'same-origin' })
+            .then((response) => {
+                if (response.status === 503) {
+                    // 休業中・混雑中は、言われた秒数だけ待って読み直す
+                    const wait = Math.max(parseInt(response.headers.get('Retry-After'), 10) || 0, pollSeconds);
+                    setTimeout(poll, wait * 1000);
+                    return;
+                }
+                const type = response.headers.get('Content-Type') || '';
+                if (!type.includes('application/json')) {
+                    // ログイン画面やエラーページなど、JSON 以外が返ってきたら読みにいくのをやめる
+                    console.warn('embers: unexpected response', response.status, type);
+                    return;
+                }
+                return response.json().then((delta) => {
+                    if (!response.ok) {
+                        setTimeout(poll, pollSeconds * 1000);
+                        return;
+                    }
+                    apply(delta);
+                    // 上限で切られていたら、間をあけずに続きを読む
+                    setTimeout(poll, delta.truncated ? 0 : pollSeconds * 1000);
+                });
+            })
+            .catch((error) => {
+                // 通信の失敗はそのうち直るので、間隔をあけて読み直す（JSON として読めなかった場合はやめる）
+                if (error instanceof SyntaxError) {
+                    console.warn('embers: broken response', error);
+                    return;
+                }
+                setTimeout(poll, pollSeconds * 1000);
+            });
+    }
+
+    // --- SSE ---
+    if (feed.dataset.stream && window.EventSource) {
+        const source = new EventSource(feed.dataset.stream + '?' + cursorQuery());
+        source.addEventListener('embers', (message) => {
+            const delta = JSON.parse(message.data);
+            apply(delta);
+            if (delta.truncated) {
+                // 追いつけないほど離れていた分は、読みにいく方式で続きを取る
+                source.close();
+                poll();
+            }
+        });
+        source.addEventListener('error', () => {
+            // 再接続をあきらめた（無効・休業中など）ときだけ、読みにいく方式に切り替える
+            if (source.readyState === EventSource.CLOSED) poll();
+        });
+    } else {
+        setTimeout(poll, pollSeconds * 1000);
+    }
+});
@@ -0,0 +1,18 @@
+// タイムラインの日記カード（長い日記の折りたたみ）
+
+function toggleDiary(id, btn) {
+    const body = document.getElementById('diary-body-' + id);
+    if (body.classList.contains('collapsed')) {
+        body.classList.remove('collapsed');
+        body.style.maxHeight = 'none';
+        body.style.maskImage = 'none';
+        body.style.webkitMaskImage = 'none';
+        btn.textContent = '火から離れる';
+    } else {
+        body.classList.add('collapsed');
+        body.style.maxHeight = null;
+        body.style.maskImage = null;
+        body.style.webkitMaskImage = null;
+        btn.textContent = 'もっと火にあたる';
+    }
+}
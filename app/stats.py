@@ -0,0 +1,276 @@
+import hashlib
+import math
+from collections import Counter, defaultdict
+from datetime import datetime
+from sqlalchemy import select, update, func
+from .extensions import db, snapshots
+from .models import NightStat, NightAikotobaStat
+
+"""
+夜ごとの集計（ロールアップ）
+管理画面の統計を、diaries 全体への GROUP BY で作ると、開くたびに全行をなめることになります。
+そこで、書き込み・消火・再点火のたびに、その夜の集計行へ差分だけを足し引きしておきます。
+
+- night_stats          : 夜ごとの投稿数・消火数・灯した人の数（HyperLogLog による推定）
+- night_aikotoba_stats : 夜ごとの種火の使われた回数（上位を管理画面に出す）
+
+足し込みは「あれば加算・無ければ挿入」の1文（ON CONFLICT DO UPDATE）で行うので、
+複数のワーカーが同じ夜に同時に書いても数え落としません。
+HyperLogLog はレジスタごとの最大値をとるだけで合わせられるため、何度合わせても結果は同じです。
+
+集計がずれたとき（導入前の日記など）は、`flask rebuild-stats` で日記から数え直してください。
+"""
+
+# HyperLogLog のレジスタ数 = 2 ** HLL_PRECISION（1夜あたり 1KB。誤差はおよそ 3%）
+HLL_PRECISION = 10
+# 管理画面に出す、夜ごとの種火の数
+TOP_AIKOTOBA = 5
+
+
+class HyperLogLog:
+    """重複を除いた件数を、固定サイズのレジスタで推定する"""
+
+    def __init__(self, registers=None, precision=HLL_PRECISION):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers else bytearray(self.size)
+
+    @staticmethod
+    def hash_value(value):
+        """64ビットのハッシュ。IP Hash（16進数の sha256）ならそのまま先頭を使う"""
+        try:
+            return int(value[:16], 16)
+        except ValueError:
+            return int.from_bytes(hashlib.sha1(value.encode('utf-8')).digest()[:8], 'big')
+
+    def add(self, value):
+        if not value:
+            return
+        h = self.hash_value(value)
+        index = h >> (64 - self.precision)
+        rest = (h << self.precision) & ((1 << 64) - 1)
+        rank = min(64 - rest.bit_length() + 1, 64 - self.precision + 1)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+    def count(self):
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # 少ないうちは、空のレジスタの割合から数える（線形計数）
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+
+class NightDelta:
+    """1夜ぶんの差分"""
+
+    def __init__(self):
+        self.posts = 0
+        self.hidden = 0
+        self.sketch = None
+        self.aikotoba = Counter()
+
+    def add_post(self, ip_hash, aikotoba, is_hidden):
+        self.posts += 1
+        if is_hidden:
+            self.hidden += 1
+        if ip_hash:
+            if self.sketch is None:
+                self.sketch = HyperLogLog()
+            self.sketch.add(ip_hash)
+        if aikotoba:
+            self.aikotoba[aikotoba[:50]] += 1
+
+
+def _insert():
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"stats rollups need ON CONFLICT support: {dialect}")
+    return insert
+
+
+def _add_counts(table, keys, counts):
+    """keys の行に counts を足す（無ければ counts のまま挿入する）"""
+    insert = _insert()
+    statement = insert(table).values(**keys, **counts)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={name: table.c[name] + statement.excluded[name] for name in counts},
+    )
+    db.session.execute(statement)
+
+
+def apply_delta(night, delta):
+    """1夜ぶんの差分を集計行に足し込む（コミットは呼び出し側で）"""
+    if delta.posts or delta.hidden:
+        _add_counts(NightStat.__table__, {'night': night}, {'posts': delta.posts, 'hidden': delta.hidden})
+
+    if delta.sketch is not None:
+        # 同じ夜の行は、足し込みの文でロックを取っているので、読み合わせて書き戻しても取り合わない
+        current = db.session.execute(
+            select(NightStat.ip_sketch).where(NightStat.night == night).with_for_update()
+        ).scalar()
+        sketch = delta.sketch
+        if current:
+            sketch = HyperLogLog(current).merge(sketch)
+        db.session.execute(
+            update(NightStat).where(NightStat.night == night)
+            .values(ip_sketch=sketch.to_bytes(), updated_at=datetime.now())
+        )
+
+    for aikotoba, posts in delta.aikotoba.items():
+        _add_counts(NightAikotobaStat.__table__, {'night': night, 'aikotoba': aikotoba}, {'posts': posts})
+
+
+def _value(row, name):
+    return row.get(name) if isinstance(row, dict) else getattr(row, name, None)
+
+
+def record_posts(rows):
+    """書き込まれた日記（dict か Diary）を集計に足す（コミットは呼び出し側で）"""
+    deltas = defaultdict(NightDelta)
+    for row in rows:
+        created_at = _value(row, 'created_at') or datetime.now()
+        deltas[snapshots.night_of(created_at)].add_post(
+            _value(row, 'ip_hash'), _value(row, 'aikotoba'), bool(_value(row, 'is_hidden')),
+        )
+    for night, delta in sorted(deltas.items()):
+        apply_delta(night, delta)
+
+
+def record_flushed(rows):
+    """書き込みキューから流れた分を集計に足してコミットする（write_queue.after_flush 用）"""
+    if rows:
+        record_posts(rows)
+        db.session.commit()
+
+
+def record_hidden_change(created_ats, hidden):
+    """消火（hidden=True）・再点火された日記の投稿日時から、夜ごとの消火数を足し引きする（コミットは呼び出し側で）"""
+    changes = Counter(snapshots.night_of(value) for value in created_ats if value is not None)
+    for night, count in sorted(changes.items()):
+        delta = NightDelta()
+        delta.hidden = count if hidden else -count
+        apply_delta(night, delta)
+
+
+# --- 数え直し ---
+
+def iter_stat_records():
+    """数え直し用に、冷たい保管庫と diaries の日記を（夜ごとにまとまる順で）1件ずつ返す"""
+    from .models import Diary, ArchivedNight
+    from .cold_storage import unpack
+
+    for _night, payload in db.session.query(ArchivedNight.night, ArchivedNight.payload) \
+            .order_by(ArchivedNight.night).yield_per(1):
+        yield from unpack(payload)
+
+    rows = db.session.execute(
+        select(Diary.created_at, Diary.ip_hash, Diary.aikotoba, Diary.is_hidden)
+        .order_by(Diary.created_at)
+        .execution_options(stream_results=True, yield_per=1000)
+    )
+    for row in rows:
+        yield row._asdict()
+
+
+def rebuild(records, echo=None):
+    """
+    集計を空にして、日記（dict の列。投稿日時の古い順）から数え直す。数えた夜の数を返す。
+    夜が変わるたびに足し込むので、メモリに持つのは1夜ぶんだけ。
+    records を読んでいるカーソルを閉じないよう、途中ではコミットせず、最後に1度だけコミットする
+    （数え直している間も、管理画面には前の集計が見える）
+    """
+    db.session.query(NightAikotobaStat).delete(synchronize_session=False)
+    db.session.query(NightStat).delete(synchronize_session=False)
+
+    nights = 0
+    current_night = None
+    delta = NightDelta()
+    for record in records:
+        created_at = record['created_at']
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+        night = snapshots.night_of(created_at)
+        if night != current_night:
+            if current_night is not None:
+                apply_delta(current_night, delta)
+                nights += 1
+                if echo is not None:
+                    echo(f"{current_night}: {delta.posts} 件")
+            current_night, delta = night, NightDelta()
+        delta.add_post(record.get('ip_hash'), record.get('aikotoba'), bool(record.get('is_hidden')))
+
+    if current_night is not None:
+        apply_delta(current_night, delta)
+        nights += 1
+        if echo is not None:
+            echo(f"{current_night}: {delta.posts} 件")
+    db.session.commit()
+    return nights
+
+
+# --- 読み出し（管理画面用。集計行だけを読む） ---
+
+def night_summaries(limit=30, before=None):
+    """新しい夜から limit 夜ぶんの集計（dict のリスト）と、その期間の合計を返す"""
+    query = NightStat.query.order_by(NightStat.night.desc())
+    if before is not None:
+        query = query.filter(NightStat.night < before)
+    stats = query.limit(limit).all()
+    nights = [stat.night for stat in stats]
+
+    top = defaultdict(list)
+    if nights:
+        ranked = select(
+            NightAikotobaStat.night, NightAikotobaStat.aikotoba, NightAikotobaStat.posts,
+            func.row_number().over(
+                partition_by=NightAikotobaStat.night,
+                order_by=(NightAikotobaStat.posts.desc(), NightAikotobaStat.aikotoba),
+            ).label('rank'),
+        ).where(NightAikotobaStat.night.in_(nights)).subquery()
+        rows = db.session.execute(
+            select(ranked.c.night, ranked.c.aikotoba, ranked.c.posts)
+            .where(ranked.c.rank <= TOP_AIKOTOBA)
+            .order_by(ranked.c.night, ranked.c.rank)
+        )
+        for night, aikotoba, posts in rows:
+            top[night].append({'aikotoba': aikotoba, 'posts': posts})
+
+    summaries = []
+    overall = HyperLogLog()
+    for stat in stats:
+        sketch = HyperLogLog(stat.ip_sketch) if stat.ip_sketch else None
+        if sketch is not None:
+            overall.merge(sketch)
+        summaries.append({
+            'night': stat.night.isoformat(),
+            'posts': stat.posts,
+            'hidden': max(stat.hidden, 0),
+            'visible': max(stat.posts - stat.hidden, 0),
+            'unique_ips': sketch.count() if sketch is not None else 0,
+            'top_aikotoba': top.get(stat.night, []),
+        })
+
+    totals = {
+        'nights': len(summaries),
+        'posts': sum(s['posts'] for s in summaries),
+        'hidden': sum(s['hidden'] for s in summaries),
+        # 夜をまたいで同じ人は1人として数える（レジスタを合わせてから数える）
+        'unique_ips': overall.count() if summaries else 0,
+    }
+    return summaries, totals
@@ -1,6 +1,11 @@
 import hashlib
 from functools import wraps
-from flask import current_app  # 【重要】実行中のアプリを参照するための機能
+from flask import current_app, session, flash, redirect, url_for  # 【重要】実行中のアプリを参照するための機能
+from .ng_words import normalize_text
+
+# 長い日記（タイムラインで折りたたむ）の基準
+LONG_CONTENT_CHARS = 140
+LONG_CONTENT_NEWLINES = 5
 
 def get_ip_hash(ip_address):
     """IPアドレスとSaltを組み合わせてハッシュ化する"""
@@ -12,6 +17,26 @@ def get_ip_hash(ip_address):
     
     return hashlib.sha256(f"{ip_address}{salt}".encode('utf-8')).hexdigest()
 
+def hash_aikotoba(aikotoba):
+    """種火を固定長（64文字）のハッシュにする。検索時の等価比較用"""
+    if aikotoba is None:
+        return None
+    return hashlib.sha256(aikotoba.encode('utf-8')).hexdigest()
+
+def derive_content_fields(content):
+    """
+    本文から決まる値を、書き込み時に1度だけ計算する（表示・検索のたびに本文をなめ直さないため）
+    - is_long  : タイムラインで折りたたむかどうか
+    - search_text : 検索用の正規化済みテキスト（ng_words と同じ正規化）
+    """
+    content = content or ''
+    is_long = len(content) > LONG_CONTENT_CHARS or content.count('\n') > LONG_CONTENT_NEWLINES
+
+    return {
+        'is_long': is_long,
+        'search_text': normalize_text(content),
+    }
+
 def fire_required(f):
     """
     デコレータ: 必要な前処理があればここに記述
@@ -20,4 +45,32 @@ def fire_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         return f(*args, **kwargs)
-    return decorated_function
\ No newline at end of file
+    return decorated_function
+
+def admin_required(f):
+    """
+    デコレータ: 管理者（火の番）だけが使えるページにする
+    管理者でなければ、メッセージを出してトップへ戻す
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not session.get('is_admin'):
+            flash('その操作は許可されていません。', 'error')
+            return redirect(url_for('main.index'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+def is_public_view():
+    """
+    セッションによって見た目が変わらない「誰が見ても同じページ」かどうか。
+    管理者・さっきの種火の表示・フラッシュメッセージ・DB反映待ちの投稿がある場合は False
+    """
+    if session.get('is_admin'):
+        return False
+    if session.get('my_aikotoba'):
+        return False
+    if session.get('_flashes'):
+        return False
+    if session.get('pending_posts'):
+        return False
+    return True
@@ -0,0 +1,369 @@
+import json
+import os
+import threading
+import time
+import uuid as uuid_lib
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError, OperationalError, InterfaceError
+from .cache import _connect_shared
+
+"""
+書き込みの後回し（ライトビハインド）
+投稿はまずローカルのSQLiteジャーナル（追記のみ・fsyncあり）に積み、
+裏のスレッドが「件数がたまったら」または「一定時間たったら」まとめて本番DBへ複数行INSERTします。
+19:00の投稿ラッシュでも、リクエストの待ち時間が本番DBのコミット待ちに引きずられません。
+
+ジャーナルは gunicorn の全ワーカーで共有され、どのワーカーの裏スレッドが流しても構いません。
+
+公開時刻つきの行（火の番のボットが時間をずらして灯す投稿など）も同じジャーナルに積みます。
+WRITE_BEHIND_ENABLED が無効でも、ジャーナルに行がある間は裏スレッドを動かします。
+
+まとめてのINSERTが行のせい（一意制約など）で失敗したときは、1件ずつ入れ直します。
+それでも MAX_ATTEMPTS 回失敗した行は dead_diaries に移し、後ろの投稿を止めないようにします
+（`flask write-queue-dead` で確認・積み直し）。DBにつながらないときは、行のせいにせずそのまま待ちます。
+"""
+
+# 書いた本人にだけ、DBに入る前の投稿を見せるための軽い行
+PendingDiary = namedtuple('PendingDiary', ['uuid', 'content', 'aikotoba', 'created_at'])
+
+# 取り出したまま戻ってこない行（ワーカーが落ちた等）を、別のワーカーが拾い直すまでの秒数
+CLAIM_TIMEOUT = 60
+# 裏スレッドが止まっている間、ほかのプロセス（flask コマンドなど）が積んだ行が無いか見にいく間隔（秒）
+PROBE_INTERVAL = 30
+# 1件ずつ入れ直しても失敗した行を、dead_diaries に移すまでの回数
+MAX_ATTEMPTS = 3
+
+
+def _encode(row):
+    data = dict(row)
+    for key, value in data.items():
+        if isinstance(value, datetime):
+            data[key] = {'__dt__': value.isoformat()}
+    return json.dumps(data, ensure_ascii=False)
+
+
+def _decode(payload):
+    data = json.loads(payload)
+    for key, value in data.items():
+        if isinstance(value, dict) and '__dt__' in value:
+            data[key] = datetime.fromisoformat(value['__dt__'])
+    return data
+
+
+class WriteQueue:
+    """Flask拡張の形をとった書き込みキュー（extensions.py で空の箱を作り init_app で中身を入れる）"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.path = None
+        self.batch_size = 50
+        self.flush_interval = 0.5
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        self._start_lock = threading.Lock()
+        self._after_flush = []
+        # 裏スレッドを動かすか（書き込みの後回しが有効か、ジャーナルに行が残っているとき）
+        self.active = False
+        self._next_probe = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('WRITE_BEHIND_ENABLED', False)
+        self.batch_size = app.config.get('WRITE_BATCH_SIZE', 50)
+        self.flush_interval = app.config.get('WRITE_FLUSH_INTERVAL', 0.5)
+        self.path = app.config.get('WRITE_QUEUE_PATH') or os.path.join(app.instance_path, 'write_queue.sqlite3')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._setup()
+        self.active = self.enabled or self._total_count() > 0
+
+        # 裏スレッドは fork 後のワーカーごとに起動する（リクエストが来た時に確認）
+        app.before_request(self.ensure_flusher)
+        app.extensions['write_queue'] = self
+
+    def after_flush(self, func):
+        """DBに流した直後に呼ぶ処理を登録する（キャッシュの世代更新など）。func(rows)"""
+        self._after_flush.append(func)
+        return func
+
+    # --- ジャーナル ---
+
+    def _connect(self):
+        return _connect_shared(self._local, self.path, timeout=10, synchronous='FULL')
+
+    def _setup(self):
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS pending_diaries ('
+            ' seq INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' uuid TEXT NOT NULL UNIQUE,'
+            ' payload TEXT NOT NULL,'
+            ' release_at REAL NOT NULL,'
+            ' claimed_at REAL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_pending_release ON pending_diaries (release_at)')
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(pending_diaries)')}
+        if 'attempts' not in columns:
+            conn.execute('ALTER TABLE pending_diaries ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS dead_diaries ('
+            ' seq INTEGER PRIMARY KEY,'
+            ' uuid TEXT NOT NULL,'
+            ' payload TEXT NOT NULL,'
+            ' error TEXT,'
+            ' failed_at REAL NOT NULL)'
+        )
+
+    def enqueue(self, row, release_at=None):
+        """
+        日記1件ぶんの列（dict）をジャーナルに積み、uuid を返す。
+        release_at（UNIX時刻）を渡すと、その時刻まではDBに流さない。
+        """
+        return self.enqueue_many([row], [release_at])[0]
+
+    def enqueue_many(self, rows, release_ats=None):
+        """
+        複数件をまとめて（1トランザクションで）ジャーナルに積み、uuid のリストを返す。
+        release_ats は行ごとの公開時刻（UNIX時刻 or None）
+        """
+        release_ats = list(release_ats or [None] * len(rows))
+        now = time.time()
+        values = []
+        for row, release_at in zip(rows, release_ats):
+            row = dict(row)
+            row.setdefault('uuid', str(uuid_lib.uuid4()))
+            row.setdefault('created_at', datetime.now())
+            values.append((row['uuid'], _encode(row), release_at or now))
+
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('INSERT INTO pending_diaries (uuid, payload, release_at) VALUES (?, ?, ?)', values)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        self.active = True
+        self.ensure_flusher()
+        if self.pending_count() >= self.batch_size:
+            self._wakeup.set()
+        return [uuid for uuid, _, _ in values]
+
+    def _total_count(self):
+        """公開時刻の前のものも含めた、ジャーナルの全件数"""
+        return self._connect().execute('SELECT COUNT(*) FROM pending_diaries').fetchone()[0]
+
+    def pending_count(self):
+        row = self._connect().execute(
+            'SELECT COUNT(*) FROM pending_diaries WHERE release_at <= ?', (time.time(),)
+        ).fetchone()
+        return row[0]
+
+    def pending_for(self, uuids):
+        """まだDBに入っていない投稿のうち、指定の uuid のもの（新しい順）"""
+        if not uuids:
+            return []
+        placeholders = ','.join('?' * len(uuids))
+        rows = self._connect().execute(
+            f'SELECT payload FROM pending_diaries WHERE uuid IN ({placeholders}) ORDER BY seq DESC',
+            list(uuids),
+        ).fetchall()
+        result = []
+        for (payload,) in rows:
+            data = _decode(payload)
+            result.append(PendingDiary(data['uuid'], data['content'], data['aikotoba'], data['created_at']))
+        return result
+
+    def _claim(self, limit):
+        """流す順番が来た行を、他のワーカーと取り合わないように確保する"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                'SELECT seq, payload FROM pending_diaries'
+                ' WHERE release_at <= ? AND (claimed_at IS NULL OR claimed_at < ?)'
+                ' ORDER BY seq LIMIT ?',
+                (now, now - CLAIM_TIMEOUT, limit),
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    'UPDATE pending_diaries SET claimed_at = ? WHERE seq = ?',
+                    [(now, seq) for seq, _ in rows],
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return rows
+
+    def _release(self, seqs):
+        self._connect().executemany('UPDATE pending_diaries SET claimed_at = NULL WHERE seq = ?', [(s,) for s in seqs])
+
+    def _delete(self, seqs):
+        self._connect().executemany('DELETE FROM pending_diaries WHERE seq = ?', [(s,) for s in seqs])
+
+    def _fail(self, seq, error):
+        """1件の失敗を数え、MAX_ATTEMPTS 回に達したら dead_diaries に移す。移したら True"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'UPDATE pending_diaries SET attempts = attempts + 1, claimed_at = NULL WHERE seq = ?', (seq,)
+            )
+            dead = conn.execute(
+                'INSERT INTO dead_diaries (seq, uuid, payload, error, failed_at)'
+                ' SELECT seq, uuid, payload, ?, ? FROM pending_diaries WHERE seq = ? AND attempts >= ?',
+                (str(error)[:2000], time.time(), seq, MAX_ATTEMPTS),
+            ).rowcount
+            if dead:
+                conn.execute('DELETE FROM pending_diaries WHERE seq = ?', (seq,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return bool(dead)
+
+    def dead_letters(self):
+        """dead_diaries の行（古い順）を (seq, 日記の dict, エラー, 失敗した時刻) で返す"""
+        rows = self._connect().execute(
+            'SELECT seq, payload, error, failed_at FROM dead_diaries ORDER BY seq'
+        ).fetchall()
+        return [(seq, _decode(payload), error, datetime.fromtimestamp(failed_at))
+                for seq, payload, error, failed_at in rows]
+
+    def requeue_dead(self, seqs=None):
+        """dead_diaries の行（seqs を省けば全部）をジャーナルに積み直し、件数を返す"""
+        conn = self._connect()
+        where, params = '', []
+        if seqs:
+            where = f" WHERE seq IN ({','.join('?' * len(seqs))})"
+            params = list(seqs)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            count = conn.execute(
+                'INSERT OR IGNORE INTO pending_diaries (uuid, payload, release_at)'
+                f' SELECT uuid, payload, ? FROM dead_diaries{where}', [time.time()] + params
+            ).rowcount
+            conn.execute(f'DELETE FROM dead_diaries{where}', params)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if count:
+            self.active = True
+            self._wakeup.set()
+        return count
+
+    # --- DBへの書き出し ---
+
+    def flush(self):
+        """流せる行をすべてDBに書き出し、書き出した件数を返す（app context 内で呼ぶ）"""
+        from .extensions import db
+        from .models import Diary
+
+        total = 0
+        while True:
+            claimed = self._claim(self.batch_size)
+            if not claimed:
+                return total
+
+            seqs = [seq for seq, _ in claimed]
+            rows = [_decode(payload) for _, payload in claimed]
+            try:
+                # 前回の書き出し途中で落ちていた場合に備え、入っている uuid は飛ばす
+                uuids = [row['uuid'] for row in rows]
+                existing = {u for (u,) in db.session.query(Diary.uuid).filter(Diary.uuid.in_(uuids))}
+                new_rows = [row for row in rows if row['uuid'] not in existing]
+                if new_rows:
+                    db.session.execute(insert(Diary), new_rows)
+                db.session.commit()
+            except (OperationalError, InterfaceError):
+                # DBにつながらない：行のせいではないので、そのまま戻して待つ
+                db.session.rollback()
+                self._release(seqs)
+                raise
+            except DBAPIError:
+                # 一意制約・型の誤りなど：どの行のせいかを1件ずつ確かめる
+                db.session.rollback()
+                new_rows = self._flush_one_by_one(claimed)
+            except Exception:
+                db.session.rollback()
+                self._release(seqs)
+                raise
+            else:
+                self._delete(seqs)
+
+            total += len(new_rows)
+            for func in self._after_flush:
+                func(new_rows)
+
+    def _flush_one_by_one(self, claimed):
+        """確保した行を1件ずつ入れる。入れた行のリストを返す（失敗した行は数えて戻すか、dead_diaries へ）"""
+        from .extensions import db, metrics
+        from .models import Diary
+
+        inserted = []
+        for seq, payload in claimed:
+            row = _decode(payload)
+            try:
+                if db.session.query(Diary.id).filter(Diary.uuid == row['uuid']).first() is None:
+                    db.session.execute(insert(Diary), [row])
+                    inserted.append(row)
+                db.session.commit()
+            except (OperationalError, InterfaceError):
+                db.session.rollback()
+                self._release([s for s, _ in claimed])
+                raise
+            except DBAPIError as e:
+                db.session.rollback()
+                e = e.orig or e
+                if self._fail(seq, e):
+                    metrics.registry.inc('yotakibi_write_queue_dead_total', {})
+                    self.app.logger.error(f"write queue: {row['uuid']} moved to dead_diaries: {e}")
+                else:
+                    self.app.logger.warning(f"write queue: {row['uuid']} failed to insert: {e}")
+                continue
+            self._delete([seq])
+        return inserted
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            with self.app.app_context():
+                try:
+                    self.flush()
+                except Exception as e:
+                    self.app.logger.error(f"write queue flush failed: {e}")
+                    time.sleep(min(self.flush_interval * 10, 5))
+                finally:
+                    from .extensions import db
+                    db.session.remove()
+
+    def ensure_flusher(self):
+        """このプロセスの裏スレッドが動いていなければ起動する"""
+        if not self.active:
+            now = time.monotonic()
+            if now < self._next_probe:
+                return
+            self._next_probe = now + PROBE_INTERVAL
+            if self._total_count() == 0:
+                return
+            self.active = True
+        pid = os.getpid()
+        if self._thread_pid == pid and self._thread and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread_pid == pid and self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='write-queue-flusher', daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
@@ -0,0 +1,4 @@
+"""
+夜焚き火の性能計測用パッケージ
+アプリ本体（app/）からは読み込まれません。
+"""
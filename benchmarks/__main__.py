@@ -0,0 +1,47 @@
+import click
+from flask.cli import FlaskGroup
+
+from .bench_flood import main as flood_main
+from .bench_ng_words import main as ng_words_main
+from .harness import run_command, compare_command
+from .seed import seed_command
+
+"""
+計測用コマンドの入り口
+データベースはアプリと同じく環境変数 DATABASE_URL で選びます。
+
+    python -m benchmarks seed-diaries --count 1000000
+    python -m benchmarks run --label sqlite
+    python -m benchmarks compare old.json new.json
+    python -m benchmarks ng-words
+    python -m benchmarks flood
+"""
+
+
+def _create_app():
+    from app import create_app
+    return create_app()
+
+
+@click.command('ng-words')
+def ng_words_command():
+    """NGワード判定のマイクロベンチマーク"""
+    ng_words_main()
+
+
+@click.command('flood')
+def flood_command():
+    """連投検知の検出率・誤検知率・判定時間（合成データ）"""
+    flood_main()
+
+
+cli = FlaskGroup(create_app=_create_app, add_default_commands=False, help='夜焚き火の計測ツール')
+cli.add_command(seed_command)
+cli.add_command(run_command)
+cli.add_command(compare_command)
+cli.add_command(ng_words_command)
+cli.add_command(flood_command)
+
+
+if __name__ == '__main__':
+    cli()
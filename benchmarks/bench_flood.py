@@ -0,0 +1,95 @@
+import random
+import time
+
+from app.flood import FloodDetector, clean
+
+from .seed import make_content
+
+"""
+連投検知の確かめ（合成データ）
+ふつうの日記の流れに、少しずつ書き換えたコピペの連投を混ぜて流し、
+- 連投をどれだけ見つけたか（最初の FLOOD_MAX_SIMILAR 件は通すので、それ以降の分のうち）
+- ふつうの日記をどれだけ誤って連投とみなしたか
+- 1件の判定にかかった時間
+を表示します。DBは使いません。
+
+    python -m benchmarks flood
+"""
+
+KANA = 'あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん'
+NOISE = [' ', '　', '!', '！', '…', '☆', 'w', '。', '\n']
+
+FLOOD_TEMPLATES = [
+    'いまなら無料で夜のお供をプレゼント中、詳しくはプロフィールのリンクから見てね',
+    'この焚き火サイトはもうすぐ閉鎖されます、みんな別の場所に移動してください、本当です',
+    '夜焚き火の管理人さんへ、今すぐ返事をください、ずっと待っています、お願いします',
+    '今日も明日もあさっても、ここに同じことを書き続けます、誰か気づいてくれるまで',
+    '話を聞いてくれる人を探しています、同じ悩みを持つ人はいませんか、種火で連絡してね',
+]
+
+
+def personal_tail(rng):
+    """ふつうの日記らしいばらつき（その人だけの言い回し）"""
+    return ''.join(rng.choice(KANA) for _ in range(rng.randint(8, 20))) + '。'
+
+
+def mutate(rng, text, edits):
+    """1文字の置き換え・記号や空白の差し込みを edits 回くわえる"""
+    chars = list(text)
+    for _ in range(edits):
+        position = rng.randrange(len(chars))
+        if rng.random() < 0.5:
+            chars[position] = rng.choice(KANA)
+        else:
+            chars.insert(position, rng.choice(NOISE))
+    return ''.join(chars)
+
+
+def run(natural=5000, copies=30, max_edits=4, seed=42):
+    rng = random.Random(seed)
+    detector = FloodDetector()
+    detector.action = 'hide'
+
+    stream = [('natural', make_content(rng) + personal_tail(rng)) for _ in range(natural)]
+    for template in FLOOD_TEMPLATES:
+        for _ in range(copies):
+            stream.append(('flood', mutate(rng, template, rng.randint(1, max_edits))))
+    # 連投のコピーどうしの順番は保ったまま、ふつうの日記の流れに散らばらせる
+    rng.shuffle(stream)
+
+    flagged = {'natural': 0, 'flood': 0}
+    timings = []
+    now = time.time()
+    for i, (kind, text) in enumerate(stream):
+        started = time.perf_counter()
+        verdict = detector.match(clean(text), now=now)
+        timings.append(time.perf_counter() - started)
+        if verdict.is_flood:
+            flagged[kind] += 1
+        # hide の動き：連投とみなしても受け付けるので、索引には入れる
+        detector.add(f"k{i}", text)
+
+    timings.sort()
+    floods = len(FLOOD_TEMPLATES) * copies
+    expected = floods - len(FLOOD_TEMPLATES) * detector.max_similar
+    return {
+        'posts': len(stream),
+        'flood_detected': flagged['flood'] / expected,
+        'natural_false_positive': flagged['natural'] / natural,
+        'mean_us': sum(timings) / len(timings) * 1e6,
+        'p99_us': timings[int(len(timings) * 0.99)] * 1e6,
+        'index_size': detector.size,
+    }
+
+
+def main():
+    result = run()
+    print(f"posts                  : {result['posts']}")
+    print(f"flood detected         : {result['flood_detected']:.1%}")
+    print(f"natural false positive : {result['natural_false_positive']:.2%}")
+    print(f"check time (mean / p99): {result['mean_us']:.1f} / {result['p99_us']:.1f} us")
+    print(f"index size             : {result['index_size']}")
+
+
+if __name__ == '__main__':
+    main()
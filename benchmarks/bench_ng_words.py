@@ -0,0 +1,93 @@
+import random
+import re
+import time
+
+from app import ng_words
+from app.ng_words import NGWordMatcher, check_text_safety
+
+"""
+NGワード判定のマイクロベンチマーク
+旧実装（リストごとのループ + re.search）と、Aho-Corasick オートマトン版を比べます。
+
+    python -m benchmarks.bench_ng_words
+"""
+
+SAMPLE_CHARS = 'あいうえおかきくけこさしすせそたちつてとなにぬねの夜焚き火月星風雨今日明日楽しい静か'
+
+
+def legacy_check_text_safety(text, check_reserved=False, is_admin=False,
+                             general=None, admin=None, reserved=None):
+    """置き換え前の実装（比較用にそのまま残したもの）"""
+    general = ng_words.GENERAL_NG_WORDS if general is None else general
+    admin = ng_words.ADMIN_EXCLUSIVE_PATTERNS if admin is None else admin
+    reserved = ng_words.RESERVED_AIKOTOBA_WORDS if reserved is None else reserved
+
+    if not text:
+        return True, None
+    for word in general:
+        if word in text:
+            return False, "その言葉は、薪としてくべることはできません。"
+    if not is_admin:
+        for pattern in admin:
+            if re.search(pattern, text, re.IGNORECASE):
+                return False, "その言葉（管理人の名前）は使用できません。"
+        if check_reserved:
+            for word in reserved:
+                if word in text:
+                    return False, f"「{word}」を含む種火は、管理人が使用するため予約されています。"
+    return True, None
+
+
+def random_text(rng, length):
+    return ''.join(rng.choice(SAMPLE_CHARS) for _ in range(length))
+
+
+def timeit(func, texts, repeat=5):
+    """一番速かった回の、1件あたりのマイクロ秒"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            func(text)
+        best = min(best, time.perf_counter() - start)
+    return best / len(texts) * 1e6
+
+
+def run(num_texts=200, text_length=2000, extra_words=3000, seed=42):
+    rng = random.Random(seed)
+    texts = [random_text(rng, text_length) for _ in range(num_texts)]
+
+    results = {}
+
+    # 1. 現在のリストそのまま（本文チェック相当）
+    results['builtin/legacy'] = timeit(lambda t: legacy_check_text_safety(t, check_reserved=True), texts)
+    results['builtin/automaton'] = timeit(lambda t: check_text_safety(t, check_reserved=True), texts)
+
+    # 2. 数千語に増やした場合
+    big_general = list(ng_words.GENERAL_NG_WORDS) + [random_text(rng, rng.randint(3, 6)) + 'ぞ' for _ in range(extra_words)]
+    big_reserved = list(ng_words.RESERVED_AIKOTOBA_WORDS) + [f"official_{i}" for i in range(extra_words)]
+    results[f'+{extra_words}words/legacy'] = timeit(
+        lambda t: legacy_check_text_safety(t, check_reserved=True, general=big_general, reserved=big_reserved), texts)
+
+    start = time.perf_counter()
+    matcher = NGWordMatcher({
+        'general': big_general,
+        'admin': ng_words.ADMIN_EXCLUSIVE_PATTERNS,
+        'reserved': big_reserved,
+    })
+    build_ms = (time.perf_counter() - start) * 1000
+    results[f'+{extra_words}words/automaton'] = timeit(lambda t: matcher.find(t, categories=('general',)), texts)
+
+    return results, build_ms
+
+
+def main():
+    results, build_ms = run()
+    print(f"{'case':<28}{'us/text':>12}")
+    for name, micros in results.items():
+        print(f"{name:<28}{micros:>12.1f}")
+    print(f"automaton build time (large list): {build_ms:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, func
+
+from app.extensions import db, post_limiter
+from app.models import Diary
+
+"""
+ホットパスの計測ハーネス
+テストクライアントで main.index / main.search（管理者・一般）/ post.write を繰り返し叩き、
+レイテンシの p50/p95/p99 と、1リクエストあたりのSQL発行数をJSONに残します。
+コミット間で同じコマンドを流して、結果を compare で比べてください。
+
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks run --label sqlite
+    DATABASE_URL=postgresql://localhost/yotakibi_bench python -m benchmarks run --label postgres
+    python -m benchmarks compare benchmarks/results/a.json benchmarks/results/b.json
+"""
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+# 深いページの計測で使う、しおりの数
+DEEP_CURSORS = 100
+
+
+class QueryCounter:
+    """エンジンに発行されたSQLの数を数える"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _client(app, admin=False):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        # 営業時間外でも計測できるよう、一般客は「関係者」として入る
+        if admin:
+            sess['is_admin'] = True
+        else:
+            sess['debug_visitor'] = True
+    return client
+
+
+def _scenarios(app, rng):
+    """(名前, クライアント, リクエストを作る関数) の一覧"""
+    public = _client(app)
+    admin = _client(app, admin=True)
+    writer = _client(app)
+
+    newest = db.session.query(func.max(Diary.id)).scalar() or 0
+    popular = db.session.query(Diary.aikotoba).filter(Diary.aikotoba == '管理人').limit(1).scalar() or 'おやすみ'
+
+    # 深いページのしおりは、計測（SQLの数え上げ）の外で先に作っておく
+    from app.pagination import encode_cursor
+    picked = {rng.randint(1, max(newest, 1)) for _ in range(DEEP_CURSORS)}
+    deep_cursors = [
+        encode_cursor(created_at, diary_id)
+        for diary_id, created_at in db.session.query(Diary.id, Diary.created_at).filter(Diary.id.in_(picked))
+    ]
+
+    def index_first():
+        return public.get('/')
+
+    def index_deep():
+        # 深いページ：適当な既存日記の位置から「次の夜」をたどる
+        if not deep_cursors:
+            return public.get('/')
+        return public.get('/', query_string={'before': rng.choice(deep_cursors)})
+
+    def search_public():
+        return public.get('/search', query_string={'q': popular})
+
+    def search_admin():
+        return admin.get('/search', query_string={'q': rng.choice(['ラーメン', '月がきれい', '猫に会った', 'ココア'])})
+
+    def write():
+        return writer.post('/write', data={
+            'content': f"計測用の薪です。{rng.random()}",
+            'aikotoba': f"bench{rng.randint(1, 10 ** 6)}",
+        })
+
+    return [
+        ('main.index', index_first),
+        ('main.index (deep cursor)', index_deep),
+        ('main.search (public)', search_public),
+        ('main.search (admin)', search_admin),
+        ('post.write', write),
+    ]
+
+
+def run_benchmarks(app, iterations=200, warmup=20, seed=0):
+    """各シナリオを計測し、結果の dict を返す（app context 内で呼ぶ）"""
+    rng = random.Random(seed)
+    app.config['WTF_CSRF_ENABLED'] = False
+    # 計測中は連投制限に引っかからないように
+    post_limiter.limit = 10 ** 9
+
+    results = {}
+    for name, request_func in _scenarios(app, rng):
+        for _ in range(warmup):
+            request_func().close()
+
+        latencies = []
+        queries = 0
+        statuses = {}
+        with QueryCounter(db.engine) as counter:
+            for _ in range(iterations):
+                before = counter.count
+                started = time.perf_counter()
+                response = request_func()
+                latencies.append((time.perf_counter() - started) * 1000)
+                # 受け付け制限（AdmissionControlMiddleware）の処理中の数を戻す
+                response.close()
+                queries += counter.count - before
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        db.session.remove()
+
+        latencies.sort()
+        results[name] = {
+            'iterations': iterations,
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'queries_per_request': round(queries / iterations, 2),
+            'statuses': {str(k): v for k, v in statuses.items()},
+        }
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.command('run')
+@click.option('--iterations', default=200, show_default=True)
+@click.option('--warmup', default=20, show_default=True)
+@click.option('--label', default=None, help='結果ファイルにつける名前（例: sqlite, postgres）')
+@click.option('--output', default=None, help='結果JSONの保存先（未指定なら benchmarks/results/ 配下）')
+@with_appcontext
+def run_command(iterations, warmup, label, output):
+    """ホットパスを計測して、結果をJSONに保存する"""
+    app = current_app._get_current_object()
+    report = {
+        'label': label,
+        'git_revision': _git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'database': db.engine.dialect.name,
+        'diary_rows': db.session.query(func.count(Diary.id)).scalar(),
+        'python': platform.python_version(),
+        'scenarios': run_benchmarks(app, iterations=iterations, warmup=warmup),
+    }
+
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        name = '-'.join(filter(None, [datetime.now().strftime('%Y%m%d-%H%M%S'), report['git_revision'], label]))
+        output = os.path.join(RESULTS_DIR, f"{name}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    click.echo(f"{'scenario':<28}{'p50':>9}{'p95':>9}{'p99':>9}{'queries':>9}")
+    for name, r in report['scenarios'].items():
+        click.echo(f"{name:<28}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['queries_per_request']:>9.1f}")
+    click.echo(f"saved: {output}")
+
+
+@click.command('compare')
+@click.argument('baseline', type=click.Path(exists=True))
+@click.argument('current', type=click.Path(exists=True))
+def compare_command(baseline, current):
+    """2つの計測結果を並べ、p95 とSQL数の差を表示する"""
+    with open(baseline, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(current, encoding='utf-8') as f:
+        new = json.load(f)
+
+    click.echo(f"{old.get('git_revision')} ({old.get('database')}) -> {new.get('git_revision')} ({new.get('database')})")
+    click.echo(f"{'scenario':<28}{'p95 old':>10}{'p95 new':>10}{'change':>9}{'queries':>12}")
+    for name, r in new['scenarios'].items():
+        before = old['scenarios'].get(name)
+        if before is None:
+            click.echo(f"{name:<28}{'-':>10}{r['p95_ms']:>10.2f}{'new':>9}")
+            continue
+        change = (r['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+        click.echo(
+            f"{name:<28}{before['p95_ms']:>10.2f}{r['p95_ms']:>10.2f}{change:>+8.1f}%"
+            f"{before['queries_per_request']:>6.1f}->{r['queries_per_request']:<5.1f}"
+        )
@@ -0,0 +1,116 @@
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import insert
+
+from app.extensions import db
+from app.models import Diary
+from app.utils import get_ip_hash, hash_aikotoba, derive_content_fields
+
+"""
+計測用の大量データ投入
+本物らしい日本語の日記・種火の偏り・消火済みの割合で、数百万行を手早く入れます。
+
+    DATABASE_URL=... python -m benchmarks seed-diaries --count 1000000
+"""
+
+OPENINGS = [
+    "今日は", "さっき", "帰り道、", "仕事終わりに", "夜になって", "久しぶりに", "なんとなく",
+    "雨の中、", "コンビニで", "寝る前に", "電車の中で", "休みの日なのに",
+]
+MIDDLES = [
+    "月がきれいだった", "ラーメンを食べた", "昔の友達のことを思い出した", "少しだけ泣いた",
+    "猫に会った", "散歩をした", "本を一冊読み終えた", "ココアを飲んだ", "部屋の掃除をした",
+    "上司に褒められた", "失敗してしまった", "好きな曲をずっと聴いていた", "星を数えた",
+]
+ENDINGS = [
+    "。", "。明日もがんばろう。", "。おやすみなさい。", "。なんだか疲れた。", "。悪くない夜だ。",
+    "。\nまた明日。", "。誰かに話したかった。", "。火にあたって温まろう。",
+]
+
+# 種火の語彙。先頭ほどよく使われる（Zipf風の偏り）
+AIKOTOBA_WORDS = [
+    "管理人", "おやすみ", "月", "ねこ", "雨の匂い", "midnight_blue", "ココア", "星屑", "1998年の夏",
+    "焚き火", "しずく", "夜更かし", "ひとりごと", "帰り道", "MeltingIce", "ゆず", "海", "灯り",
+]
+
+
+def make_content(rng):
+    parts = [rng.choice(OPENINGS) + rng.choice(MIDDLES) + rng.choice(ENDINGS)]
+    # たまに長い日記（折りたたみ表示の対象）を混ぜる
+    while rng.random() < 0.35:
+        parts.append(rng.choice(OPENINGS) + rng.choice(MIDDLES) + rng.choice(ENDINGS))
+    return ''.join(parts)
+
+
+def make_aikotoba(rng, weights):
+    word = rng.choices(AIKOTOBA_WORDS, weights=weights)[0]
+    # 半分くらいは自分だけの種火（ほぼ一意）
+    if rng.random() < 0.5:
+        word = f"{word}{rng.randint(1, 99999)}"
+    return word[:30]
+
+
+def generate_rows(count, days, hidden_ratio, seed=0, ip_pool=5000):
+    """日記の行（dict）を count 件つくるジェネレーター。夜（19:00〜25:00）に散らばる"""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(AIKOTOBA_WORDS))]
+    start_night = datetime.now().replace(hour=19, minute=0, second=0, microsecond=0) - timedelta(days=days)
+    night_seconds = 6 * 3600
+    ip_hashes = [get_ip_hash(f"10.0.{i // 256}.{i % 256}") for i in range(ip_pool)]
+
+    for i in range(count):
+        night = start_night + timedelta(days=(i * days) // max(count, 1))
+        created_at = night + timedelta(seconds=rng.randrange(night_seconds))
+        aikotoba = make_aikotoba(rng, weights)
+        content = make_content(rng)
+        yield {
+            'uuid': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            'content': content,
+            **derive_content_fields(content),
+            'aikotoba': aikotoba,
+            'aikotoba_hash': hash_aikotoba(aikotoba),
+            'is_hidden': rng.random() < hidden_ratio,
+            'ip_hash': rng.choice(ip_hashes),
+            'user_agent': 'Yotakibi Bench/1.0',
+            'created_at': created_at,
+            'updated_at': created_at,
+        }
+
+
+def seed_diaries(count, batch_size=5000, days=365, hidden_ratio=0.03, seed=0, echo=print):
+    """まとめて複数行INSERTで投入する。投入した件数を返す"""
+    started = time.perf_counter()
+    batch = []
+    inserted = 0
+    for row in generate_rows(count, days, hidden_ratio, seed=seed):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db.session.execute(insert(Diary.__table__), batch)
+            db.session.commit()
+            inserted += len(batch)
+            batch = []
+            elapsed = time.perf_counter() - started
+            echo(f"{inserted:>10} rows  ({inserted / elapsed:,.0f} rows/s)")
+    if batch:
+        db.session.execute(insert(Diary.__table__), batch)
+        db.session.commit()
+        inserted += len(batch)
+    echo(f"done: {inserted} rows in {time.perf_counter() - started:.1f}s")
+    return inserted
+
+
+@click.command('seed-diaries')
+@click.option('--count', default=100000, show_default=True, help='投入する日記の件数')
+@click.option('--batch-size', default=5000, show_default=True, help='1回のINSERTで入れる件数')
+@click.option('--days', default=365, show_default=True, help='何夜ぶんに散らばらせるか')
+@click.option('--hidden-ratio', default=0.03, show_default=True, help='消火済みにする割合')
+@click.option('--seed', default=0, show_default=True, help='乱数の種（同じ値なら同じデータ）')
+@with_appcontext
+def seed_command(count, batch_size, days, hidden_ratio, seed):
+    """計測用の日記を大量に投入する"""
+    seed_diaries(count, batch_size=batch_size, days=days, hidden_ratio=hidden_ratio, seed=seed, echo=click.echo)
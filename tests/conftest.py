@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# 設定はインポートした時点で環境変数から読まれるので、app を読む前に置き場を一時ディレクトリへ向ける
+# （手元の yotakibi.db や instance/ を汚さない）
+_TMP = tempfile.mkdtemp(prefix='yotakibi-test-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_TMP, 'yotakibi.db')}"
+for _name, _path in {
+    'WRITE_QUEUE_PATH': 'write_queue.sqlite3',
+    'TIMELINE_CACHE_PATH': 'timeline_cache.sqlite3',
+    'RATE_LIMIT_PATH': 'rate_limit.sqlite3',
+    'METRICS_DIR': 'metrics',
+    'ASSETS_DIR': 'assets',
+    'SNAPSHOT_DIR': 'snapshots',
+    'COLD_STORAGE_PATH': 'archive.sqlite3',
+    'BOT_LOCK_PATH': 'firekeeper.lock',
+    'PROFILE_DIR': 'profiles',
+}.items():
+    os.environ[_name] = os.path.join(_TMP, _path)
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    yield app
+    shutil.rmtree(_TMP, ignore_errors=True)
+
+
+@pytest.fixture
+def visitor(app):
+    """営業時間外でも書けるよう「関係者」として入るクライアント"""
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['debug_visitor'] = True
+    return client